@@ -2,22 +2,44 @@ import sys
 import os
 import sqlite3
 import re
+import csv
+import gzip
+import json
+import zlib
+import hashlib
+import unicodedata
+import uuid
 import datetime
+import time
+import queue
+import pathlib
+import threading
 import traceback
+import tracemalloc
+import collections
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # --- BLOCO DE PROTEÇÃO DE IMPORTAÇÃO ---
 try:
-    from PyQt6.QtCore import Qt, QUrl, QTimer, QSettings, QSize, pyqtSignal, QMimeData
+    from PyQt6.QtCore import (
+        Qt, QUrl, QTimer, QSettings, QSize, pyqtSignal, QMimeData, QObject, QThread, QDate,
+        QStandardPaths, QEvent, QProcess
+    )
     from PyQt6.QtWidgets import (
         QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
         QLineEdit, QPushButton, QLabel, QSplitter, QTextEdit, QTextBrowser, QGroupBox,
         QStackedWidget, QTabBar, QMessageBox, QDialog, QFileDialog, QFrame,
-        QRadioButton, QButtonGroup
+        QRadioButton, QButtonGroup, QDateEdit, QComboBox, QProgressBar, QCheckBox,
+        QFormLayout, QSpinBox
     )
-    from PyQt6.QtGui import QPixmap, QFont, QIcon, QAction, QImage
+    from PyQt6.QtGui import QPixmap, QFont, QIcon, QAction, QImage, QPainter, QColor, QPalette
     from PyQt6.QtMultimedia import QCamera, QMediaCaptureSession, QVideoSink, QMediaDevices
     from PyQt6.QtWebEngineWidgets import QWebEngineView
-    from PyQt6.QtWebEngineCore import QWebEngineSettings, QWebEnginePage, QWebEngineProfile
+    from PyQt6.QtWebEngineCore import (
+        QWebEngineSettings, QWebEnginePage, QWebEngineProfile,
+        QWebEngineUrlRequestInterceptor, QWebEngineUrlRequestInfo
+    )
     import qrcode
     from PIL.ImageQt import ImageQt
 except ImportError as e:
@@ -30,6 +52,32 @@ except ImportError as e:
     print("="*60 + "\n")
     sys.exit(1)
 
+# Dependência opcional: usada apenas para medir a memória dos processos de renderização
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Dependência opcional: exportação em formato colunar (Parquet)
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Dependência opcional: cofre de senhas do sistema operacional
+try:
+    import keyring
+except ImportError:
+    keyring = None
+
+def pasta_dados_app(*subpastas):
+    """Pasta local do aplicativo (credenciais, relatórios, amostras), criada sob demanda"""
+    base = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.GenericDataLocation)
+    caminho = os.path.join(base, "PortariaVirtual", *subpastas)
+    os.makedirs(caminho, exist_ok=True)
+    return caminho
+
 # --- CLASSE CUSTOMIZADA PARA NAVEGAÇÃO COM ABAS ---
 class CustomWebPage(QWebEnginePage):
     """
@@ -51,6 +99,1041 @@ class CustomWebPage(QWebEnginePage):
         new_view = self.browser_window.add_new_tab(QUrl(""), "Nova Guia", profile=current_profile)
         return new_view.page()
 
+# --- NOVA CLASSE: INTERCEPTADOR DE REQUISIÇÕES DO WORKER ---
+class InterceptadorWorker(QWebEngineUrlRequestInterceptor):
+    """
+    Bloqueia no worker os recursos que não contribuem para o texto da página
+    (imagens, fontes, mídia, telemetria) e tudo que venha de hosts de terceiros.
+    """
+    DOMINIO_PORTAL = "governarti.com.br"
+
+    _T = QWebEngineUrlRequestInfo.ResourceType
+    TIPOS_BLOQUEADOS = {
+        _T.ResourceTypeImage, _T.ResourceTypeFontResource, _T.ResourceTypeMedia,
+        _T.ResourceTypeFavicon, _T.ResourceTypePing, _T.ResourceTypePrefetch,
+        _T.ResourceTypeObject, _T.ResourceTypePluginResource, _T.ResourceTypeCspReport,
+    }
+    # Tamanho médio de cada tipo bloqueado; serve apenas para estimar a economia
+    TAMANHO_ESTIMADO = {
+        _T.ResourceTypeImage: 30 * 1024,
+        _T.ResourceTypeFontResource: 40 * 1024,
+        _T.ResourceTypeMedia: 200 * 1024,
+        _T.ResourceTypeScript: 50 * 1024,
+        _T.ResourceTypeStylesheet: 20 * 1024,
+    }
+    del _T
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.reiniciar_contagem()
+
+    def reiniciar_contagem(self):
+        self.bloqueios = 0
+        self.bytes_bloqueados = 0
+
+    def interceptRequest(self, info):
+        tipo = info.resourceType()
+        host = info.requestUrl().host()
+        terceiro = host != self.DOMINIO_PORTAL and not host.endswith("." + self.DOMINIO_PORTAL)
+        if tipo == QWebEngineUrlRequestInfo.ResourceType.ResourceTypeMainFrame: return
+        if tipo in self.TIPOS_BLOQUEADOS or terceiro:
+            info.block(True)
+            self.bloqueios += 1
+            self.bytes_bloqueados += self.TAMANHO_ESTIMADO.get(tipo, 2 * 1024)
+
+# --- NOVA CLASSE: GERENCIADOR DE CICLO DE VIDA DAS ABAS ---
+class GerenciadorAbas(QObject):
+    """
+    Congela ou descarta abas em segundo plano para conter o consumo de memória.
+    Abas fixas nunca são suspensas. Abas descartadas mantêm URL e título e
+    recarregam ao serem ativadas novamente.
+    """
+    PREFIXO_DESCARTADA = "💤 "
+
+    def __init__(self, browser_window):
+        super().__init__(browser_window)
+        self.browser_window = browser_window
+        settings = browser_window.settings
+        self.minutos_congelar = int(settings.value("abas/minutos_congelar", 5))
+        self.minutos_descartar = int(settings.value("abas/minutos_descartar", 20))
+        self.orcamento_mb = int(settings.value("abas/orcamento_mb", 1500))
+
+        # view -> {"fixa": bool, "ultimo_uso": float}
+        self.abas = {}
+        # Sem psutil e sem /proc (Windows) não há como medir: o orçamento fica desligado
+        self.orcamento_desativado_avisado = False
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.verificar)
+        self.timer.start(30000)
+
+    def registrar(self, view, fixa=False):
+        self.abas[view] = {"fixa": fixa, "ultimo_uso": time.monotonic()}
+
+    def remover(self, view):
+        self.abas.pop(view, None)
+
+    def marcar_uso(self, view):
+        """Aba que sai de foco: a inatividade conta a partir de agora, não da ativação"""
+        info = self.abas.get(view)
+        if info:
+            info["ultimo_uso"] = time.monotonic()
+
+    def ativar(self, view):
+        """Marca a aba como em uso e restaura a página caso esteja suspensa"""
+        info = self.abas.get(view)
+        if not info: return
+        info["ultimo_uso"] = time.monotonic()
+        page = view.page()
+        if page.lifecycleState() != QWebEnginePage.LifecycleState.Active:
+            # Uma página descartada é recarregada automaticamente ao voltar para Active
+            page.setLifecycleState(QWebEnginePage.LifecycleState.Active)
+            index = self.browser_window.web_stack.indexOf(view)
+            texto = self.browser_window.tabs.tabText(index)
+            if texto.startswith(self.PREFIXO_DESCARTADA):
+                self.browser_window.tabs.setTabText(index, texto[len(self.PREFIXO_DESCARTADA):])
+
+    def suspender(self, view, estado):
+        page = view.page()
+        if page.lifecycleState() == estado or view.isVisible(): return
+        # O Chromium só aceita Discarded a partir de Frozen
+        if estado == QWebEnginePage.LifecycleState.Discarded and page.lifecycleState() == QWebEnginePage.LifecycleState.Active:
+            page.setLifecycleState(QWebEnginePage.LifecycleState.Frozen)
+        page.setLifecycleState(estado)
+        if estado == QWebEnginePage.LifecycleState.Discarded:
+            index = self.browser_window.web_stack.indexOf(view)
+            texto = self.browser_window.tabs.tabText(index)
+            if not texto.startswith(self.PREFIXO_DESCARTADA):
+                self.browser_window.tabs.setTabText(index, self.PREFIXO_DESCARTADA + texto)
+
+    @staticmethod
+    def memoria_processo_mb(pid):
+        """Memória residente do processo de renderização em MB (None se indisponível)"""
+        if not pid: return None
+        try:
+            if psutil:
+                return psutil.Process(pid).memory_info().rss / (1024 * 1024)
+            with open(f"/proc/{pid}/status") as f:
+                for linha in f:
+                    if linha.startswith("VmRSS:"):
+                        return int(linha.split()[1]) / 1024
+        except Exception:
+            pass
+        return None
+
+    def verificar(self):
+        agora = time.monotonic()
+        estados = QWebEnginePage.LifecycleState
+        memoria_por_pid = {}
+        # Processos de abas fixas ou visíveis não podem ser liberados; ficam fora do orçamento
+        pids_protegidos = set()
+
+        for view, info in list(self.abas.items()):
+            page = view.page()
+            index = self.browser_window.web_stack.indexOf(view)
+            if index == -1:
+                self.remover(view)
+                continue
+
+            # Processos de renderização podem ser compartilhados entre abas do mesmo site
+            pid = page.renderProcessPid()
+            if pid and pid not in memoria_por_pid:
+                memoria_por_pid[pid] = self.memoria_processo_mb(pid)
+            memoria = memoria_por_pid.get(pid)
+            estado = {estados.Active: "Ativa", estados.Frozen: "Congelada", estados.Discarded: "Descartada"}.get(page.lifecycleState(), "?")
+            texto_mem = f"{memoria:.0f} MB" if memoria is not None else "N/D"
+            self.browser_window.tabs.setTabToolTip(index, f"{view.url().toString()}\nEstado: {estado}\nMemória: {texto_mem}")
+
+            if info["fixa"] or view.isVisible():
+                # Aba em uso agora: a contagem de inatividade começa quando ela sair de foco
+                info["ultimo_uso"] = agora
+                pids_protegidos.add(pid)
+                continue
+            inativo_min = (agora - info["ultimo_uso"]) / 60
+            if inativo_min >= self.minutos_descartar:
+                self.suspender(view, estados.Discarded)
+            elif inativo_min >= self.minutos_congelar:
+                self.suspender(view, estados.Frozen)
+
+        # Acima do orçamento: descarta as abas usadas há mais tempo primeiro
+        if memoria_por_pid and all(m is None for m in memoria_por_pid.values()):
+            if not self.orcamento_desativado_avisado:
+                self.orcamento_desativado_avisado = True
+                self.browser_window.registrar("⚠️ Memória das abas indisponível (instale o psutil): orçamento de memória desativado.")
+            return
+        for pid in pids_protegidos:
+            memoria_por_pid.pop(pid, None)
+        total = sum(m for m in memoria_por_pid.values() if m)
+        if total <= self.orcamento_mb: return
+        candidatas = sorted(
+            (v for v, i in self.abas.items() if not i["fixa"] and not v.isVisible()
+             and v.page().lifecycleState() != estados.Discarded and v.page().renderProcessPid() not in pids_protegidos),
+            key=lambda v: self.abas[v]["ultimo_uso"]
+        )
+        for view in candidatas:
+            if total <= self.orcamento_mb: break
+            memoria = memoria_por_pid.pop(view.page().renderProcessPid(), None)
+            self.suspender(view, estados.Discarded)
+            total -= memoria or 0
+
+# --- NOVA CLASSE: COFRE DE CREDENCIAIS ---
+class CofreCredenciais:
+    """
+    Guarda usuário e senha do portal fora do código-fonte: no cofre do sistema
+    (keyring) quando disponível; senão em arquivo local cifrado com DPAPI no
+    Windows ou, nos demais sistemas, legível apenas pelo próprio usuário.
+    """
+    SERVICO = "PortariaApps.MonitorVisitas"
+
+    def __init__(self):
+        self.caminho = os.path.join(pasta_dados_app(), "credenciais.bin")
+
+    def salvar(self, usuario, senha):
+        dados = json.dumps({"usuario": usuario, "senha": senha}).encode("utf-8")
+        if keyring:
+            keyring.set_password(self.SERVICO, "portal", dados.decode("utf-8"))
+            return
+        if sys.platform == "win32":
+            dados = self._dpapi(dados, proteger=True)
+        fd = os.open(self.caminho, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(dados)
+
+    def carregar(self):
+        """Retorna (usuario, senha) ou (None, None) se nada foi cadastrado"""
+        try:
+            if keyring:
+                dados = keyring.get_password(self.SERVICO, "portal")
+                dados = dados.encode("utf-8") if dados else None
+            elif os.path.exists(self.caminho):
+                with open(self.caminho, "rb") as f:
+                    dados = f.read()
+                if sys.platform == "win32":
+                    dados = self._dpapi(dados, proteger=False)
+            else:
+                dados = None
+            if not dados: return None, None
+            cred = json.loads(dados.decode("utf-8"))
+            return cred.get("usuario"), cred.get("senha")
+        except Exception as e:
+            print(f"❌ Erro ao ler credenciais: {e}")
+            return None, None
+
+    @staticmethod
+    def _dpapi(dados, proteger):
+        """Cifra/decifra com a DPAPI do Windows (vinculada à conta do usuário)"""
+        import ctypes
+        from ctypes import wintypes
+
+        class DATA_BLOB(ctypes.Structure):
+            _fields_ = [("cbData", wintypes.DWORD), ("pbData", ctypes.POINTER(ctypes.c_char))]
+
+        buffer = ctypes.create_string_buffer(dados, len(dados))
+        entrada = DATA_BLOB(len(dados), ctypes.cast(buffer, ctypes.POINTER(ctypes.c_char)))
+        saida = DATA_BLOB()
+        crypt32 = ctypes.windll.crypt32
+        funcao = crypt32.CryptProtectData if proteger else crypt32.CryptUnprotectData
+        if not funcao(ctypes.byref(entrada), None, None, None, None, 0, ctypes.byref(saida)):
+            raise OSError("Falha na DPAPI ao acessar as credenciais")
+        try:
+            return ctypes.string_at(saida.pbData, saida.cbData)
+        finally:
+            ctypes.windll.kernel32.LocalFree(saida.pbData)
+
+# --- NOVA CLASSE: GERENCIADOR DE SESSÃO DO PORTAL ---
+class GerenciadorSessao(QObject):
+    """
+    Mantém uma única sessão autenticada para todos os navegadores do portal.
+    Os cookies ficam persistidos nos perfis nomeados e são replicados entre
+    eles; quando a sessão está para expirar (ou um worker cai no login) a
+    renovação é feita uma só vez, num navegador oculto, e os demais aguardam
+    o sinal sessao_renovada.
+    """
+    sessao_renovada = pyqtSignal()
+    sessao_falhou = pyqtSignal(str)
+
+    DOMINIO_PORTAL = "governarti.com.br"
+    URL_PORTAL = "https://portaria-global.governarti.com.br/visita/"
+    MARGEM_EXPIRACAO_S = 300
+    # Só os cookies de sessão/autenticação importam para a expiração; cookies
+    # auxiliares de vida curta (preferências, telemetria) não pedem novo login
+    TRECHOS_COOKIE_SESSAO = ("sess", "auth", "token", "jwt")
+    # Intervalo mínimo entre renovações preventivas
+    INTERVALO_RENOVACAO_S = 600
+
+    JS_LOGIN = """
+    (function(usuario, senha, enviar) {
+        var setter = Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set;
+        document.querySelectorAll('input').forEach(function(i) {
+            var valor = i.type == 'password' ? senha : ((i.type == 'text' || i.type == 'email') ? usuario : null);
+            if (valor === null) return;
+            setter.call(i, valor);
+            i.dispatchEvent(new Event('input', {bubbles: true}));
+        });
+        if (!enviar) return;
+        var botao = document.querySelector('button[type=submit], input[type=submit], form button');
+        if (botao) botao.click();
+        else if (document.forms.length) document.forms[0].submit();
+    })(%s, %s, %s);
+    """
+
+    def __init__(self, dono, perfis):
+        # `dono` é a janela ou o MotorCaptura do processo filho: só precisa de registrar()
+        super().__init__(dono)
+        self.dono = dono
+        self.perfis = perfis
+        self.cofre = CofreCredenciais()
+        self.renovando = False
+        self.login_enviado = False
+        self.expiracoes = {}
+        self.copiados = set()
+        self.ultima_renovacao_preventiva = 0
+
+        for perfil in perfis:
+            # Cookies de sessão também vão para o disco e sobrevivem ao reinício
+            perfil.setPersistentCookiesPolicy(QWebEngineProfile.PersistentCookiesPolicy.ForcePersistentCookies)
+            loja = perfil.cookieStore()
+            loja.cookieAdded.connect(lambda c, origem=perfil: self.on_cookie_adicionado(c, origem))
+            loja.cookieRemoved.connect(self.on_cookie_removido)
+            loja.loadAllCookies()
+
+        self.view = QWebEngineView()
+        self.view.setVisible(False)
+        self.view.setPage(QWebEnginePage(perfis[-1], self.view))
+        self.view.loadFinished.connect(self.on_load_finished)
+
+        self.timer_limite = QTimer(self)
+        self.timer_limite.setSingleShot(True)
+        self.timer_limite.timeout.connect(lambda: self.finalizar(False, "Tempo esgotado ao renovar a sessão."))
+
+        self.timer_expiracao = QTimer(self)
+        self.timer_expiracao.timeout.connect(self.verificar_expiracao)
+        self.timer_expiracao.start(60000)
+
+    def eh_cookie_portal(self, cookie):
+        dominio = cookie.domain().lstrip(".")
+        return dominio == self.DOMINIO_PORTAL or dominio.endswith("." + self.DOMINIO_PORTAL)
+
+    def on_cookie_adicionado(self, cookie, origem):
+        if not self.eh_cookie_portal(cookie): return
+        nome = bytes(cookie.name()).decode("latin-1")
+        if not cookie.isSessionCookie() and any(t in nome.lower() for t in self.TRECHOS_COOKIE_SESSAO):
+            self.expiracoes[nome] = cookie.expirationDate().toSecsSinceEpoch()
+
+        # Replica para os demais perfis; a assinatura evita o eco de volta
+        assinatura = (cookie.domain(), nome, cookie.path(), bytes(cookie.value()))
+        if assinatura in self.copiados:
+            self.copiados.discard(assinatura)
+            return
+        for perfil in self.perfis:
+            if perfil is origem: continue
+            self.copiados.add(assinatura)
+            perfil.cookieStore().setCookie(cookie, QUrl(self.URL_PORTAL))
+
+    def on_cookie_removido(self, cookie):
+        if self.eh_cookie_portal(cookie):
+            self.expiracoes.pop(bytes(cookie.name()).decode("latin-1"), None)
+
+    def verificar_expiracao(self):
+        agora = time.time()
+        # Cookies já vencidos não contam: o navegador os descarta e o login, se
+        # necessário, é detectado pelos workers
+        for nome in [n for n, fim in self.expiracoes.items() if fim <= agora]:
+            del self.expiracoes[nome]
+        if not self.expiracoes or self.renovando: return
+        if agora - self.ultima_renovacao_preventiva < self.INTERVALO_RENOVACAO_S: return
+        restante = min(self.expiracoes.values()) - agora
+        if restante < self.MARGEM_EXPIRACAO_S:
+            self.ultima_renovacao_preventiva = agora
+            self.dono.registrar("🔑 Sessão do portal perto de expirar. Renovando...")
+            self.renovar()
+
+    def script_login(self, enviar):
+        usuario, senha = self.cofre.carregar()
+        if not usuario: return None
+        return self.JS_LOGIN % (json.dumps(usuario), json.dumps(senha), "true" if enviar else "false")
+
+    def preencher_login(self, view):
+        """Preenche (sem enviar) o formulário de login de uma aba interativa"""
+        js = self.script_login(enviar=False)
+        if js: view.page().runJavaScript(js)
+
+    def renovar(self):
+        """Renova a sessão uma única vez, mesmo que vários workers peçam ao mesmo tempo"""
+        if self.renovando: return
+        usuario, _ = self.cofre.carregar()
+        if not usuario:
+            self.sessao_falhou.emit("Credenciais do portal não cadastradas (Configurações > Acesso ao Portal).")
+            return
+        self.renovando = True
+        self.login_enviado = False
+        self.timer_limite.start(30000)
+        # Acessar o portal já prolonga sessões deslizantes; se cair no login, autentica
+        self.view.setUrl(QUrl(self.URL_PORTAL))
+
+    def on_load_finished(self, ok):
+        if not self.renovando: return
+        url = self.view.url().toString()
+        if "/login" not in url:
+            self.finalizar(True)
+        elif self.login_enviado:
+            self.finalizar(False, "O portal recusou as credenciais cadastradas.")
+        else:
+            self.login_enviado = True
+            self.view.page().runJavaScript(self.script_login(enviar=True))
+
+    def finalizar(self, sucesso, motivo=""):
+        if not self.renovando: return
+        self.renovando = False
+        self.timer_limite.stop()
+        if sucesso:
+            self.dono.registrar("🔑 Sessão do portal renovada.")
+            self.sessao_renovada.emit()
+        else:
+            self.dono.registrar(f"❌ {motivo}")
+            self.sessao_falhou.emit(motivo)
+
+# --- NOVA CLASSE: REVALIDAÇÃO DE VISITAS JÁ CAPTURADAS ---
+class AgendadorRevalidacao(QObject):
+    """
+    Revisita no portal, em ritmo configurável, as visitas ainda válidas ou que
+    começam em breve, para captar prorrogações e cancelamentos. Usa um worker
+    próprio com o mesmo perfil do worker de captura (cookies e cache) e
+    interceptador próprio.
+    """
+    LIMITE_CARGA_MS = 45000
+    # Após falha ao renovar a sessão, o ciclo normal espera antes de voltar ao portal
+    PAUSA_APOS_FALHA_S = 300
+
+    def __init__(self, motor):
+        super().__init__(motor)
+        self.motor = motor
+        self.ultimo_id = 0
+        self.visita_em_andamento = None
+        # Pedidos vindos da tela de detalhes passam na frente do ciclo normal
+        self.prioridade = collections.deque()
+        self.prioritaria = False
+        self.aguardando_sessao = False
+        self.retomar_em = 0
+
+        self.view = QWebEngineView()
+        self.view.setVisible(False)
+        self.view.setPage(QWebEnginePage(motor.perfil_worker, self.view))
+        self.view.settings().setAttribute(QWebEngineSettings.WebAttribute.AutoLoadImages, False)
+        self.interceptador = InterceptadorWorker(self)
+        self.view.page().setUrlRequestInterceptor(self.interceptador)
+        self.view.loadFinished.connect(self.on_load_finished)
+
+        # Sem loadFinished ou sem retorno do runJavaScript (navegação interrompida,
+        # renderizador caído) a visita em andamento seria esperada para sempre
+        self.timer_limite = QTimer(self)
+        self.timer_limite.setSingleShot(True)
+        self.timer_limite.timeout.connect(self.carga_esgotada)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.revalidar_proxima)
+        self.configurar_ritmo(int(motor.settings.value("revalidacao/por_minuto", 2)))
+        motor.sessao.sessao_renovada.connect(self.retomar_apos_sessao)
+        motor.sessao.sessao_falhou.connect(self.falha_sessao)
+
+    def configurar_ritmo(self, por_minuto):
+        """Revalidações por minuto; 0 desativa"""
+        self.timer.stop()
+        if por_minuto > 0:
+            self.timer.start(int(60000 / por_minuto))
+
+    def revalidar_agora(self, visita_id):
+        """Enfileira com prioridade; não depende da captura estar ligada"""
+        if visita_id not in self.prioridade:
+            self.prioridade.append(visita_id)
+        self.revalidar_proxima()
+
+    def revalidar_proxima(self):
+        motor = self.motor
+        if not motor.db or self.visita_em_andamento or self.aguardando_sessao: return
+        if self.prioridade:
+            self.carregar_visita(self.prioridade.popleft(), prioritaria=True)
+            return
+        if not motor.rodando or time.monotonic() < self.retomar_em: return
+        visita_id = motor.db.proxima_para_revalidar(self.ultimo_id)
+        if visita_id is None:
+            # Fim da lista: recomeça do início no próximo ciclo
+            self.ultimo_id = 0
+            return
+        self.ultimo_id = visita_id
+        self.carregar_visita(visita_id)
+
+    def carregar_visita(self, visita_id, prioritaria=False):
+        self.visita_em_andamento = visita_id
+        self.prioritaria = prioritaria
+        self.timer_limite.start(self.LIMITE_CARGA_MS)
+        self.view.setUrl(QUrl(f"https://portaria-global.governarti.com.br/visita/{visita_id}/detalhes?t={datetime.datetime.now().timestamp()}"))
+
+    def on_load_finished(self, ok):
+        if self.visita_em_andamento:
+            QTimer.singleShot(800, lambda: self.view.page().runJavaScript("document.body.innerText;", self.callback_revalidacao))
+
+    def carga_esgotada(self):
+        visita_id, self.visita_em_andamento = self.visita_em_andamento, None
+        if not visita_id: return
+        self.view.stop()
+        self.motor.registrar(f"⚠️ Revalidação do ID {visita_id} sem resposta do portal; seguindo para a próxima.")
+        if self.prioritaria and self.motor.db:
+            self.motor.eventos.publicar("visita_revalidada", {"visita_id": visita_id, "resultado": False})
+
+    def callback_revalidacao(self, conteudo):
+        self.timer_limite.stop()
+        visita_id, self.visita_em_andamento = self.visita_em_andamento, None
+        motor = self.motor
+        if not visita_id or not motor.db: return
+        resultado = self.processar_conteudo(visita_id, conteudo)
+        if resultado == "sessao":
+            # Nada é recarregado até a sessão ser renovada (retomar_apos_sessao) ou falhar
+            self.aguardando_sessao = True
+            if self.prioritaria:
+                # Volta para a frente da fila e é refeita quando a sessão for renovada
+                self.prioridade.appendleft(visita_id)
+                motor.eventos.publicar("visita_revalidada", {"visita_id": visita_id, "resultado": resultado})
+            # Sem credenciais a falha é emitida na hora: só pede depois de marcar a espera
+            motor.sessao.renovar()
+            return
+        if self.prioritaria:
+            motor.eventos.publicar("visita_revalidada", {"visita_id": visita_id, "resultado": resultado})
+            QTimer.singleShot(0, self.revalidar_proxima)
+
+    def retomar_apos_sessao(self):
+        self.aguardando_sessao = False
+        self.retomar_em = 0
+        self.revalidar_proxima()
+
+    def falha_sessao(self, motivo):
+        if not self.aguardando_sessao: return
+        self.aguardando_sessao = False
+        self.retomar_em = time.monotonic() + self.PAUSA_APOS_FALHA_S
+        # Pedidos da tela de detalhes não ficam presos: são descartados com aviso
+        while self.prioridade:
+            visita_id = self.prioridade.popleft()
+            self.motor.eventos.publicar("visita_revalidada", {"visita_id": visita_id, "resultado": "sessao_falhou"})
+
+    def processar_conteudo(self, visita_id, conteudo):
+        motor = self.motor
+        if conteudo and "entrar" in conteudo.lower()[:300]:
+            return "sessao"
+        # Página vazia ou não encontrada: nada a gravar neste ciclo
+        if not conteudo: return False
+        if "não encontrada" in conteudo.lower(): return "nao_encontrada"
+
+        nome, cpf, horario = motor.db.extrair_dados(conteudo)
+        if motor.verificar_parser(visita_id, conteudo, nome, cpf, horario) == "anomala": return False
+        if nome == "Desconhecido" and cpf == "N/A": return False
+        resultado = motor.db.salvar_visita(visita_id, nome, cpf, horario, conteudo, self.view.url().toString())
+        if resultado == "alterada":
+            motor.registrar(f"♻️ ID {visita_id} revalidado: dados alterados no portal ({horario})")
+        return resultado
+
+class BaldeTokens:
+    """Limite de taxa simples: `por_minuto` fichas, acumulando no máximo `capacidade`"""
+    def __init__(self, por_minuto, capacidade=3):
+        self.capacidade = capacidade
+        self.fichas = float(capacidade)
+        self.ultimo = time.monotonic()
+        self.ajustar(por_minuto)
+
+    def ajustar(self, por_minuto):
+        self.por_segundo = max(por_minuto, 0) / 60.0
+
+    def repor(self):
+        agora = time.monotonic()
+        self.fichas = min(self.capacidade, self.fichas + (agora - self.ultimo) * self.por_segundo)
+        self.ultimo = agora
+
+    def disponivel(self):
+        self.repor()
+        return self.fichas >= 1
+
+    def consumir(self):
+        self.fichas -= 1
+
+    def espera(self):
+        """Segundos até a próxima ficha (None se a faixa está parada)"""
+        if not self.por_segundo: return None
+        return max(0.0, (1 - self.fichas) / self.por_segundo)
+
+class EscalonadorCaptura:
+    """
+    Decide qual ID o worker carrega em seguida, em duas faixas:
+
+    - ao vivo: localiza o ID mais recente emitido pelo portal (galope 1, 2, 4, 8...
+      a partir do maior ID salvo e depois bissecção) e segue a cauda, para que as
+      visitas de hoje apareçam na busca em segundos mesmo após horas parado;
+    - histórico: percorre de cima para baixo as lacunas deixadas para trás,
+      pulando IDs já gravados ou inexistentes, com a capacidade que sobra.
+
+    Cada faixa tem seu balde de fichas; o histórico é gentil no expediente e
+    agressivo fora dele. As lacunas pendentes ficam em metadados para retomar
+    depois de reiniciar.
+    """
+    ESPERA_CAUDA = 10  # segundos entre tentativas no ID seguinte ao mais recente
+    TENTATIVAS_ANTES_SONDAGEM = 6
+    SALTOS_SONDAGEM = (2, 4, 8, 16, 32)
+
+    def __init__(self, db, settings):
+        self.db = db
+        self.settings = settings
+        self.maior_salvo = db.get_maior_id_salvo()
+        self.fase = "galope"
+        self.base = self.maior_salvo
+        self.encontrado = self.maior_salvo
+        self.passo = 1
+        self.ausente = None
+        self.fronteira = None
+        self.falhas_fronteira = 0
+        self.saltos_pendentes = []
+        self.proxima_tentativa = 0.0
+        self.lacunas = json.loads(db.get_meta("captura_lacunas", "[]"))
+        self.balde_ao_vivo = BaldeTokens(0)
+        self.balde_historico = BaldeTokens(0)
+        self.aplicar_politica()
+
+    def no_expediente(self):
+        agora = datetime.datetime.now()
+        inicio, fim = (int(h) for h in str(self.settings.value("captura/expediente", "7-19")).split("-"))
+        return agora.weekday() < 5 and inicio <= agora.hour < fim
+
+    def aplicar_politica(self):
+        self.balde_ao_vivo.ajustar(int(self.settings.value("captura/ao_vivo_por_minuto", 40)))
+        if self.no_expediente():
+            self.balde_historico.ajustar(int(self.settings.value("captura/historico_expediente", 6)))
+        else:
+            self.balde_historico.ajustar(int(self.settings.value("captura/historico_fora_expediente", 60)))
+
+    def pendentes_historico(self):
+        return sum(max(0, cursor - limite) for limite, cursor in self.lacunas)
+
+    def salvar_lacunas(self):
+        self.lacunas = [l for l in self.lacunas if l[1] > l[0]]
+        self.db.set_meta("captura_lacunas", json.dumps(self.lacunas))
+
+    def candidato_ao_vivo(self):
+        if self.fase == "galope":
+            return self.base + self.passo
+        if self.fase == "bisseccao":
+            return (self.encontrado + self.ausente) // 2
+        if self.saltos_pendentes:
+            return self.fronteira + self.saltos_pendentes[0]
+        if time.monotonic() < self.proxima_tentativa: return None
+        return self.fronteira
+
+    def candidato_historico(self):
+        # Lacuna mais recente primeiro: é a que mais interessa à portaria
+        while self.lacunas:
+            lacuna = self.lacunas[-1]
+            verificados = 0
+            while lacuna[1] > lacuna[0] and verificados < 1000:
+                if not self.db.existe_visita(lacuna[1]): return lacuna[1]
+                lacuna[1] -= 1
+                verificados += 1
+            if lacuna[1] > lacuna[0]: return None
+            self.lacunas.pop()
+            self.salvar_lacunas()
+        return None
+
+    def proxima(self):
+        """(visita_id, faixa) a carregar agora, ou (None, ms) de espera"""
+        self.aplicar_politica()
+        vivo = self.candidato_ao_vivo()
+        if vivo is not None and self.balde_ao_vivo.disponivel():
+            self.balde_ao_vivo.consumir()
+            return vivo, "ao_vivo"
+        historico = self.candidato_historico()
+        if historico is not None and self.balde_historico.disponivel():
+            self.balde_historico.consumir()
+            return historico, "historico"
+
+        esperas = []
+        if vivo is None and self.fase == "cauda":
+            esperas.append(self.proxima_tentativa - time.monotonic())
+        elif vivo is not None:
+            esperas.append(self.balde_ao_vivo.espera())
+        if historico is not None:
+            esperas.append(self.balde_historico.espera())
+        esperas = [e for e in esperas if e is not None]
+        return None, int(max(0.2, min(esperas) if esperas else self.ESPERA_CAUDA) * 1000)
+
+    def registrar(self, visita_id, faixa, encontrada):
+        """Atualiza o estado da faixa; devolve uma mensagem para o log quando algo relevante muda"""
+        if faixa == "historico":
+            for lacuna in self.lacunas:
+                if lacuna[0] < visita_id <= lacuna[1]:
+                    lacuna[1] = visita_id - 1
+            self.salvar_lacunas()
+            return None
+
+        if self.fase == "galope":
+            if encontrada:
+                self.encontrado = visita_id
+                self.passo *= 2
+                return None
+            self.ausente = visita_id
+            self.fase = "bisseccao"
+        elif self.fase == "bisseccao":
+            if encontrada: self.encontrado = visita_id
+            else: self.ausente = visita_id
+        else:
+            return self.registrar_cauda(visita_id, encontrada)
+
+        if self.ausente - self.encontrado > 1: return None
+        return self.entrar_na_cauda()
+
+    def entrar_na_cauda(self):
+        mais_recente = self.encontrado
+        self.fase = "cauda"
+        self.fronteira = mais_recente + 1
+        self.falhas_fronteira = 0
+        self.saltos_pendentes = []
+        # Tudo entre o ponto de partida e o mais recente fica para o histórico
+        if mais_recente - 1 > self.base:
+            self.lacunas.append([self.base, mais_recente - 1])
+            self.salvar_lacunas()
+            return f"📍 ID mais recente no portal: {mais_recente}. {self.pendentes_historico()} IDs antigos ficam para o histórico."
+        return None
+
+    def registrar_cauda(self, visita_id, encontrada):
+        if self.saltos_pendentes:
+            self.saltos_pendentes.pop(0)
+            if not encontrada: return None
+            # Havia um buraco na numeração: os IDs pulados vão para o histórico e o galope recomeça
+            self.lacunas.append([self.fronteira - 1, visita_id - 1])
+            self.salvar_lacunas()
+            self.fase, self.base, self.encontrado, self.passo = "galope", visita_id, visita_id, 1
+            self.saltos_pendentes = []
+            return f"↪️ Numeração do portal saltou do {self.fronteira} para o {visita_id}; o intervalo vai para o histórico."
+        if encontrada:
+            self.fronteira = visita_id + 1
+            self.falhas_fronteira = 0
+            return None
+        self.falhas_fronteira += 1
+        self.proxima_tentativa = time.monotonic() + self.ESPERA_CAUDA
+        if self.falhas_fronteira % self.TENTATIVAS_ANTES_SONDAGEM == 0:
+            # Sem novidade há um tempo: confere se a numeração não pulou à frente
+            self.saltos_pendentes = list(self.SALTOS_SONDAGEM)
+        return None
+
+class MonitorParser:
+    """
+    Acompanha a saúde do extrator numa janela deslizante das últimas páginas que
+    claramente carregaram (nem vazias, nem login, nem "não encontrada"). Se a
+    maioria delas vier sem os marcadores "Visitante:"/"Horário:", ou com eles mas
+    sem nada extraível, o layout do portal provavelmente mudou: a captura deve
+    parar em vez de tratar toda página como inexistente. As páginas suspeitas
+    mais recentes ficam guardadas como amostra para testar a correção offline
+    (ver testar_amostras_parser).
+    """
+    JANELA = 30
+    MINIMO = 12
+    LIMIAR = 0.8
+    MIN_CARACTERES = 80
+    AMOSTRAS = 20
+    MARCADORES = ("visitante:", "horário:")
+
+    def __init__(self):
+        # visita_id -> anômala?; uma entrada por ID, para que as novas tentativas
+        # da mesma página estranha não contem várias vezes
+        self.janela = collections.OrderedDict()
+        self.amostras = collections.deque(maxlen=self.AMOSTRAS)
+        self.repeticoes = collections.Counter()
+
+    def reiniciar(self):
+        self.janela.clear()
+        self.amostras.clear()
+        self.repeticoes.clear()
+
+    def classificar(self, conteudo, nome, cpf, horario):
+        """(situação, motivo): "ok", "neutra" (não diz nada sobre o layout) ou "anomala" """
+        texto = (conteudo or "").strip().lower()
+        if len(texto) < self.MIN_CARACTERES or "não encontrada" in texto:
+            return "neutra", ""
+        faltando = [m for m in self.MARCADORES if m not in texto]
+        if faltando:
+            return "anomala", "sem o marcador " + " / ".join(f'"{m}"' for m in faltando)
+        if nome == "Desconhecido" and cpf == "N/A":
+            return "anomala", "marcadores presentes, mas nome e CPF não extraídos"
+        if horario == "N/A":
+            return "anomala", "marcadores presentes, mas validade não extraída"
+        return "ok", ""
+
+    def registrar(self, visita_id, conteudo, nome, cpf, horario):
+        situacao, motivo = self.classificar(conteudo, nome, cpf, horario)
+        if situacao == "neutra": return situacao
+        repetida = visita_id in self.janela
+        self.janela[visita_id] = situacao == "anomala"
+        self.janela.move_to_end(visita_id)
+        if len(self.janela) > self.JANELA:
+            self.janela.popitem(last=False)
+        if situacao == "anomala":
+            self.repeticoes[visita_id] += 1
+            if not repetida:
+                self.amostras.append((visita_id, motivo, conteudo))
+        else:
+            self.repeticoes.pop(visita_id, None)
+        return situacao
+
+    def taxa_falhas(self):
+        return sum(self.janela.values()) / len(self.janela) if self.janela else 0.0
+
+    def deriva_detectada(self):
+        return len(self.janela) >= self.MINIMO and self.taxa_falhas() >= self.LIMIAR
+
+    def salvar_amostras(self):
+        """Grava as amostras numa pasta nova e devolve o caminho"""
+        pasta = pasta_dados_app("amostras_parser", datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+        with open(os.path.join(pasta, "resumo.txt"), "w", encoding="utf-8") as f:
+            f.write(f"Falhas na janela: {sum(self.janela.values())} de {len(self.janela)} páginas carregadas\n\n")
+            for visita_id, motivo, conteudo in self.amostras:
+                f.write(f"ID {visita_id}: {motivo}\n")
+                with open(os.path.join(pasta, f"{visita_id}.txt"), "w", encoding="utf-8") as amostra:
+                    amostra.write(conteudo)
+        return pasta
+
+class Perfilador(QObject):
+    """
+    Modo de diagnóstico para quando a estação fica lenta. Enquanto ativo:
+
+    - uma thread amostra as pilhas de todas as threads (sys._current_frames) e
+      acumula pilhas no formato "collapsed" (compatível com flamegraph);
+    - um batimento de 50 ms na thread da interface detecta travamentos do loop
+      de eventos acima de `limite_ms` e registra a pilha que estava rodando;
+    - o tracemalloc tira fotos periódicas e registra o que mais cresceu.
+
+    Os relatórios são regravados a cada minuto, na thread da interface (a foto do
+    tracemalloc segura o GIL de qualquer forma), em pasta_dados_app("perfil", <início>).
+    A pausa causada pela própria gravação não conta como travamento.
+    """
+    def __init__(self, parent=None, intervalo_ms=10, limite_ms=200):
+        super().__init__(parent)
+        self.intervalo = intervalo_ms / 1000.0
+        self.limite = limite_ms / 1000.0
+        self.ativo = False
+        self.pasta = None
+        self.trava = threading.Lock()
+        self.pilhas = collections.Counter()
+        self.amostras = 0
+        self.travamentos = []
+        self.ultimo_batimento = time.monotonic()
+        self.foto_anterior = None
+        self.thread_amostragem = None
+        self.iniciou_tracemalloc = False
+        self.gravando = False
+
+        self.timer_batimento = QTimer(self)
+        self.timer_batimento.timeout.connect(self.bater)
+        self.timer_relatorio = QTimer(self)
+        self.timer_relatorio.timeout.connect(self.gravar_relatorios)
+
+    def iniciar(self):
+        if self.ativo: return
+        self.ativo = True
+        self.pasta = pasta_dados_app("perfil", datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+        self.pilhas.clear()
+        self.amostras = 0
+        self.travamentos = []
+        self.ultimo_batimento = time.monotonic()
+        # Se outro código já estiver rastreando, o rastreamento continua sendo dele
+        self.iniciou_tracemalloc = not tracemalloc.is_tracing()
+        if self.iniciou_tracemalloc:
+            tracemalloc.start(5)
+        self.foto_anterior = tracemalloc.take_snapshot()
+        self.timer_batimento.start(50)
+        self.timer_relatorio.start(60000)
+        self.thread_amostragem = threading.Thread(target=self.amostrar, name="perfilador", daemon=True)
+        self.thread_amostragem.start()
+
+    def parar(self):
+        if not self.ativo: return
+        self.ativo = False
+        self.timer_batimento.stop()
+        self.timer_relatorio.stop()
+        # A thread sai em até um intervalo de amostragem; depois disso nada mais disputa os relatórios
+        self.thread_amostragem.join()
+        self.gravar_relatorios()
+        if self.iniciou_tracemalloc:
+            tracemalloc.stop()
+            self.iniciou_tracemalloc = False
+        self.foto_anterior = None
+
+    def bater(self):
+        self.ultimo_batimento = time.monotonic()
+
+    @staticmethod
+    def descrever_pilha(frame, linhas=False):
+        partes = []
+        while frame is not None:
+            codigo = frame.f_code
+            partes.append(f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}" + (f":{frame.f_lineno}" if linhas else ""))
+            frame = frame.f_back
+        return ";".join(reversed(partes))
+
+    def amostrar(self):
+        proprio = threading.get_ident()
+        principal = threading.main_thread().ident
+        nomes = {}
+        travamento = None
+        while self.ativo:
+            time.sleep(self.intervalo)
+            agora = time.monotonic()
+            if len(nomes) != threading.active_count():
+                nomes = {t.ident: t.name for t in threading.enumerate()}
+            pilha_principal = None
+            with self.trava:
+                for ident, frame in sys._current_frames().items():
+                    if ident == proprio: continue
+                    self.pilhas[f"{nomes.get(ident, ident)};{self.descrever_pilha(frame)}"] += 1
+                    if ident == principal: pilha_principal = self.descrever_pilha(frame, linhas=True)
+                self.amostras += 1
+
+                # Batimento atrasado = a interface está presa em algum slot
+                parada = agora - self.ultimo_batimento
+                if self.gravando:
+                    # A pausa é a do próprio perfilador gravando os relatórios; um
+                    # travamento em curso terminou antes dela
+                    if travamento is not None:
+                        self.travamentos.append(travamento)
+                        travamento = None
+                elif parada > self.limite:
+                    if travamento is None:
+                        travamento = {"inicio": datetime.datetime.now().strftime("%H:%M:%S"), "pilhas": collections.Counter()}
+                    if pilha_principal: travamento["pilhas"][pilha_principal] += 1
+                    travamento["duracao"] = parada
+                elif travamento is not None:
+                    self.travamentos.append(travamento)
+                    travamento = None
+
+    def gravar_relatorios(self):
+        if not self.pasta: return
+        self.gravando = True
+        try:
+            self.escrever_relatorios()
+        finally:
+            # O intervalo da gravação não entra na próxima medida de parada
+            self.ultimo_batimento = time.monotonic()
+            self.gravando = False
+
+    def escrever_relatorios(self):
+        with self.trava:
+            pilhas = list(self.pilhas.items())
+            travamentos = list(self.travamentos)
+            amostras = self.amostras
+        with open(os.path.join(self.pasta, "cpu.collapsed"), "w", encoding="utf-8") as f:
+            for pilha, contagem in sorted(pilhas, key=lambda x: -x[1]):
+                f.write(f"{pilha} {contagem}\n")
+
+        with open(os.path.join(self.pasta, "travamentos.txt"), "w", encoding="utf-8") as f:
+            f.write(f"{amostras} amostras a cada {self.intervalo * 1000:.0f} ms; travamento = interface parada por mais de {self.limite * 1000:.0f} ms\n\n")
+            for t in sorted(travamentos, key=lambda x: -x["duracao"]):
+                pilha = t["pilhas"].most_common(1)[0][0] if t["pilhas"] else "?"
+                f.write(f"{t['inicio']}  {t['duracao'] * 1000:.0f} ms\n    " + pilha.replace(";", "\n    ") + "\n\n")
+
+        if tracemalloc.is_tracing():
+            foto = tracemalloc.take_snapshot()
+            atual, pico = tracemalloc.get_traced_memory()
+            with open(os.path.join(self.pasta, "memoria.txt"), "a", encoding="utf-8") as f:
+                f.write(f"=== {datetime.datetime.now():%H:%M:%S}  atual {atual / 1048576:.1f} MB, pico {pico / 1048576:.1f} MB\n")
+                if self.foto_anterior is not None:
+                    for estatistica in foto.compare_to(self.foto_anterior, "lineno")[:15]:
+                        f.write(f"    {estatistica}\n")
+                f.write("\n")
+            self.foto_anterior = foto
+
+# --- NOVA CLASSE: TEMAS PRÉ-COMPILADOS ---
+class MotorTemas:
+    """
+    Paletas e folhas de estilo de cada modo, montadas uma única vez e guardadas
+    em cache. As cores gerais vão pela QPalette da aplicação, que não exige
+    re-polir widgets; as folhas de estilo são aplicadas só onde fazem falta
+    (painel lateral, barra de navegação e diálogos), com seletores por
+    objectName e pela propriedade "papel" dos botões, para que as WebViews
+    nunca sejam re-polidas numa troca de tema.
+    """
+    CORES = {
+        "light": {
+            "fundo": "#f8fafc", "texto": "#1e293b", "campo": "#ffffff", "borda": "#cbd5e1",
+            "borda_grupo": "#94a3b8", "titulo_grupo": "#1e293b", "botao": "#f1f5f9", "texto_botao": "#334155",
+            "botao_hover": "#e2e8f0", "aba": "#f1f5f9", "texto_aba": "#334155", "destravar": "#f59e0b",
+            "anonima": "#334155", "limpar": "#e2e8f0", "texto_limpar": "#64748b", "texto_home": "#1e293b",
+            "cartao": "#ffffff", "dialogo": "#ffffff", "link": "#2563eb",
+        },
+        "dark": {
+            "fundo": "#0f172a", "texto": "#e2e8f0", "campo": "#1e293b", "borda": "#475569",
+            "borda_grupo": "#475569", "titulo_grupo": "#94a3b8", "botao": "#334155", "texto_botao": "white",
+            "botao_hover": "#475569", "aba": "#1e293b", "texto_aba": "#94a3b8", "destravar": "#d97706",
+            "anonima": "#475569", "limpar": "#334155", "texto_limpar": "#e2e8f0", "texto_home": "white",
+            "cartao": "#1e293b", "dialogo": "#1e293b", "link": "#38bdf8",
+        },
+    }
+
+    FOLHA_COMUM = """
+        QLineEdit {{ background-color: {campo}; color: {texto}; border: 1px solid {borda}; padding: 6px; border-radius: 4px; }}
+        QTextEdit {{ background-color: {campo}; color: {texto}; border: 1px solid {borda}; border-radius: 4px; }}
+        QGroupBox {{ border: 1px solid {borda_grupo}; border-radius: 6px; margin-top: 10px; font-weight: bold; color: {titulo_grupo}; }}
+        QGroupBox::title {{ subcontrol-origin: margin; subcontrol-position: top left; padding: 0 3px; }}
+        QLabel {{ color: {texto}; }}
+        QPushButton {{ background-color: {botao}; color: {texto_botao}; border: 1px solid {borda}; border-radius: 4px; padding: 6px; }}
+        QPushButton:hover {{ background-color: {botao_hover}; }}
+    """
+
+    FOLHAS = {
+        "painel": """
+            QWidget#painelLateral {{ background-color: {fundo}; color: {texto}; }}
+            QPushButton[papel="cabecalho"] {{ border-radius: 6px; font-size: 18px; padding: 0; }}
+            QPushButton[papel="cabecalho"]:hover {{ border-color: #94a3b8; }}
+            QPushButton#btnInstrucao {{ font-size: 12px; padding: 0 10px; font-weight: bold; }}
+            QPushButton[papel="limpar"] {{ background-color: {limpar}; color: {texto_limpar}; border: none; font-weight: bold; }}
+            QPushButton[papel="anonima"] {{ background-color: {anonima}; color: white; padding: 8px; border: none; }}
+            QPushButton[papel="primario"] {{ background-color: #2563eb; color: white; padding: 8px; border: none; font-weight: bold; }}
+            QPushButton[papel="perigo"] {{ background-color: #ef4444; color: white; padding: 8px; border: none; font-weight: bold; }}
+            QTextEdit#logSistema {{ background: #1e293b; color: #4ade80; font-family: Consolas, monospace; font-size: 12px; border: 1px solid {borda}; }}
+        """,
+        "barra": """
+            QWidget#barraNavegacao {{ background-color: {fundo}; }}
+            QPushButton[papel="destravar"] {{ background-color: {destravar}; color: white; font-weight: bold; border: none; padding: 5px 10px; }}
+            QPushButton[papel="home"] {{ font-size: 18px; padding-bottom: 3px; color: {texto_home}; }}
+            QTabBar::tab {{ background: {aba}; color: {texto_aba}; border: 1px solid {borda}; padding: 8px 30px 8px 12px; border-radius: 4px; margin-right: 4px; }}
+            QTabBar::tab:selected {{ background: #2563eb; color: white; border-color: #2563eb; }}
+        """,
+        "dialogo": """
+            QDialog {{ background-color: {dialogo}; color: {texto}; }}
+        """,
+    }
+
+    def __init__(self):
+        self.paletas = {}
+        self.folhas = {}
+
+    def cores(self, modo):
+        return self.CORES.get(modo, self.CORES["light"])
+
+    def paleta(self, modo):
+        if modo not in self.paletas:
+            c = self.cores(modo)
+            paleta = QPalette()
+            for papel, cor in ((QPalette.ColorRole.Window, c["fundo"]), (QPalette.ColorRole.WindowText, c["texto"]),
+                               (QPalette.ColorRole.Base, c["campo"]), (QPalette.ColorRole.AlternateBase, c["botao"]),
+                               (QPalette.ColorRole.Text, c["texto"]), (QPalette.ColorRole.Button, c["botao"]),
+                               (QPalette.ColorRole.ButtonText, c["texto_botao"]), (QPalette.ColorRole.ToolTipBase, c["campo"]),
+                               (QPalette.ColorRole.ToolTipText, c["texto"]), (QPalette.ColorRole.PlaceholderText, c["texto_limpar"]),
+                               (QPalette.ColorRole.Mid, c["borda"]), (QPalette.ColorRole.Link, c["link"]),
+                               (QPalette.ColorRole.Highlight, "#2563eb"), (QPalette.ColorRole.HighlightedText, "white")):
+                paleta.setColor(papel, QColor(cor))
+            self.paletas[modo] = paleta
+        return self.paletas[modo]
+
+    def folha(self, modo, escopo):
+        chave = (modo, escopo)
+        if chave not in self.folhas:
+            modelo = self.FOLHA_COMUM + self.FOLHAS[escopo]
+            self.folhas[chave] = modelo.format(**self.cores(modo))
+        return self.folhas[chave]
+
 class QRDialog(QDialog):
     def __init__(self, pixmap, parent=None):
         super().__init__(parent)
@@ -231,19 +1314,20 @@ class CameraDialog(QDialog):
 
 # --- NOVA CLASSE: DIÁLOGO DE CONFIGURAÇÕES ---
 class ConfigDialog(QDialog):
+    # Estilo base do diálogo para garantir legibilidade (somado à folha do tema)
+    FOLHA_BASE = """
+        QDialog { font-size: 14px; }
+        QGroupBox { font-weight: bold; border: 1px solid #cbd5e1; border-radius: 6px; margin-top: 10px; padding-top: 15px; }
+        QGroupBox::title { subcontrol-origin: margin; subcontrol-position: top center; padding: 0 5px; }
+    """
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.parent_window = parent
         self.setWindowTitle("Configurações do Sistema")
         self.setModal(True)
         self.setMinimumWidth(400)
-        
-        # Define estilo base do diálogo para garantir legibilidade
-        self.setStyleSheet("""
-            QDialog { font-size: 14px; }
-            QGroupBox { font-weight: bold; border: 1px solid #cbd5e1; border-radius: 6px; margin-top: 10px; padding-top: 15px; }
-            QGroupBox::title { subcontrol-origin: margin; subcontrol-position: top center; padding: 0 5px; }
-        """)
+        self.aplicar_folha()
 
         layout = QVBoxLayout(self)
 
@@ -275,6 +1359,23 @@ class ConfigDialog(QDialog):
         hbox_btns.addWidget(btn_load)
         hbox_btns.addWidget(btn_new)
         lay_db.addLayout(hbox_btns)
+
+        hbox_arq = QHBoxLayout()
+        hbox_arq.addWidget(QLabel("Arquivar visitas expiradas há mais de (dias, 0 = nunca):"))
+        self.sp_arquivo = QSpinBox()
+        self.sp_arquivo.setRange(0, 3650)
+        self.sp_arquivo.setValue(int(self.parent_window.settings.value("arquivo/dias", 365)))
+        self.sp_arquivo.valueChanged.connect(lambda v: self.parent_window.settings.setValue("arquivo/dias", v))
+        hbox_arq.addWidget(self.sp_arquivo)
+        lay_db.addLayout(hbox_arq)
+
+        btn_importar = QPushButton("📥 Importar / Mesclar Bancos")
+        btn_importar.clicked.connect(self.acao_importar)
+        lay_db.addWidget(btn_importar)
+
+        btn_manutencao = QPushButton("🧰 Executar Manutenção Agora")
+        btn_manutencao.clicked.connect(self.acao_manutencao)
+        lay_db.addWidget(btn_manutencao)
         layout.addWidget(gb_db)
 
         # === SEÇÃO APARÊNCIA ===
@@ -290,8 +1391,7 @@ class ConfigDialog(QDialog):
         self.bg_theme.addButton(self.rb_escuro, 2)
         
         # Define seleção atual
-        current_theme = self.parent_window.settings.value("theme", "light")
-        if current_theme == "dark":
+        if self.parent_window.tema_atual == "dark":
             self.rb_escuro.setChecked(True)
         else:
             self.rb_claro.setChecked(True)
@@ -302,6 +1402,99 @@ class ConfigDialog(QDialog):
         lay_theme.addWidget(self.rb_escuro)
         layout.addWidget(gb_theme)
 
+        # === SEÇÃO ACESSO AO PORTAL ===
+        gb_acesso = QGroupBox("Acesso ao Portal")
+        lay_acesso = QFormLayout(gb_acesso)
+        usuario, _ = self.parent_window.sessao.cofre.carregar()
+        self.input_usuario = QLineEdit(usuario or "")
+        self.input_senha = QLineEdit()
+        self.input_senha.setEchoMode(QLineEdit.EchoMode.Password)
+        self.input_senha.setPlaceholderText("Manter a senha atual" if usuario else "")
+        btn_cred = QPushButton("🔑 Salvar Credenciais")
+        btn_cred.setStyleSheet("background-color: #3b82f6; color: white; padding: 8px; border-radius: 4px; font-weight: bold;")
+        btn_cred.clicked.connect(self.acao_salvar_credenciais)
+        lay_acesso.addRow("Usuário:", self.input_usuario)
+        lay_acesso.addRow("Senha:", self.input_senha)
+        lay_acesso.addRow(btn_cred)
+        layout.addWidget(gb_acesso)
+
+        # === SEÇÃO SINCRONIZAÇÃO ===
+        gb_sync = QGroupBox("Sincronização entre Estações")
+        lay_sync = QVBoxLayout(gb_sync)
+        pasta_sync = self.parent_window.settings.value("sync/pasta", "")
+        self.lbl_pasta_sync = QLabel(pasta_sync or "Nenhuma pasta compartilhada definida")
+        self.lbl_pasta_sync.setWordWrap(True)
+        lay_sync.addWidget(self.lbl_pasta_sync)
+
+        self.chk_captura = QCheckBox("Esta estação captura do portal")
+        self.chk_captura.setChecked(self.parent_window.settings.value("captura/ativa", True, type=bool))
+        self.chk_captura.toggled.connect(self.parent_window.definir_captura_ativa)
+        lay_sync.addWidget(self.chk_captura)
+
+        self.chk_processo = QCheckBox("Capturar em processo separado, supervisionado (vale ao reiniciar)")
+        self.chk_processo.setChecked(self.parent_window.settings.value("captura/processo_separado", False, type=bool))
+        self.chk_processo.toggled.connect(lambda ativo: self.parent_window.settings.setValue("captura/processo_separado", ativo))
+        lay_sync.addWidget(self.chk_processo)
+
+        hbox_sync = QHBoxLayout()
+        btn_pasta = QPushButton("📁 Pasta Compartilhada")
+        btn_pasta.setStyleSheet("background-color: #3b82f6; color: white; padding: 8px; border-radius: 4px; font-weight: bold;")
+        btn_pasta.clicked.connect(self.acao_pasta_sync)
+        btn_sync = QPushButton("🔄 Sincronizar Agora")
+        btn_sync.setStyleSheet("background-color: #10b981; color: white; padding: 8px; border-radius: 4px; font-weight: bold;")
+        btn_sync.clicked.connect(self.parent_window.sincronizar_estacoes)
+        hbox_sync.addWidget(btn_pasta)
+        hbox_sync.addWidget(btn_sync)
+        lay_sync.addLayout(hbox_sync)
+        layout.addWidget(gb_sync)
+
+        # === SEÇÃO REVALIDAÇÃO ===
+        gb_reval = QGroupBox("Revalidação de Visitas")
+        lay_reval = QHBoxLayout(gb_reval)
+        lay_reval.addWidget(QLabel("Revalidações por minuto (0 = desativada):"))
+        self.sp_revalidacao = QSpinBox()
+        self.sp_revalidacao.setRange(0, 60)
+        self.sp_revalidacao.setValue(int(self.parent_window.settings.value("revalidacao/por_minuto", 2)))
+        self.sp_revalidacao.valueChanged.connect(self.trocar_ritmo_revalidacao)
+        lay_reval.addWidget(self.sp_revalidacao)
+        layout.addWidget(gb_reval)
+
+        # === SEÇÃO API LOCAL ===
+        gb_api = QGroupBox("API Local (somente leitura e eventos)")
+        lay_api = QHBoxLayout(gb_api)
+        self.chk_api = QCheckBox("Ativar em 127.0.0.1, porta:")
+        self.chk_api.setChecked(self.parent_window.settings.value("api/ativa", False, type=bool))
+        self.sp_porta_api = QSpinBox()
+        self.sp_porta_api.setRange(1024, 65535)
+        self.sp_porta_api.setValue(int(self.parent_window.settings.value("api/porta", 8765)))
+        self.chk_api.toggled.connect(self.trocar_api)
+        self.sp_porta_api.editingFinished.connect(self.trocar_api)
+        lay_api.addWidget(self.chk_api)
+        lay_api.addWidget(self.sp_porta_api)
+        layout.addWidget(gb_api)
+
+        # === SEÇÃO RELATÓRIOS ===
+        gb_rel = QGroupBox("Relatórios")
+        lay_rel = QVBoxLayout(gb_rel)
+        btn_exportar = QPushButton("📤 Exportar Visitas")
+        btn_exportar.setStyleSheet("background-color: #6366f1; color: white; padding: 8px; border-radius: 4px; font-weight: bold;")
+        btn_exportar.clicked.connect(self.acao_exportar)
+        lay_rel.addWidget(btn_exportar)
+        layout.addWidget(gb_rel)
+
+        # === SEÇÃO DIAGNÓSTICO ===
+        gb_diag = QGroupBox("Diagnóstico")
+        lay_diag = QVBoxLayout(gb_diag)
+        self.chk_perfil = QCheckBox("Modo de perfilamento (CPU, memória e travamentos da interface)")
+        self.chk_perfil.setChecked(self.parent_window.perfilador.ativo)
+        self.chk_perfil.toggled.connect(self.trocar_perfilamento)
+        lay_diag.addWidget(self.chk_perfil)
+        self.lbl_pasta_perfil = QLabel(self.parent_window.perfilador.pasta or "")
+        self.lbl_pasta_perfil.setWordWrap(True)
+        self.lbl_pasta_perfil.setStyleSheet("font-size: 11px; color: #64748b;")
+        lay_diag.addWidget(self.lbl_pasta_perfil)
+        layout.addWidget(gb_diag)
+
         # === RODAPÉ ===
         btn_fechar = QPushButton("Fechar")
         btn_fechar.clicked.connect(self.accept)
@@ -320,9 +1513,392 @@ class ConfigDialog(QDialog):
         if "Ativo" in self.lbl_status.text():
              self.lbl_status.setStyleSheet("color: #10b981; font-weight: bold; margin-bottom: 10px;")
 
+    def trocar_perfilamento(self, ativo):
+        # Vale também para as próximas inicializações, até ser desligado
+        self.parent_window.settings.setValue("perfil/ativo", ativo)
+        self.parent_window.definir_perfilamento(ativo)
+        self.lbl_pasta_perfil.setText(self.parent_window.perfilador.pasta or "")
+
+    def acao_manutencao(self):
+        db = self.parent_window.db
+        if not db:
+            QMessageBox.warning(self, "Aviso", "Nenhum banco carregado.")
+            return
+        # Pedido explícito: roda tudo em segundo plano, com orçamento maior para a
+        # verificação de integridade (no processo de captura, se estiver separado)
+        self.parent_window.comandar("manutencao", completa=True)
+        QMessageBox.information(self, "Manutenção do Banco", "Manutenção iniciada em segundo plano. Acompanhe o resultado no log.")
+
     def trocar_tema(self, id):
         modo = "dark" if id == 2 else "light"
         self.parent_window.aplicar_tema(modo)
+        self.aplicar_folha()
+
+    def aplicar_folha(self):
+        # Exportação e importação são filhas deste diálogo e herdam a mesma folha
+        janela = self.parent_window
+        self.setStyleSheet(janela.temas.folha(janela.tema_atual, "dialogo") + self.FOLHA_BASE)
+
+    def acao_salvar_credenciais(self):
+        cofre = self.parent_window.sessao.cofre
+        usuario = self.input_usuario.text().strip()
+        senha = self.input_senha.text() or cofre.carregar()[1]
+        if not usuario or not senha:
+            QMessageBox.warning(self, "Aviso", "Informe usuário e senha.")
+            return
+        try:
+            cofre.salvar(usuario, senha)
+        except Exception as e:
+            QMessageBox.critical(self, "Erro", f"Falha ao salvar as credenciais:\n{e}")
+            return
+        self.input_senha.clear()
+        QMessageBox.information(self, "Sucesso", "Credenciais salvas com segurança.")
+        self.parent_window.renovar_sessao()
+
+    def trocar_ritmo_revalidacao(self, valor):
+        self.parent_window.settings.setValue("revalidacao/por_minuto", valor)
+        self.parent_window.comandar("ritmo_revalidacao", por_minuto=valor)
+
+    def trocar_api(self):
+        settings = self.parent_window.settings
+        settings.setValue("api/ativa", self.chk_api.isChecked())
+        settings.setValue("api/porta", self.sp_porta_api.value())
+        self.parent_window.configurar_api()
+
+    def acao_pasta_sync(self):
+        pasta = QFileDialog.getExistingDirectory(self, "Selecionar Pasta Compartilhada", self.parent_window.settings.value("sync/pasta", ""))
+        if pasta:
+            self.parent_window.settings.setValue("sync/pasta", pasta)
+            self.lbl_pasta_sync.setText(pasta)
+            self.parent_window.sincronizar_estacoes()
+
+    def acao_importar(self):
+        if not self.parent_window.db:
+            QMessageBox.warning(self, "Aviso", "Carregue um banco de dados antes de importar.")
+            return
+        dlg = ImportacaoDialog(self.parent_window, self)
+        dlg.exec()
+
+    def acao_exportar(self):
+        if not self.parent_window.db:
+            QMessageBox.warning(self, "Aviso", "Carregue um banco de dados antes de exportar.")
+            return
+        dlg = ExportacaoDialog(self.parent_window.db.db_path, self)
+        dlg.exec()
+
+# --- NOVA CLASSE: DIÁLOGO DE EXPORTAÇÃO ---
+class ExportacaoDialog(QDialog):
+    def __init__(self, db_path, parent=None):
+        super().__init__(parent)
+        self.db_path = db_path
+        self.exportador = None
+        self.setWindowTitle("Exportar Visitas")
+        self.setModal(True)
+        self.setMinimumWidth(420)
+
+        layout = QVBoxLayout(self)
+        form = QFormLayout()
+
+        self.chk_periodo = QCheckBox("Filtrar por período da visita")
+        form.addRow(self.chk_periodo)
+
+        hoje = QDate.currentDate()
+        self.dt_inicio = QDateEdit(QDate(hoje.year(), hoje.month(), 1))
+        self.dt_fim = QDateEdit(hoje)
+        for dt in (self.dt_inicio, self.dt_fim):
+            dt.setCalendarPopup(True)
+            dt.setDisplayFormat("dd/MM/yyyy")
+            dt.setEnabled(False)
+            self.chk_periodo.toggled.connect(dt.setEnabled)
+        form.addRow("De:", self.dt_inicio)
+        form.addRow("Até:", self.dt_fim)
+
+        self.cb_validade = QComboBox()
+        self.cb_validade.addItem("Todas", "todas")
+        self.cb_validade.addItem("Somente válidas", "validas")
+        self.cb_validade.addItem("Somente expiradas", "expiradas")
+        form.addRow("Validade:", self.cb_validade)
+
+        self.input_nome = QLineEdit()
+        self.input_nome.setPlaceholderText("Opcional")
+        form.addRow("Nome contém:", self.input_nome)
+
+        self.cb_formato = QComboBox()
+        self.cb_formato.addItem("CSV", "csv")
+        if pyarrow:
+            self.cb_formato.addItem("Parquet (colunar)", "parquet")
+        else:
+            self.cb_formato.addItem("Parquet (instale: pip install pyarrow)", "parquet")
+            self.cb_formato.model().item(1).setEnabled(False)
+        form.addRow("Formato:", self.cb_formato)
+        layout.addLayout(form)
+
+        self.barra = QProgressBar()
+        self.barra.setValue(0)
+        layout.addWidget(self.barra)
+        self.lbl_progresso = QLabel("")
+        layout.addWidget(self.lbl_progresso)
+
+        hbox = QHBoxLayout()
+        self.btn_exportar = QPushButton("📤 Exportar")
+        self.btn_exportar.setStyleSheet("background-color: #2563eb; color: white; padding: 8px; border-radius: 4px; font-weight: bold;")
+        self.btn_exportar.clicked.connect(self.iniciar_exportacao)
+        self.btn_cancelar = QPushButton("Fechar")
+        self.btn_cancelar.setStyleSheet("padding: 8px;")
+        self.btn_cancelar.clicked.connect(self.cancelar_ou_fechar)
+        hbox.addWidget(self.btn_exportar)
+        hbox.addWidget(self.btn_cancelar)
+        layout.addLayout(hbox)
+
+    def iniciar_exportacao(self):
+        formato = self.cb_formato.currentData()
+        filtro_arq = "Parquet (*.parquet)" if formato == "parquet" else "CSV (*.csv)"
+        sugestao = os.path.join(os.path.expanduser("~"), "Downloads", f"visitas_{datetime.date.today():%Y%m%d}.{formato}")
+        destino, _ = QFileDialog.getSaveFileName(self, "Salvar Exportação", sugestao, filtro_arq)
+        if not destino: return
+
+        filtros = {
+            "validade": self.cb_validade.currentData(),
+            "nome": self.input_nome.text().strip(),
+        }
+        if self.chk_periodo.isChecked():
+            filtros["inicio"] = self.dt_inicio.date().toString("yyyy-MM-dd")
+            filtros["fim"] = self.dt_fim.date().toString("yyyy-MM-dd")
+
+        self.exportador = ExportadorVisitas(self.db_path, destino, formato, filtros, self)
+        self.exportador.progresso.connect(self.atualizar_progresso)
+        self.exportador.concluido.connect(self.exportacao_concluida)
+        self.exportador.erro.connect(self.exportacao_falhou)
+        self.btn_exportar.setEnabled(False)
+        self.btn_cancelar.setText("Cancelar")
+        self.lbl_progresso.setText("Preparando...")
+        self.exportador.start()
+
+    def atualizar_progresso(self, feitos, total):
+        self.barra.setMaximum(max(total, 1))
+        self.barra.setValue(feitos)
+        self.lbl_progresso.setText(f"{feitos} de {total} visitas exportadas")
+
+    def exportacao_concluida(self, resumo):
+        self.btn_exportar.setEnabled(True)
+        self.btn_cancelar.setText("Fechar")
+        self.lbl_progresso.setText(resumo)
+        QMessageBox.information(self, "Sucesso", resumo)
+
+    def exportacao_falhou(self, mensagem):
+        self.btn_exportar.setEnabled(True)
+        self.btn_cancelar.setText("Fechar")
+        self.lbl_progresso.setText("")
+        QMessageBox.critical(self, "Erro", f"Falha na exportação:\n{mensagem}")
+
+    def cancelar_ou_fechar(self):
+        if self.exportador and self.exportador.isRunning():
+            self.exportador.cancelado = True
+            return
+        self.accept()
+
+    def closeEvent(self, event):
+        if self.exportador and self.exportador.isRunning():
+            self.exportador.cancelado = True
+            self.exportador.wait()
+        super().closeEvent(event)
+
+class ImportacaoDialog(QDialog):
+    def __init__(self, browser_window, parent=None):
+        super().__init__(parent)
+        self.browser_window = browser_window
+        self.importador = None
+        self.fontes = []
+        self.setWindowTitle("Importar / Mesclar Visitas")
+        self.setModal(True)
+        self.setMinimumWidth(460)
+
+        layout = QVBoxLayout(self)
+        aviso = QLabel("Mescla outros bancos (.db) ou exportações CSV no banco ativo. "
+                       "Em visitas repetidas vale a captura mais recente.")
+        aviso.setWordWrap(True)
+        layout.addWidget(aviso)
+
+        self.lbl_fontes = QLabel("Nenhum arquivo selecionado")
+        self.lbl_fontes.setWordWrap(True)
+        self.lbl_fontes.setStyleSheet("font-size: 11px; color: #64748b;")
+        layout.addWidget(self.lbl_fontes)
+        btn_arquivos = QPushButton("📂 Selecionar Arquivos")
+        btn_arquivos.clicked.connect(self.selecionar_arquivos)
+        layout.addWidget(btn_arquivos)
+
+        self.barra = QProgressBar()
+        self.barra.setValue(0)
+        layout.addWidget(self.barra)
+        self.lbl_progresso = QLabel("")
+        layout.addWidget(self.lbl_progresso)
+
+        hbox = QHBoxLayout()
+        self.btn_importar = QPushButton("📥 Importar")
+        self.btn_importar.setStyleSheet("background-color: #2563eb; color: white; padding: 8px; border-radius: 4px; font-weight: bold;")
+        self.btn_importar.setEnabled(False)
+        self.btn_importar.clicked.connect(self.iniciar_importacao)
+        self.btn_cancelar = QPushButton("Fechar")
+        self.btn_cancelar.setStyleSheet("padding: 8px;")
+        self.btn_cancelar.clicked.connect(self.cancelar_ou_fechar)
+        hbox.addWidget(self.btn_importar)
+        hbox.addWidget(self.btn_cancelar)
+        layout.addLayout(hbox)
+
+    def selecionar_arquivos(self):
+        fontes, _ = QFileDialog.getOpenFileNames(self, "Selecionar Bancos ou Exportações", "",
+                                                 "Bancos e exportações (*.db *.csv);;SQLite Database (*.db);;CSV (*.csv)")
+        if not fontes: return
+        self.fontes = [f for f in fontes if not f.endswith("_arquivo.db")]
+        self.lbl_fontes.setText("\n".join(os.path.basename(f) for f in self.fontes))
+        self.btn_importar.setEnabled(bool(self.fontes))
+
+    def iniciar_importacao(self):
+        self.importador = ImportadorVisitas(self.browser_window.db.db_path, self.fontes, self)
+        self.importador.progresso.connect(self.atualizar_progresso)
+        self.importador.etapa.connect(self.lbl_progresso.setText)
+        self.importador.concluido.connect(self.importacao_concluida)
+        self.importador.erro.connect(self.importacao_falhou)
+        self.btn_importar.setEnabled(False)
+        self.btn_cancelar.setText("Cancelar")
+        self.importador.start()
+
+    def atualizar_progresso(self, feitos, total):
+        self.barra.setMaximum(max(total, 1))
+        self.barra.setValue(feitos)
+
+    def importacao_concluida(self, resumo, aplicadas):
+        self.btn_cancelar.setText("Fechar")
+        self.lbl_progresso.setText(resumo)
+        self.browser_window.visitas_importadas(aplicadas)
+        QMessageBox.information(self, "Sucesso", resumo)
+
+    def importacao_falhou(self, mensagem):
+        self.btn_importar.setEnabled(True)
+        self.btn_cancelar.setText("Fechar")
+        self.lbl_progresso.setText("")
+        # Cancelamento no meio da mescla mantém o que já entrou
+        self.browser_window.visitas_importadas(0)
+        QMessageBox.critical(self, "Erro", f"Falha na importação:\n{mensagem}")
+
+    def cancelar_ou_fechar(self):
+        if self.importador and self.importador.isRunning():
+            self.importador.cancelado = True
+            self.lbl_progresso.setText("Cancelando...")
+            return
+        self.accept()
+
+    def closeEvent(self, event):
+        if self.importador and self.importador.isRunning():
+            self.importador.cancelado = True
+            self.importador.wait()
+        super().closeEvent(event)
+
+class GraficoBarras(QWidget):
+    """Gráfico de barras simples desenhado com QPainter"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.dados = []
+        self.cor_texto = QColor("#1e293b")
+        self.setMinimumHeight(260)
+
+    def definir_dados(self, dados):
+        """Lista de (rótulo, valor)"""
+        self.dados = dados
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(self.cor_texto)
+        if not self.dados:
+            painter.drawText(self.rect(), Qt.AlignmentFlag.AlignCenter, "Sem dados")
+            return
+        margem, base = 30, self.height() - 40
+        largura = (self.width() - 2 * margem) / len(self.dados)
+        maximo = max(v for _, v in self.dados) or 1
+        passo_rotulo = max(1, int(40 / max(largura, 1)))
+        for i, (rotulo, valor) in enumerate(self.dados):
+            altura = (base - 20) * valor / maximo
+            x = margem + i * largura
+            painter.fillRect(int(x + largura * 0.15), int(base - altura), max(1, int(largura * 0.7)), int(altura), QColor("#2563eb"))
+            if valor and largura >= 18:
+                painter.drawText(int(x), int(base - altura - 16), int(largura), 14, Qt.AlignmentFlag.AlignCenter, str(valor))
+            if i % passo_rotulo == 0:
+                painter.drawText(int(x - largura), base + 4, int(largura * 3), 30,
+                                 Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignTop | Qt.TextFlag.TextWordWrap, str(rotulo))
+
+class DashboardDialog(QDialog):
+    """
+    Painel de movimento da portaria. Lê só as tabelas de estatísticas mantidas
+    pelo DatabaseHandler, então abre na hora qualquer que seja o histórico.
+    """
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.browser_window = parent
+        self.setWindowTitle("📊 Movimento de Visitantes")
+        self.resize(820, 480)
+        self.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+
+        self.grafico = GraficoBarras()
+        self.setStyleSheet(parent.temas.folha(parent.tema_atual, "dialogo"))
+        self.grafico.cor_texto = QColor(parent.cores_tema["texto"])
+
+        layout = QVBoxLayout(self)
+        topo = QHBoxLayout()
+        self.combo_visao = QComboBox()
+        self.combo_visao.addItems(["Por dia (últimos 30 dias)", "Por hora do dia", "Por anfitrião (15 maiores)"])
+        self.combo_visao.currentIndexChanged.connect(self.atualizar)
+        topo.addWidget(QLabel("Visão:"))
+        topo.addWidget(self.combo_visao)
+        topo.addStretch()
+        layout.addLayout(topo)
+
+        self.lbl_resumo = QLabel("")
+        self.lbl_resumo.setStyleSheet("font-size: 13px;")
+        layout.addWidget(self.lbl_resumo)
+        layout.addWidget(self.grafico, 1)
+
+        btn_fechar = QPushButton("Fechar")
+        btn_fechar.clicked.connect(self.close)
+        layout.addWidget(btn_fechar, alignment=Qt.AlignmentFlag.AlignRight)
+
+        # Acompanha a captura enquanto o painel estiver aberto
+        parent.eventos.assinar(self.on_evento)
+        self.finished.connect(lambda: parent.eventos.cancelar(self.on_evento))
+        self.atualizar()
+
+    def on_evento(self, evento):
+        if evento["tipo"] in ("visita_nova", "visita_alterada"):
+            self.atualizar()
+
+    def atualizar(self):
+        db = self.browser_window.db
+        if not db:
+            self.lbl_resumo.setText("Nenhum banco carregado.")
+            self.grafico.definir_dados([])
+            return
+        resumo = db.resumo_estatisticas()
+        texto = f"<b>Total:</b> {resumo['total']} visitas"
+        if resumo["pico_dia"]:
+            dia, qtd = resumo["pico_dia"]
+            texto += f" · <b>Dia de pico:</b> {'/'.join(reversed(dia.split('-')))} ({qtd})"
+        if resumo["pico_hora"]:
+            hora, qtd = resumo["pico_hora"]
+            texto += f" · <b>Horário de pico:</b> {hora:02d}h ({qtd})"
+        self.lbl_resumo.setText(texto)
+
+        visao = self.combo_visao.currentIndex()
+        if visao == 0:
+            por_dia = dict(db.estatisticas_por_dia(30))
+            hoje = datetime.date.today()
+            dias = [hoje - datetime.timedelta(days=n) for n in range(29, -1, -1)]
+            dados = [(d.strftime("%d/%m"), por_dia.get(d.isoformat(), 0)) for d in dias]
+        elif visao == 1:
+            dados = [(f"{hora:02d}h", qtd) for hora, qtd in db.estatisticas_por_hora()]
+        else:
+            dados = [(anfitriao[:18], qtd) for anfitriao, qtd in db.estatisticas_por_anfitriao(15)]
+        self.grafico.definir_dados(dados)
 
 class InstrucoesDialog(QDialog):
     def __init__(self, parent=None):
@@ -332,13 +1908,8 @@ class InstrucoesDialog(QDialog):
         self.setWindowFlags(Qt.WindowType.FramelessWindowHint | Qt.WindowType.Dialog)
 
         # Tema
-        theme = parent.settings.value("theme", "light") if parent else "light"
-        if theme == "dark":
-            self.setStyleSheet("background-color: #1e293b; color: #e2e8f0;")
-            link_color = "#38bdf8"
-        else:
-            self.setStyleSheet("background-color: #ffffff; color: #1e293b;")
-            link_color = "#2563eb"
+        self.setStyleSheet(parent.temas.folha(parent.tema_atual, "dialogo"))
+        link_color = parent.cores_tema["link"]
 
         layout = QVBoxLayout(self)
         layout.setContentsMargins(40, 40, 40, 40)
@@ -434,13 +2005,514 @@ class InstrucoesDialog(QDialog):
 
         QMessageBox.information(self, "Sucesso", "Texto formatado copiado para a área de transferência!")
 
+# --- NOVA CLASSE: DETALHES DA VISITA A PARTIR DO BANCO ---
+class DetalhesVisitaDialog(QDialog):
+    """
+    Mostra na hora a visita gravada no banco (campos extraídos e texto bruto),
+    sem depender do portal. A atualização pelo portal roda em segundo plano,
+    por pedido do usuário ou quando a captura está desatualizada, e chega pelo
+    barramento de eventos.
+    """
+    def __init__(self, parent, visita_id):
+        super().__init__(parent)
+        self.browser_window = parent
+        self.visita_id = visita_id
+        self.setWindowTitle(f"Visita {visita_id}")
+        self.resize(640, 560)
+        self.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+
+        self.setStyleSheet(parent.temas.folha(parent.tema_atual, "dialogo"))
+
+        layout = QVBoxLayout(self)
+        form = QFormLayout()
+        self.campos = {}
+        for chave, rotulo in (("nome", "Visitante:"), ("cpf", "CPF / ID:"), ("horario", "Validade:"),
+                              ("anfitriao", "Anfitrião:"), ("data_captura", "Capturada em:"), ("url", "URL:")):
+            lbl = QLabel("-")
+            lbl.setTextInteractionFlags(Qt.TextInteractionFlag.TextSelectableByMouse)
+            lbl.setWordWrap(True)
+            self.campos[chave] = lbl
+            form.addRow(rotulo, lbl)
+        layout.addLayout(form)
+
+        self.lbl_status = QLabel("")
+        self.lbl_status.setStyleSheet("color: #64748b; font-size: 12px;")
+        layout.addWidget(self.lbl_status)
+
+        self.txt_conteudo = QTextEdit()
+        self.txt_conteudo.setReadOnly(True)
+        self.txt_conteudo.setStyleSheet("font-family: Consolas; font-size: 12px;")
+        layout.addWidget(self.txt_conteudo)
+
+        botoes = QHBoxLayout()
+        self.btn_atualizar = QPushButton("🔄 Atualizar do Portal")
+        self.btn_atualizar.clicked.connect(self.atualizar_do_portal)
+        self.btn_portal = QPushButton("🌐 Abrir no Portal")
+        self.btn_portal.clicked.connect(lambda: parent.abrir_visita_no_portal(self.visita_id))
+        btn_fechar = QPushButton("Fechar")
+        btn_fechar.clicked.connect(self.close)
+        botoes.addWidget(self.btn_atualizar)
+        botoes.addWidget(self.btn_portal)
+        botoes.addStretch()
+        botoes.addWidget(btn_fechar)
+        layout.addLayout(botoes)
+
+        parent.eventos.assinar(self.on_evento)
+        self.finished.connect(lambda: parent.eventos.cancelar(self.on_evento))
+
+        if self.carregar() and self.desatualizada():
+            self.atualizar_do_portal()
+
+    def carregar(self):
+        db = self.browser_window.db
+        registro = db.obter_visita(self.visita_id) if db else None
+        if not registro:
+            self.lbl_status.setText("Visita não encontrada no banco.")
+            return False
+        _, nome, cpf, horario, conteudo, url, data_captura = registro
+        self.data_captura = data_captura
+        valores = {"nome": nome, "cpf": cpf, "horario": horario, "anfitriao": DatabaseHandler.extrair_anfitriao(conteudo or ""),
+                   "data_captura": data_captura, "url": url}
+        for chave, valor in valores.items():
+            self.campos[chave].setText(str(valor).strip() if valor else "-")
+        cor = "green" if self.ainda_valida(horario) else "red"
+        self.campos["horario"].setStyleSheet(f"color: {cor}; font-weight: bold;")
+        self.txt_conteudo.setPlainText(conteudo or "")
+        return True
+
+    @staticmethod
+    def ainda_valida(horario):
+        partes = (horario or "").split(" - ")
+        if len(partes) != 2: return True
+        try:
+            return datetime.datetime.strptime(partes[1].strip()[:10], "%d/%m/%Y").date() >= datetime.date.today()
+        except ValueError:
+            return True
+
+    def desatualizada(self):
+        """Só vale a pena ir ao portal se a visita ainda importa e a captura já tem algumas horas"""
+        horas = int(self.browser_window.settings.value("detalhes/horas_desatualizada", 6))
+        try:
+            captura = datetime.datetime.strptime(self.data_captura, "%Y-%m-%d %H:%M:%S")
+        except (TypeError, ValueError):
+            return False
+        # data_captura vem de CURRENT_TIMESTAMP (UTC)
+        idade = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - captura
+        return self.ainda_valida(self.campos["horario"].text()) and idade > datetime.timedelta(hours=horas)
+
+    def atualizar_do_portal(self):
+        self.btn_atualizar.setEnabled(False)
+        self.lbl_status.setText("🔄 Consultando o portal em segundo plano...")
+        self.browser_window.revalidar_agora(self.visita_id)
+
+    def on_evento(self, evento):
+        dados = evento["dados"]
+        if dados.get("visita_id") != self.visita_id: return
+        if evento["tipo"] in ("visita_nova", "visita_alterada"):
+            self.carregar()
+        elif evento["tipo"] == "visita_revalidada":
+            self.btn_atualizar.setEnabled(True)
+            mensagens = {
+                "alterada": "✅ Atualizada: o portal trouxe alterações.",
+                "nova": "✅ Atualizada a partir do portal.",
+                "inalterada": "✅ Conferida no portal: sem alterações.",
+                "nao_encontrada": "⚠️ O portal não encontrou esta visita.",
+                "sessao": "🔑 Sessão do portal expirada; nova tentativa após o login.",
+                "sessao_falhou": "❌ Não foi possível renovar a sessão do portal; confira as credenciais.",
+            }
+            self.lbl_status.setText(mensagens.get(dados.get("resultado"), "❌ Não foi possível consultar o portal."))
+
+# --- NOVA CLASSE: BARRAMENTO DE EVENTOS DE VISITAS ---
+class BarramentoEventos:
+    """
+    Publica eventos de visitas (nova, alterada, sincronizadas) para quem quiser
+    reagir sem consultar o banco. Assinantes internos recebem callbacks;
+    assinantes externos recebem uma fila limitada. Quem não consome a tempo é
+    desligado (e pode reconectar pedindo os eventos desde o último id recebido,
+    mantidos num histórico curto).
+    """
+    TAMANHO_HISTORICO = 1000
+
+    def __init__(self):
+        self.trava = threading.Lock()
+        self.sequencia = 0
+        self.historico = collections.deque(maxlen=self.TAMANHO_HISTORICO)
+        self.callbacks = []
+        self.filas = []
+
+    def assinar(self, callback):
+        self.callbacks.append(callback)
+
+    def cancelar(self, callback):
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+
+    def criar_fila(self, tamanho=256, desde_id=None):
+        """Fila para consumidor em outra thread, já com os eventos posteriores a `desde_id`"""
+        fila = queue.Queue(maxsize=tamanho)
+        with self.trava:
+            if desde_id is not None:
+                for evento in self.historico:
+                    if evento["id"] > desde_id and not fila.full():
+                        fila.put_nowait(evento)
+            self.filas.append(fila)
+        return fila
+
+    def remover_fila(self, fila):
+        with self.trava:
+            if fila in self.filas:
+                self.filas.remove(fila)
+
+    def publicar(self, tipo, dados):
+        with self.trava:
+            self.sequencia += 1
+            evento = {"id": self.sequencia, "tipo": tipo, "momento": datetime.datetime.now().isoformat(timespec="seconds"), "dados": dados}
+            self.historico.append(evento)
+            for fila in list(self.filas):
+                try:
+                    fila.put_nowait(evento)
+                except queue.Full:
+                    # Contrapressão: consumidor lento é desligado em vez de segurar a captura
+                    self.filas.remove(fila)
+                    fila.transbordou = True
+        for callback in list(self.callbacks):
+            try:
+                callback(evento)
+            except Exception as e:
+                print(f"❌ Erro em assinante de eventos: {e}")
+        return evento
+
+# --- NOVA CLASSE: ÍNDICE DE NOMES TOLERANTE A ERROS ---
+class IndiceNomes:
+    """
+    Índice auxiliar de detalhes_visitas para achar nomes digitados com erro
+    ("Jhonatan" x "Jonathan", "Souza" x "Sousa"). Cada palavra distinta dos
+    nomes entra uma vez no vocabulário com sua chave fonética e seus trigramas;
+    as postagens ligam palavra -> visita. A busca aproximada trabalha sobre o
+    vocabulário (pequeno) e só depois cruza as postagens.
+    """
+    # Regras fonéticas aplicadas em ordem sobre o texto já sem acentos
+    REGRAS_FONETICAS = [
+        (r"ph", "f"), (r"th", "t"), (r"sch", "x"), (r"sh", "x"), (r"ch", "x"),
+        (r"lh", "l"), (r"nh", "n"), (r"h", ""),
+        (r"sc(?=[ei])", "s"), (r"c(?=[ei])", "s"), (r"qu(?=[ei])", "k"), (r"gu(?=[ei])", "g"),
+        (r"g(?=[ei])", "j"), (r"q", "k"), (r"c", "k"),
+        (r"y", "i"), (r"w", "v"), (r"z", "s"),
+        (r"ou", "o"), (r"m$", "n"), (r"l$", "u"),
+        (r"([a-z])\1+", r"\1"),
+    ]
+    REGRAS_COMPILADAS = [(re.compile(padrao), subst) for padrao, subst in REGRAS_FONETICAS]
+    # Palavras do vocabulário cruzadas por termo; acima disso o termo é genérico demais
+    LIMITE_CANDIDATOS = 40
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+
+    def criar_tabelas(self):
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS nomes_vocabulario (
+                token TEXT PRIMARY KEY,
+                fonetica TEXT
+            ) WITHOUT ROWID
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_vocabulario_fonetica ON nomes_vocabulario(fonetica)")
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS nomes_trigramas (
+                trigrama TEXT,
+                token TEXT,
+                PRIMARY KEY (trigrama, token)
+            ) WITHOUT ROWID
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS nomes_postagens (
+                token TEXT,
+                visita_id INTEGER,
+                PRIMARY KEY (token, visita_id)
+            ) WITHOUT ROWID
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_postagens_visita ON nomes_postagens(visita_id)")
+
+    @staticmethod
+    def normalizar(texto):
+        texto = (texto or "").lower().replace("ç", "s")
+        texto = unicodedata.normalize("NFKD", texto)
+        texto = "".join(c for c in texto if not unicodedata.combining(c))
+        return re.sub(r"[^a-z ]", " ", texto)
+
+    @classmethod
+    def tokens(cls, nome):
+        return [t for t in cls.normalizar(nome).split() if len(t) >= 2]
+
+    @classmethod
+    def chave_fonetica(cls, token):
+        chave = token
+        for regex, subst in cls.REGRAS_COMPILADAS:
+            chave = regex.sub(subst, chave)
+        return chave
+
+    @staticmethod
+    def trigramas(token):
+        t = f"  {token} "
+        return {t[i:i + 3] for i in range(len(t) - 2)}
+
+    @staticmethod
+    def distancia(a, b, limite):
+        """Levenshtein com corte: devolve limite + 1 assim que o limite é ultrapassado"""
+        if abs(len(a) - len(b)) > limite: return limite + 1
+        anterior = list(range(len(b) + 1))
+        for i, ca in enumerate(a, 1):
+            atual = [i]
+            for j, cb in enumerate(b, 1):
+                atual.append(min(anterior[j] + 1, atual[j - 1] + 1, anterior[j - 1] + (ca != cb)))
+            if min(atual) > limite: return limite + 1
+            anterior = atual
+        return anterior[-1]
+
+    def indexar(self, visita_id, nome):
+        """Atualiza as postagens de uma visita (idempotente). Não faz commit."""
+        self.cursor.execute("DELETE FROM nomes_postagens WHERE visita_id = ?", (visita_id,))
+        for token in set(self.tokens(nome)):
+            self.cursor.execute("INSERT OR IGNORE INTO nomes_vocabulario (token, fonetica) VALUES (?, ?)",
+                                (token, self.chave_fonetica(token)))
+            if self.cursor.rowcount == 1:
+                self.cursor.executemany("INSERT OR IGNORE INTO nomes_trigramas (trigrama, token) VALUES (?, ?)",
+                                        [(tri, token) for tri in self.trigramas(token)])
+            self.cursor.execute("INSERT OR IGNORE INTO nomes_postagens (token, visita_id) VALUES (?, ?)", (token, visita_id))
+
+    def remover(self, visita_id):
+        self.cursor.execute("DELETE FROM nomes_postagens WHERE visita_id = ?", (visita_id,))
+
+    def tokens_semelhantes(self, termo):
+        """Palavras do vocabulário parecidas com `termo`, com nota de similaridade (0-1)"""
+        notas = {}
+        limite = 1 if len(termo) <= 5 else 2
+
+        self.cursor.execute("SELECT token FROM nomes_vocabulario WHERE fonetica = ?", (self.chave_fonetica(termo),))
+        for (token,) in self.cursor.fetchall():
+            notas[token] = 0.9
+
+        tris = list(self.trigramas(termo))
+        minimo = max(1, len(tris) - 3 * limite)
+        self.cursor.execute(f'''
+            SELECT token FROM nomes_trigramas WHERE trigrama IN ({",".join("?" * len(tris))})
+            GROUP BY token HAVING COUNT(*) >= ?
+        ''', tris + [minimo])
+        for (token,) in self.cursor.fetchall():
+            d = self.distancia(termo, token, limite)
+            if d <= limite:
+                notas[token] = max(notas.get(token, 0), 1 - d / max(len(termo), len(token)))
+        return notas
+
+    def tokens_candidatos(self, termo, aproximado=True):
+        """
+        Palavras do vocabulário que casam com `termo`: as que o contêm (nota 1) e, se
+        `aproximado`, as parecidas, limitadas às LIMITE_CANDIDATOS de maior nota.
+        Devolve None quando o termo está contido em palavras demais para ser cruzado
+        pelas postagens (ex.: "ma").
+        """
+        self.cursor.execute("SELECT token FROM nomes_vocabulario WHERE token LIKE ? LIMIT ?",
+                            (f"%{termo}%", self.LIMITE_CANDIDATOS + 1))
+        exatos = [token for (token,) in self.cursor.fetchall()]
+        if len(exatos) > self.LIMITE_CANDIDATOS: return None
+        notas = {}
+        if aproximado:
+            semelhantes = sorted(self.tokens_semelhantes(termo).items(), key=lambda item: (-item[1], item[0]))
+            notas.update(semelhantes[:self.LIMITE_CANDIDATOS - len(exatos)])
+        notas.update(dict.fromkeys(exatos, 1.0))
+        return notas
+
+    def buscar(self, termos, limite=50, aproximado=True):
+        """
+        Retorna visita_ids cujo nome casa com todos os termos (palavra que contém o
+        termo ou, se `aproximado`, parecida com ele), ordenados por similaridade e,
+        no empate, pela visita mais recente. Termos genéricos demais só filtram as
+        visitas achadas pelos demais; se todos forem genéricos devolve None.
+        """
+        candidatos, genericos = [], []
+        for termo in termos:
+            notas = self.tokens_candidatos(termo, aproximado and len(termo) >= 3)
+            if notas is None:
+                genericos.append(termo)
+            elif not notas:
+                return []
+            else:
+                candidatos.append(notas)
+        if not candidatos: return None
+
+        # Interseção e ranking no SQL: só as visitas da página voltam para o Python
+        valores = [v for i, notas in enumerate(candidatos) for token, nota in notas.items() for v in (i, token, nota)]
+        filtros = "".join(" AND EXISTS (SELECT 1 FROM nomes_postagens g WHERE g.visita_id = por_termo.visita_id AND g.token LIKE ?)"
+                          for _ in genericos)
+        self.cursor.execute(f'''
+            WITH candidatos(termo, token, nota) AS (VALUES {",".join(["(?, ?, ?)"] * (len(valores) // 3))}),
+            por_termo AS (
+                SELECT p.visita_id, c.termo, MAX(c.nota) AS nota
+                FROM candidatos c JOIN nomes_postagens p ON p.token = c.token
+                GROUP BY p.visita_id, c.termo
+            )
+            SELECT visita_id FROM por_termo
+            GROUP BY visita_id HAVING COUNT(*) = ?{filtros}
+            ORDER BY SUM(nota) DESC, visita_id DESC LIMIT ?
+        ''', valores + [len(candidatos)] + [f"%{t}%" for t in genericos] + [limite])
+        return [vid for (vid,) in self.cursor.fetchall()]
+
 class DatabaseHandler:
-    def __init__(self, db_path):
+    # Convertem "dd/mm/aaaa - dd/mm/aaaa" em datas ISO comparáveis direto no SQL
+    SQL_DATA_INICIO = "(substr(horario, 7, 4) || '-' || substr(horario, 4, 2) || '-' || substr(horario, 1, 2))"
+    SQL_DATA_FIM = "(substr(horario, 20, 4) || '-' || substr(horario, 17, 2) || '-' || substr(horario, 14, 2))"
+
+    # Índices secundários de detalhes_visitas
+    INDICES_VISITAS = (
+        ("idx_nome", "nome"),
+        ("idx_cpf", "cpf"),
+        ("idx_horario", "horario"),
+        # Permite ler apenas o que mudou desde a última sincronização
+        ("idx_seq_alteracao", "seq_alteracao"),
+        # Índice de expressão: localiza visitas ainda válidas sem varrer a tabela
+        ("idx_data_fim", SQL_DATA_FIM),
+        ("idx_visitante", "chave_visitante"),
+    )
+
+    # Espera do escritor pelo lock de escrita (busy timeout). Precisa passar da
+    # transação mais longa de outra conexão: uma faixa da importação ou uma tarefa
+    # de manutenção, limitada por ORCAMENTO_MAXIMO_S
+    ESPERA_ESCRITA_S = 150.0
+
+    def __init__(self, db_path, eventos=None, somente_leitura=False, preparar_esquema=True):
         # Conexão direta com o caminho fornecido pelo usuário via GUI
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.db_path = db_path
+        self.eventos = eventos if eventos else BarramentoEventos()
+        self.somente_leitura = somente_leitura
+        if somente_leitura:
+            # Interface com captura em processo separado: o esquema já foi criado/migrado pelo escritor
+            self.conn = sqlite3.connect(self.uri_somente_leitura(db_path), uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(db_path, timeout=self.ESPERA_ESCRITA_S, check_same_thread=False)
+            # Só vale para bancos novos; bancos antigos são convertidos pela manutenção
+            self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # WAL permite leituras longas (exportação) sem bloquear as gravações da captura
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.preparar_conexao(self.conn, db_path, somente_leitura)
         self.cursor = self.conn.cursor()
-        self.criar_tabelas()
-        self.migrar_dados_vazios()
+        # Incrementado a cada escrita visível nas consultas; invalida caches de leitura
+        self.geracao = 0
+        self.indice_nomes = IndiceNomes(self.conn)
+        # Conexões auxiliares (ex.: thread de manutenção) usam o esquema já migrado pelo escritor
+        if not somente_leitura and preparar_esquema:
+            self.criar_tabelas()
+            self.migrar_dados_vazios()
+
+    def fechar(self):
+        self.conn.close()
+
+    @classmethod
+    def criar_indices_visitas(cls, conn):
+        for nome, expressao in cls.INDICES_VISITAS:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON detalhes_visitas({expressao})")
+
+    @staticmethod
+    def caminho_arquivo(db_path):
+        return os.path.splitext(db_path)[0] + "_arquivo.db"
+
+    @staticmethod
+    def uri_somente_leitura(caminho):
+        return pathlib.Path(caminho).absolute().as_uri() + "?mode=ro"
+
+    @classmethod
+    def preparar_conexao(cls, conn, db_path, somente_leitura=False):
+        """
+        Anexa o banco de arquivo (visitas antigas, conteúdo comprimido) e cria a
+        view temporária visitas_todas, que enxerga as duas bases como uma só.
+        """
+        conn.create_function("comprimir", 1, lambda t: zlib.compress(t.encode("utf-8")) if t is not None else None, deterministic=True)
+        conn.create_function("descomprimir", 1, lambda b: zlib.decompress(b).decode("utf-8") if b is not None else None, deterministic=True)
+        if somente_leitura:
+            # Conexões de leitura exigem uri=True; o arquivo já foi criado pela conexão principal
+            conn.execute("ATTACH DATABASE ? AS arquivo", (cls.uri_somente_leitura(cls.caminho_arquivo(db_path)),))
+        else:
+            conn.execute("ATTACH DATABASE ? AS arquivo", (cls.caminho_arquivo(db_path),))
+            cls.criar_tabelas_arquivo(conn)
+        # Se uma visita estiver nas duas bases (ex.: sincronizada depois de arquivada), vale a do banco principal
+        conn.execute('''
+            CREATE TEMP VIEW IF NOT EXISTS visitas_todas AS
+            SELECT visita_id, nome, cpf, horario, conteudo, url, data_captura, chave_visitante FROM main.detalhes_visitas
+            UNION ALL
+            SELECT a.visita_id, a.nome, a.cpf, a.horario, descomprimir(a.conteudo_zlib), a.url, a.data_captura, a.chave_visitante
+            FROM arquivo.visitas_arquivadas a
+            WHERE NOT EXISTS (SELECT 1 FROM main.detalhes_visitas d WHERE d.visita_id = a.visita_id)
+        ''')
+
+    @staticmethod
+    def criar_tabelas_arquivo(conn):
+        conn.execute("PRAGMA arquivo.auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA arquivo.journal_mode=WAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS arquivo.visitas_arquivadas (
+                visita_id INTEGER PRIMARY KEY,
+                nome TEXT,
+                cpf TEXT,
+                horario TEXT,
+                conteudo_zlib BLOB,
+                url TEXT,
+                data_captura TIMESTAMP,
+                hash_conteudo TEXT,
+                origem TEXT,
+                chave_visitante TEXT
+            )
+        ''')
+        colunas = [col[1] for col in conn.execute("PRAGMA arquivo.table_info(visitas_arquivadas)")]
+        if 'chave_visitante' not in colunas:
+            conn.execute("ALTER TABLE arquivo.visitas_arquivadas ADD COLUMN chave_visitante TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS arquivo.idx_arq_nome ON visitas_arquivadas(nome)")
+        conn.execute("CREATE INDEX IF NOT EXISTS arquivo.idx_arq_cpf ON visitas_arquivadas(cpf)")
+        conn.execute("CREATE INDEX IF NOT EXISTS arquivo.idx_arq_visitante ON visitas_arquivadas(chave_visitante)")
+
+    @classmethod
+    def abrir_conexao_leitura(cls, db_path, somente_leitura=False):
+        """Conexão avulsa (ex.: outra thread) já com o arquivo anexado"""
+        if somente_leitura:
+            conn = sqlite3.connect(cls.uri_somente_leitura(db_path), uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(db_path)
+        cls.preparar_conexao(conn, db_path, somente_leitura)
+        return conn
+
+    def arquivar_lote(self, dias, lote=500):
+        """
+        Move para o banco de arquivo, comprimidas, até `lote` visitas expiradas há
+        mais de `dias` dias. Retorna quantas foram movidas.
+        """
+        limite = (datetime.date.today() - datetime.timedelta(days=dias)).isoformat()
+        self.cursor.execute(f'''
+            SELECT visita_id FROM detalhes_visitas
+            WHERE ({self.SQL_DATA_FIM} < ? AND horario != 'N/A')
+               OR (horario = 'N/A' AND data_captura < ?)
+            LIMIT ?
+        ''', (limite, limite, lote))
+        ids = [(r[0],) for r in self.cursor.fetchall()]
+        if not ids: return 0
+        # Cópia antes da remoção: em WAL a transação não é atômica entre bancos anexados,
+        # e uma queda no meio deixa no máximo uma duplicata (resolvida pela view)
+        self.cursor.executemany('''
+            INSERT OR REPLACE INTO arquivo.visitas_arquivadas
+                (visita_id, nome, cpf, horario, conteudo_zlib, url, data_captura, hash_conteudo, origem, chave_visitante)
+            SELECT visita_id, nome, cpf, horario, comprimir(conteudo), url, data_captura, hash_conteudo, origem, chave_visitante
+            FROM main.detalhes_visitas WHERE visita_id = ?
+        ''', ids)
+        self.conn.commit()
+        self.cursor.executemany("DELETE FROM main.detalhes_visitas WHERE visita_id = ?", ids)
+        self.conn.commit()
+        return len(ids)
+
+    def existe_visita(self, visita_id):
+        self.cursor.execute("SELECT 1 FROM visitas_todas WHERE visita_id = ?", (visita_id,))
+        return self.cursor.fetchone() is not None
+
+    def obter_visita(self, visita_id):
+        """(visita_id, nome, cpf, horario, conteudo, url, data_captura) do banco principal ou do arquivo"""
+        self.cursor.execute("SELECT visita_id, nome, cpf, horario, conteudo, url, data_captura FROM visitas_todas WHERE visita_id = ?", (visita_id,))
+        return self.cursor.fetchone()
 
     def reprocessar_dados_existentes(self):
         self.cursor.execute("SELECT visita_id, conteudo FROM detalhes_visitas")
@@ -483,43 +2555,606 @@ class DatabaseHandler:
             self.cursor.execute("ALTER TABLE detalhes_visitas ADD COLUMN cpf TEXT")
         if 'horario' not in columns:
             self.cursor.execute("ALTER TABLE detalhes_visitas ADD COLUMN horario TEXT")
+        if 'origem' not in columns:
+            # Estação de onde veio a versão atual da linha (NULL = capturada aqui)
+            self.cursor.execute("ALTER TABLE detalhes_visitas ADD COLUMN origem TEXT")
+        if 'hash_conteudo' not in columns:
+            self.cursor.execute("ALTER TABLE detalhes_visitas ADD COLUMN hash_conteudo TEXT")
+        if 'chave_visitante' not in columns:
+            self.cursor.execute("ALTER TABLE detalhes_visitas ADD COLUMN chave_visitante TEXT")
+        if 'seq_alteracao' not in columns:
+            # Número crescente da última alteração local; marca d'água da sincronização
+            self.cursor.execute("ALTER TABLE detalhes_visitas ADD COLUMN seq_alteracao INTEGER")
+
+        self.criar_indices_visitas(self.conn)
+
+        # Uma linha por pessoa (CPF normalizado ou, sem CPF, nome normalizado), derivada das visitas
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS visitantes (
+                chave TEXT PRIMARY KEY,
+                nome TEXT,
+                cpf TEXT,
+                total_visitas INTEGER,
+                primeira_visita_id INTEGER,
+                ultima_visita_id INTEGER,
+                primeira_data TEXT,
+                validade_fim TEXT,
+                horario_atual TEXT
+            )
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_visitantes_nome ON visitantes(nome)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_visitantes_cpf ON visitantes(cpf)")
 
-        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_nome ON detalhes_visitas(nome)")
-        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_cpf ON detalhes_visitas(cpf)")
-        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_horario ON detalhes_visitas(horario)")
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS historico_visitas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                visita_id INTEGER,
+                campo TEXT,
+                valor_antigo TEXT,
+                valor_novo TEXT,
+                data_alteracao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_historico_visita ON historico_visitas(visita_id)")
+
+        # Visitas cujos índices derivados ainda precisam ser (re)calculados em segundo plano
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS pendencias_indice (visita_id INTEGER PRIMARY KEY)")
+        self.indice_nomes.criar_tabelas()
+
+        # Estatísticas de movimento materializadas; estatisticas_contribuicao guarda o que
+        # cada visita soma hoje, para que reprocessar uma visita nunca conte em dobro
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS estatisticas_contribuicao (
+                visita_id INTEGER PRIMARY KEY,
+                dia TEXT,
+                hora INTEGER,
+                anfitriao TEXT
+            )
+        ''')
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS estatisticas_dia (dia TEXT PRIMARY KEY, visitas INTEGER)")
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS estatisticas_hora (dia TEXT, hora INTEGER, visitas INTEGER, PRIMARY KEY (dia, hora))")
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS estatisticas_anfitriao (anfitriao TEXT PRIMARY KEY, visitas INTEGER)")
+
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS manutencao_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tarefa TEXT,
+                inicio TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                duracao_ms INTEGER,
+                bytes_recuperados INTEGER,
+                resultado TEXT
+            )
+        ''')
+
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS metadados (
+                chave TEXT PRIMARY KEY,
+                valor TEXT
+            )
+        ''')
+
+        if versao < 1:
+            self.reprocessar_dados_existentes()
+            self.cursor.execute("PRAGMA user_version = 1")
+        if versao < 2:
+            self.calcular_hashes_existentes()
+            self.cursor.execute("PRAGMA user_version = 2")
+        if versao < 3:
+            self.cursor.execute("INSERT OR IGNORE INTO pendencias_indice (visita_id) SELECT visita_id FROM detalhes_visitas")
+            self.cursor.execute("PRAGMA user_version = 3")
+        if versao < 4:
+            # chave_visitante e a tabela visitantes são preenchidas pela fila em segundo plano
+            self.cursor.execute("INSERT OR IGNORE INTO pendencias_indice (visita_id) SELECT visita_id FROM visitas_todas")
+            self.cursor.execute("PRAGMA user_version = 4")
+        if versao < 5:
+            self.cursor.execute("INSERT OR IGNORE INTO pendencias_indice (visita_id) SELECT visita_id FROM visitas_todas")
+            self.cursor.execute("PRAGMA user_version = 5")
+        if versao < 6:
+            self.numerar_alteracoes_existentes()
+            self.cursor.execute("PRAGMA user_version = 6")
+        self.conn.commit()
+
+    def numerar_alteracoes_existentes(self):
+        """
+        Migração da marca d'água (data_captura, visita_id) para seq_alteracao: numera
+        as linhas locais na ordem antiga e converte a marca já exportada.
+        """
+        self.cursor.execute("DROP INDEX IF EXISTS idx_data_captura")
+        self.cursor.execute("SELECT visita_id, COALESCE(data_captura, '') FROM detalhes_visitas WHERE origem IS NULL ORDER BY COALESCE(data_captura, ''), visita_id")
+        linhas = self.cursor.fetchall()
+        marca = tuple(json.loads(self.get_meta("sync_exportado_ate", '["", 0]')))
+        exportado = sum(1 for vid, data in linhas if (data, vid) <= marca)
+        self.cursor.executemany("UPDATE detalhes_visitas SET seq_alteracao = ? WHERE visita_id = ?",
+                                [(seq, vid) for seq, (vid, _) in enumerate(linhas, 1)])
+        self.cursor.execute("INSERT OR REPLACE INTO metadados (chave, valor) VALUES ('sync_sequencia', ?)", (str(len(linhas)),))
+        self.cursor.execute("INSERT OR REPLACE INTO metadados (chave, valor) VALUES ('sync_exportado_seq', ?)", (str(exportado),))
+        self.cursor.execute("DELETE FROM metadados WHERE chave = 'sync_exportado_ate'")
+
+    def proxima_sequencia(self):
+        """Próximo seq_alteracao; guardado em metadados para nunca ser reutilizado (nem após arquivar)"""
+        seq = int(self.get_meta("sync_sequencia", 0)) + 1
+        # Sem commit: entra na mesma transação da gravação da visita
+        self.cursor.execute("INSERT OR REPLACE INTO metadados (chave, valor) VALUES ('sync_sequencia', ?)", (str(seq),))
+        return seq
+
+    def processar_pendencias(self, lote=500):
+        """Processa um lote da fila de índices derivados. Retorna True se ainda restar trabalho."""
+        self.cursor.execute('''
+            SELECT p.visita_id, d.nome, d.cpf, d.chave_visitante, d.conteudo FROM pendencias_indice p
+            LEFT JOIN visitas_todas d ON d.visita_id = p.visita_id
+            ORDER BY p.visita_id DESC LIMIT ?
+        ''', (lote,))
+        registros = self.cursor.fetchall()
+        if not registros: return False
+        afetados = set()
+        for vid, nome, cpf, chave_atual, conteudo in registros:
+            self.atualizar_estatisticas(vid, conteudo)
+            if nome is None:
+                self.indice_nomes.remover(vid)
+                continue
+            self.indice_nomes.indexar(vid, nome)
+            chave = self.chave_visitante(nome, cpf)
+            if chave != chave_atual:
+                self.cursor.execute("UPDATE main.detalhes_visitas SET chave_visitante = ? WHERE visita_id = ?", (chave, vid))
+                self.cursor.execute("UPDATE arquivo.visitas_arquivadas SET chave_visitante = ? WHERE visita_id = ?", (chave, vid))
+            # Linhas sincronizadas podem ter mudado datas sem mudar a chave: recalcula mesmo assim
+            afetados.update({chave, chave_atual})
+        self.recalcular_visitantes(afetados)
+        self.cursor.executemany("DELETE FROM pendencias_indice WHERE visita_id = ?", [(r[0],) for r in registros])
+        self.conn.commit()
+        return len(registros) == lote
+
+    def atualizar_estatisticas(self, visita_id, conteudo):
+        """
+        Troca a contribuição antiga da visita pela atual nas tabelas de estatísticas
+        (não faz commit). Idempotente: sem mudança, nada é escrito.
+        """
+        nova = None
+        if conteudo is not None:
+            dia, hora = self.extrair_inicio(conteudo)
+            if dia: nova = (dia, hora, self.extrair_anfitriao(conteudo))
+        self.cursor.execute("SELECT dia, hora, anfitriao FROM estatisticas_contribuicao WHERE visita_id = ?", (visita_id,))
+        antiga = self.cursor.fetchone()
+        if antiga == nova: return
+        for contribuicao, delta in ((antiga, -1), (nova, 1)):
+            if not contribuicao: continue
+            dia, hora, anfitriao = contribuicao
+            self.cursor.execute("INSERT INTO estatisticas_dia (dia, visitas) VALUES (?, ?) ON CONFLICT(dia) DO UPDATE SET visitas = visitas + excluded.visitas", (dia, delta))
+            self.cursor.execute("INSERT INTO estatisticas_hora (dia, hora, visitas) VALUES (?, ?, ?) ON CONFLICT(dia, hora) DO UPDATE SET visitas = visitas + excluded.visitas", (dia, hora, delta))
+            self.cursor.execute("INSERT INTO estatisticas_anfitriao (anfitriao, visitas) VALUES (?, ?) ON CONFLICT(anfitriao) DO UPDATE SET visitas = visitas + excluded.visitas", (anfitriao, delta))
+        if antiga:
+            self.cursor.execute("DELETE FROM estatisticas_dia WHERE dia = ? AND visitas <= 0", (antiga[0],))
+            self.cursor.execute("DELETE FROM estatisticas_hora WHERE dia = ? AND hora = ? AND visitas <= 0", antiga[:2])
+            self.cursor.execute("DELETE FROM estatisticas_anfitriao WHERE anfitriao = ? AND visitas <= 0", (antiga[2],))
+        if nova:
+            self.cursor.execute("INSERT OR REPLACE INTO estatisticas_contribuicao (visita_id, dia, hora, anfitriao) VALUES (?, ?, ?, ?)", (visita_id,) + nova)
+        else:
+            self.cursor.execute("DELETE FROM estatisticas_contribuicao WHERE visita_id = ?", (visita_id,))
+
+    def estatisticas_por_dia(self, dias=30):
+        inicio = (datetime.date.today() - datetime.timedelta(days=dias - 1)).isoformat()
+        self.cursor.execute("SELECT dia, visitas FROM estatisticas_dia WHERE dia BETWEEN ? AND ? ORDER BY dia", (inicio, datetime.date.today().isoformat()))
+        return self.cursor.fetchall()
+
+    def estatisticas_por_hora(self):
+        """Visitas por hora do dia (início previsto), somadas em todo o histórico"""
+        self.cursor.execute("SELECT hora, SUM(visitas) FROM estatisticas_hora GROUP BY hora ORDER BY hora")
+        return self.cursor.fetchall()
+
+    def estatisticas_por_anfitriao(self, limite=15):
+        self.cursor.execute("SELECT anfitriao, visitas FROM estatisticas_anfitriao ORDER BY visitas DESC LIMIT ?", (limite,))
+        return self.cursor.fetchall()
+
+    def resumo_estatisticas(self):
+        self.cursor.execute("SELECT COALESCE(SUM(visitas), 0) FROM estatisticas_dia")
+        total = self.cursor.fetchone()[0]
+        self.cursor.execute("SELECT dia, visitas FROM estatisticas_dia ORDER BY visitas DESC, dia DESC LIMIT 1")
+        pico_dia = self.cursor.fetchone()
+        self.cursor.execute("SELECT hora, SUM(visitas) AS total FROM estatisticas_hora GROUP BY hora ORDER BY total DESC LIMIT 1")
+        pico_hora = self.cursor.fetchone()
+        return {"total": total, "pico_dia": pico_dia, "pico_hora": pico_hora}
+
+    @staticmethod
+    def chave_visitante(nome, cpf):
+        """CPF/documento só com letras e dígitos; sem documento, o nome normalizado"""
+        documento = re.sub(r'[^0-9A-Z]', '', (cpf or "").upper())
+        if documento and documento != "NA":
+            return f"doc:{documento}"
+        nome_norm = " ".join(IndiceNomes.normalizar(nome or "").split())
+        if not nome_norm or nome_norm == "desconhecido": return None
+        return f"nome:{nome_norm}"
+
+    def recalcular_visitantes(self, chaves):
+        """Refaz os agregados só das pessoas afetadas (não faz commit)"""
+        for chave in chaves:
+            if not chave: continue
+            self.cursor.execute(f'''
+                SELECT COUNT(*), MIN(visita_id), MAX(visita_id),
+                       MIN(CASE WHEN horario != 'N/A' THEN {self.SQL_DATA_INICIO} END),
+                       MAX(CASE WHEN horario != 'N/A' THEN {self.SQL_DATA_FIM} END)
+                FROM visitas_todas WHERE chave_visitante = ?
+            ''', (chave,))
+            total, primeira, ultima, primeira_data, validade_fim = self.cursor.fetchone()
+            if not total:
+                self.cursor.execute("DELETE FROM visitantes WHERE chave = ?", (chave,))
+                continue
+            self.cursor.execute("SELECT nome, cpf FROM visitas_todas WHERE visita_id = ?", (ultima,))
+            nome, cpf = self.cursor.fetchone()
+            # Validade atual = a visita que termina por último, não necessariamente a de maior ID
+            self.cursor.execute(f'''
+                SELECT horario FROM visitas_todas WHERE chave_visitante = ? AND horario != 'N/A'
+                ORDER BY {self.SQL_DATA_FIM} DESC LIMIT 1
+            ''', (chave,))
+            res = self.cursor.fetchone()
+            horario = res[0] if res else "N/A"
+            self.cursor.execute('''
+                INSERT OR REPLACE INTO visitantes
+                    (chave, nome, cpf, total_visitas, primeira_visita_id, ultima_visita_id, primeira_data, validade_fim, horario_atual)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (chave, (nome or "").strip(), cpf, total, primeira, ultima, primeira_data, validade_fim, horario))
+
+    def calcular_hashes_existentes(self):
+        leitura = self.conn.cursor()
+        leitura.execute("SELECT visita_id, conteudo FROM detalhes_visitas WHERE hash_conteudo IS NULL")
+        while True:
+            lote = leitura.fetchmany(1000)
+            if not lote: break
+            self.cursor.executemany("UPDATE detalhes_visitas SET hash_conteudo = ? WHERE visita_id = ?",
+                                    [(self.calcular_hash(conteudo), vid) for vid, conteudo in lote])
+
+    @staticmethod
+    def calcular_hash(conteudo):
+        # Espaços são normalizados para que variações de layout não contem como alteração
+        normalizado = " ".join((conteudo or "").split())
+        return hashlib.sha1(normalizado.encode("utf-8")).hexdigest()
+
+    def salvar_visita(self, visita_id, nome, cpf, horario, conteudo, url):
+        """
+        Retorna "nova", "alterada" ou "inalterada" (False em caso de erro).
+        Quando o hash do conteúdo não mudou nada é escrito; quando mudou, a linha
+        é atualizada no lugar e os campos alterados vão para historico_visitas.
+        Visitas novas e alteradas são publicadas em self.eventos.
+        """
+        try:
+            hash_novo = self.calcular_hash(conteudo)
+            chave = self.chave_visitante(nome, cpf)
+            self.cursor.execute("SELECT nome, cpf, horario, hash_conteudo, chave_visitante FROM detalhes_visitas WHERE visita_id = ?", (visita_id,))
+            atual = self.cursor.fetchone()
+            if atual is None:
+                self.cursor.execute('INSERT INTO detalhes_visitas (visita_id, nome, cpf, horario, conteudo, url, hash_conteudo, chave_visitante, seq_alteracao) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                   (visita_id, nome, cpf, horario, conteudo, url, hash_novo, chave, self.proxima_sequencia()))
+                self.indice_nomes.indexar(visita_id, nome)
+                self.recalcular_visitantes({chave})
+                self.atualizar_estatisticas(visita_id, conteudo)
+                resultado = "nova"
+            elif atual[3] == hash_novo:
+                return "inalterada"
+            else:
+                self.cursor.execute('''
+                    UPDATE detalhes_visitas SET nome = ?, cpf = ?, horario = ?, conteudo = ?, url = ?,
+                        hash_conteudo = ?, data_captura = CURRENT_TIMESTAMP, origem = NULL, chave_visitante = ?, seq_alteracao = ?
+                    WHERE visita_id = ?
+                ''', (nome, cpf, horario, conteudo, url, hash_novo, chave, self.proxima_sequencia(), visita_id))
+                self.recalcular_visitantes({chave, atual[4]})
+                self.atualizar_estatisticas(visita_id, conteudo)
+                alteracoes = [(visita_id, campo, antigo, novo)
+                              for campo, antigo, novo in zip(("nome", "cpf", "horario"), atual[:3], (nome, cpf, horario))
+                              if antigo != novo]
+                if atual[0] != nome:
+                    self.indice_nomes.indexar(visita_id, nome)
+                if not alteracoes:
+                    alteracoes = [(visita_id, "conteudo", atual[3], hash_novo)]
+                self.cursor.executemany("INSERT INTO historico_visitas (visita_id, campo, valor_antigo, valor_novo) VALUES (?, ?, ?, ?)", alteracoes)
+                resultado = "alterada"
+            self.conn.commit()
+            self.geracao += 1
+            self.eventos.publicar(f"visita_{resultado}", {
+                "visita_id": visita_id, "nome": nome, "cpf": cpf, "horario": horario,
+                "campos_alterados": [a[1] for a in alteracoes] if atual else [],
+            })
+            return resultado
+        except Exception as e:
+            # Nada do que já foi escrito pode ficar pendurado para o próximo commit
+            self.conn.rollback()
+            print(f"❌ Erro ao salvar visita {visita_id}: {e}")
+            return False
+
+    def proxima_para_revalidar(self, apos_id, dias_antecedencia=2):
+        """Próxima visita (após `apos_id`) ainda válida ou que começa em breve"""
+        hoje = datetime.date.today()
+        limite = (hoje + datetime.timedelta(days=dias_antecedencia)).isoformat()
+        self.cursor.execute(f'''
+            SELECT visita_id FROM detalhes_visitas
+            WHERE {self.SQL_DATA_FIM} >= ? AND horario != 'N/A' AND visita_id > ? AND {self.SQL_DATA_INICIO} <= ?
+            ORDER BY visita_id LIMIT 1
+        ''', (hoje.isoformat(), apos_id, limite))
+        res = self.cursor.fetchone()
+        return res[0] if res else None
+
+    def get_meta(self, chave, padrao=None):
+        self.cursor.execute("SELECT valor FROM metadados WHERE chave = ?", (chave,))
+        res = self.cursor.fetchone()
+        return res[0] if res else padrao
+
+    def set_meta(self, chave, valor):
+        self.cursor.execute("INSERT OR REPLACE INTO metadados (chave, valor) VALUES (?, ?)", (chave, str(valor)))
+        self.conn.commit()
+
+    # === MANUTENÇÃO ===
+    # (tarefa, intervalo em horas); a conversão de auto_vacuum roda uma única vez
+    TAREFAS_MANUTENCAO = [
+        ("converter_auto_vacuum", None),
+        ("analisar", 24 * 7),
+        ("otimizar", 6),
+        ("vacuo_incremental", 1),
+        ("integridade", 24),
+        ("backup", 24),
+    ]
+    BACKUPS_MANTER = 7
+    # Tarefa interrompida pelo orçamento (ou com erro) volta depois de 1 h, com o
+    # orçamento dobrado a cada interrupção seguida, até este teto
+    INTERVALO_NOVA_TENTATIVA_S = 3600
+    ORCAMENTO_MAXIMO_S = 120.0
+    # O VACUUM completo bloqueia as gravações da captura enquanto dura: nunca roda
+    # na manutenção ociosa, só pelo botão de manutenção das configurações
+    TAREFAS_EXPLICITAS = ("converter_auto_vacuum",)
+
+    def tarefas_pendentes(self):
+        pendentes = []
+        agora = time.time()
+        for tarefa, horas in self.TAREFAS_MANUTENCAO:
+            if horas is None:
+                if any(self.conn.execute(f"PRAGMA {esquema}.auto_vacuum").fetchone()[0] != 2 for esquema in ("main", "arquivo")):
+                    pendentes.append(tarefa)
+            elif agora - float(self.get_meta(f"manutencao_{tarefa}", 0)) >= horas * 3600:
+                if agora - float(self.get_meta(f"manutencao_{tarefa}_tentativa", 0)) >= self.INTERVALO_NOVA_TENTATIVA_S:
+                    pendentes.append(tarefa)
+        return pendentes
+
+    def selecionar_tarefas(self, completa=False):
+        """Tarefas de uma rodada: todas (pedido explícito) ou a próxima vencida (ociosa)"""
+        pendentes = self.tarefas_pendentes()
+        if completa:
+            return [t for t, _ in self.TAREFAS_MANUTENCAO if t not in self.TAREFAS_EXPLICITAS or t in pendentes]
+        return [t for t in pendentes if t not in self.TAREFAS_EXPLICITAS][:1]
+
+    @staticmethod
+    def manutencao_concluida(resultado):
+        return resultado != "interrompida por tempo" and not resultado.startswith("erro")
+
+    def tamanho_bancos(self):
+        total = 0
+        for esquema in ("main", "arquivo"):
+            paginas = self.conn.execute(f"PRAGMA {esquema}.page_count").fetchone()[0]
+            total += paginas * self.conn.execute(f"PRAGMA {esquema}.page_size").fetchone()[0]
+        return total
+
+    def executar_manutencao(self, orcamento=2.0, tarefas=None):
+        """
+        Executa a próxima tarefa vencida (ou as `tarefas` indicadas), limitando as
+        consultas longas a `orcamento` segundos. Cada execução vai para manutencao_log;
+        só as concluídas renovam o prazo da tarefa.
+        Retorna a lista de (tarefa, duracao_ms, bytes_recuperados, resultado).
+        """
+        if tarefas is None:
+            tarefas = self.tarefas_pendentes()[:1]
+        registros = []
+        for tarefa in tarefas:
+            antes = self.tamanho_bancos()
+            interrupcoes = int(self.get_meta(f"manutencao_{tarefa}_interrupcoes", 0))
+            inicio = time.monotonic()
+            limite = inicio + min(orcamento * 2 ** interrupcoes, self.ORCAMENTO_MAXIMO_S)
+            self.conn.set_progress_handler(lambda: time.monotonic() > limite, 10000)
+            try:
+                resultado = getattr(self, f"manutencao_{tarefa}")()
+            except sqlite3.OperationalError as e:
+                resultado = "interrompida por tempo" if "interrupt" in str(e) else f"erro: {e}"
+            except Exception as e:
+                resultado = f"erro: {e}"
+            finally:
+                self.conn.set_progress_handler(None, 0)
+            registro = (tarefa, int((time.monotonic() - inicio) * 1000), max(0, antes - self.tamanho_bancos()), resultado)
+            self.cursor.execute("INSERT INTO manutencao_log (tarefa, duracao_ms, bytes_recuperados, resultado) VALUES (?, ?, ?, ?)", registro)
+            if self.manutencao_concluida(resultado):
+                self.cursor.execute("DELETE FROM metadados WHERE chave IN (?, ?)", (f"manutencao_{tarefa}_interrupcoes", f"manutencao_{tarefa}_tentativa"))
+                self.set_meta(f"manutencao_{tarefa}", time.time())
+            else:
+                self.set_meta(f"manutencao_{tarefa}_interrupcoes", interrupcoes + 1)
+                self.set_meta(f"manutencao_{tarefa}_tentativa", time.time())
+            registros.append(registro)
+        return registros
+
+    def manutencao_converter_auto_vacuum(self):
+        # VACUUM completo, uma única vez por banco, para habilitar o vácuo incremental
+        self.conn.set_progress_handler(None, 0)
+        self.conn.commit()
+        for esquema in ("main", "arquivo"):
+            if self.conn.execute(f"PRAGMA {esquema}.auto_vacuum").fetchone()[0] != 2:
+                self.conn.execute(f"PRAGMA {esquema}.auto_vacuum=INCREMENTAL")
+                self.conn.execute(f"VACUUM {esquema}")
+        return "ok"
+
+    def manutencao_analisar(self):
+        # analysis_limit mantém o ANALYZE rápido mesmo em tabelas grandes
+        self.conn.execute("PRAGMA analysis_limit=1000")
+        self.conn.execute("ANALYZE main")
+        self.conn.execute("ANALYZE arquivo")
+        self.conn.commit()
+        return "ok"
+
+    def manutencao_otimizar(self):
+        self.conn.execute("PRAGMA optimize")
+        self.conn.commit()
+        return "ok"
+
+    def manutencao_vacuo_incremental(self, paginas=2000):
+        liberadas = 0
+        for esquema in ("main", "arquivo"):
+            livres = self.conn.execute(f"PRAGMA {esquema}.freelist_count").fetchone()[0]
+            if livres:
+                # execute() avança o PRAGMA um único passo (uma página); executescript roda até o fim
+                self.conn.executescript(f"PRAGMA {esquema}.incremental_vacuum({min(livres, paginas)})")
+                liberadas += min(livres, paginas)
+        self.conn.commit()
+        return f"{liberadas} páginas liberadas"
+
+    def manutencao_integridade(self):
+        resultados = [r[0] for esquema in ("main", "arquivo") for r in self.conn.execute(f"PRAGMA {esquema}.quick_check").fetchall()]
+        problemas = [r for r in resultados if r != "ok"]
+        return "ok" if not problemas else "PROBLEMAS: " + "; ".join(problemas[:5])
+
+    def manutencao_backup(self):
+        """Cópia online pela API de backup do SQLite (consistente mesmo com a captura gravando)"""
+        self.conn.set_progress_handler(None, 0)
+        pasta = pasta_dados_app("backups")
+        base = os.path.splitext(os.path.basename(self.db_path))[0]
+        carimbo = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        for esquema, sufixo in (("main", ""), ("arquivo", "_arquivo")):
+            destino = os.path.join(pasta, f"{base}_{carimbo}{sufixo}.db")
+            temporario = destino + ".tmp"
+            alvo = sqlite3.connect(temporario)
+            try:
+                self.conn.backup(alvo, name=esquema)
+                # A cópia herda o WAL; volta ao journal comum para ser um arquivo único
+                alvo.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                alvo.close()
+            os.replace(temporario, destino)
+        # Mantém só os backups mais recentes
+        for sufixo in ("", "_arquivo"):
+            copias = sorted(f for f in os.listdir(pasta) if re.fullmatch(rf"{re.escape(base)}_\d{{8}}_\d{{6}}{sufixo}\.db", f))
+            for antigo in copias[:-self.BACKUPS_MANTER]:
+                os.remove(os.path.join(pasta, antigo))
+        return f"backup em {pasta}"
+
+    def ultimas_manutencoes(self, limite=10):
+        self.cursor.execute("SELECT tarefa, inicio, duracao_ms, bytes_recuperados, resultado FROM manutencao_log ORDER BY id DESC LIMIT ?", (limite,))
+        return self.cursor.fetchall()
+
+    # === SINCRONIZAÇÃO ENTRE ESTAÇÕES ===
+    def get_id_estacao(self):
+        """Identificador desta base na troca de changesets (gerado uma única vez)"""
+        estacao = self.get_meta("sync_estacao")
+        if not estacao:
+            estacao = uuid.uuid4().hex[:12]
+            self.set_meta("sync_estacao", estacao)
+        return estacao
+
+    def estado_sincronizacao(self):
+        """
+        Marcas d'água lidas no escritor e entregues ao SincronizadorEstacoes:
+        (id da estação, último seq_alteracao exportado, {origem: último changeset recebido}).
+        """
+        estacao = self.get_id_estacao()
+        self.cursor.execute("SELECT chave, valor FROM metadados WHERE chave LIKE 'sync_recebido_%'")
+        recebidos = {chave[len("sync_recebido_"):]: valor for chave, valor in self.cursor.fetchall()}
+        return estacao, int(self.get_meta("sync_exportado_seq", 0)), recebidos
 
-        if versao < 1:
-            self.reprocessar_dados_existentes()
-            self.cursor.execute("PRAGMA user_version = 1")
+    @staticmethod
+    def limpar_changesets_antigos(pasta, estacao, dias=30):
+        limite = time.time() - dias * 86400
+        for nome_arq in os.listdir(pasta):
+            if nome_arq.startswith(estacao + "_") and nome_arq.endswith(".jsonl.gz"):
+                caminho = os.path.join(pasta, nome_arq)
+                try:
+                    if os.path.getmtime(caminho) < limite:
+                        os.remove(caminho)
+                except OSError:
+                    pass
+
+    def aplicar_lote_externo(self, linhas, origem):
+        if not linhas: return 0
+        antes = self.conn.total_changes
+        self.cursor.executemany('''
+            INSERT INTO detalhes_visitas (visita_id, nome, cpf, horario, conteudo, url, data_captura, origem, hash_conteudo)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(visita_id) DO UPDATE SET
+                nome = excluded.nome, cpf = excluded.cpf, horario = excluded.horario,
+                conteudo = excluded.conteudo, url = excluded.url, data_captura = excluded.data_captura,
+                origem = excluded.origem, hash_conteudo = excluded.hash_conteudo
+            -- Empate no mesmo segundo: vale o changeset aplicado por último (lidos em ordem)
+            WHERE COALESCE(excluded.data_captura, '') >= COALESCE(detalhes_visitas.data_captura, '')
+                AND excluded.hash_conteudo IS NOT detalhes_visitas.hash_conteudo
+        ''', [linha + [origem, self.calcular_hash(linha[4])] for linha in linhas])
+        self.cursor.executemany("INSERT OR IGNORE INTO pendencias_indice (visita_id) VALUES (?)", [(linha[0],) for linha in linhas])
         self.conn.commit()
+        aplicadas = self.conn.total_changes - antes
+        if aplicadas:
+            self.geracao += 1
+            self.eventos.publicar("visitas_sincronizadas", {"visita_ids": [linha[0] for linha in linhas], "aplicadas": aplicadas})
+        return aplicadas
 
-    def salvar_visita(self, visita_id, nome, cpf, horario, conteudo, url):
-        try:
-            self.cursor.execute('INSERT OR REPLACE INTO detalhes_visitas (visita_id, nome, cpf, horario, conteudo, url) VALUES (?, ?, ?, ?, ?, ?)',
-                               (visita_id, nome, cpf, horario, conteudo, url))
-            self.conn.commit()
-            return True
-        except Exception:
-            return False
+    def buscar_por_filtro(self, termos, limite=50):
+        if not termos: return []
+        # Termos só de letras saem do índice de nomes: evita varrer a tabela com LIKE '%termo%'
+        termos_nome = [IndiceNomes.normalizar(t).strip() for t in termos]
+        if all(t.isalpha() and len(n) >= 2 and " " not in n for t, n in zip(termos, termos_nome)):
+            ids = self.indice_nomes.buscar(termos_nome, limite)
+            if ids is not None:
+                # Visitas ainda na fila do índice (importadas ou sincronizadas há pouco) são conferidas direto
+                pendentes = self.filtrar_like("pendencias_indice JOIN detalhes_visitas USING (visita_id) WHERE", termos, limite)
+                vistos = {r[0] for r in pendentes}
+                pendentes += [r for r in self.filtrar_like("pendencias_indice JOIN arquivo.visitas_arquivadas USING (visita_id) WHERE",
+                                                           termos, limite) if r[0] not in vistos]
+                pendentes = sorted(pendentes, reverse=True)[:limite]
+                vistos = {r[0] for r in pendentes}
+                ids = [vid for vid in ids if vid not in vistos][:limite - len(pendentes)]
+                if not ids: return pendentes
+                self.cursor.execute(f"SELECT visita_id, nome, cpf, horario FROM visitas_todas WHERE visita_id IN ({','.join('?' * len(ids))})", ids)
+                por_id = {r[0]: r for r in self.cursor.fetchall()}
+                return pendentes + [por_id[vid] for vid in ids if vid in por_id]
+
+        # CPF, termos curtos ou genéricos: termos comuns acham a página logo no início da varredura
+        resultados = self.filtrar_like("detalhes_visitas WHERE", termos, limite)
+        # O arquivo só é consultado quando o banco principal não preenche a página
+        if len(resultados) < limite:
+            vistos = {r[0] for r in resultados}
+            resultados += [r for r in self.filtrar_like("arquivo.visitas_arquivadas WHERE", termos, limite - len(resultados))
+                           if r[0] not in vistos]
+        return resultados
+
+    def filtrar_like(self, origem, termos, limite):
+        """Visitas de `origem` (tabela + início do WHERE) cujo nome ou CPF contém todos os termos"""
+        conditions = " AND ".join("(nome LIKE ? OR cpf LIKE ?)" for _ in termos)
+        params = [p for t in termos for p in (f"%{t}%", f"%{t}%")]
+        self.cursor.execute(f"SELECT visita_id, nome, cpf, horario FROM {origem} {conditions} ORDER BY visita_id DESC LIMIT ?",
+                            params + [limite])
+        return self.cursor.fetchall()
 
-    def buscar_por_filtro(self, termos):
+    def buscar_visitantes(self, termos, limite=50):
+        """Uma linha por pessoa; completa com nomes parecidos como buscar_por_filtro"""
         if not termos: return []
-        query = "SELECT visita_id, nome, cpf, horario FROM detalhes_visitas WHERE "
-        conditions = []
-        params = []
-        for t in termos:
-            conditions.append("(nome LIKE ? OR cpf LIKE ?)")
-            params.extend([f"%{t}%", f"%{t}%"])
-        query += " AND ".join(conditions)
-        query += " ORDER BY visita_id DESC LIMIT 50"
-        self.cursor.execute(query, params)
+        campos = "chave, nome, cpf, total_visitas, primeira_data, validade_fim, horario_atual"
+        conditions = " AND ".join("(nome LIKE ? OR cpf LIKE ?)" for _ in termos)
+        params = [p for t in termos for p in (f"%{t}%", f"%{t}%")]
+        self.cursor.execute(f"SELECT {campos} FROM visitantes WHERE {conditions} ORDER BY ultima_visita_id DESC LIMIT ?", params + [limite])
+        resultados = self.cursor.fetchall()
+
+        termos_nome = [IndiceNomes.normalizar(t).strip() for t in termos]
+        if len(resultados) < limite and all(len(t) >= 3 and " " not in t for t in termos_nome):
+            ids = self.indice_nomes.buscar(termos_nome, limite * 4) or []
+            if ids:
+                vistos = {r[0] for r in resultados}
+                self.cursor.execute(f'''
+                    SELECT {campos} FROM visitantes WHERE chave IN (
+                        SELECT chave_visitante FROM visitas_todas WHERE visita_id IN ({','.join('?' * len(ids))})
+                    ) ORDER BY ultima_visita_id DESC
+                ''', ids)
+                resultados += [r for r in self.cursor.fetchall() if r[0] not in vistos][:limite - len(resultados)]
+        return resultados
+
+    def historico_visitante(self, chave, limite=50):
+        self.cursor.execute("SELECT visita_id, nome, cpf, horario FROM visitas_todas WHERE chave_visitante = ? ORDER BY visita_id DESC LIMIT ?", (chave, limite))
         return self.cursor.fetchall()
 
     def get_maior_id_salvo(self):
         try:
+            # O arquivo também conta: uma base só com visitas antigas não deve recomeçar do ID 1
             self.cursor.execute("SELECT MAX(visita_id) FROM detalhes_visitas")
             res = self.cursor.fetchone()
-            maior_id = res[0] if res[0] else 0
+            self.cursor.execute("SELECT MAX(visita_id) FROM arquivo.visitas_arquivadas")
+            res_arq = self.cursor.fetchone()
+            maior_id = max(res[0] or 0, res_arq[0] or 0)
             return maior_id
         except Exception as e:
             print(f"❌ Erro ao ler maior ID: {e}")
@@ -544,6 +3179,1167 @@ class DatabaseHandler:
         if not clean_nome: clean_nome = "Desconhecido"
         return clean_nome, cpf, horario
 
+    @staticmethod
+    def extrair_inicio(conteudo):
+        """(dia ISO, hora) do início previsto da visita, ou (None, None)"""
+        m_inicio = re.search(r"Horário:\s*(\d{2})/(\d{2})/(\d{4})\s+(\d{2}):\d{2}", conteudo or "")
+        if not m_inicio: return None, None
+        dia, mes, ano, hora = m_inicio.groups()
+        return f"{ano}-{mes}-{dia}", int(hora)
+
+    @staticmethod
+    def extrair_anfitriao(conteudo):
+        if not conteudo:
+            return "Desconhecido"
+        m_anfitriao = re.search(r"Anfitri[ãa]o:\s*([^\n\r]+)", conteudo, re.IGNORECASE)
+        anfitriao = m_anfitriao.group(1).strip(" -") if m_anfitriao else ""
+        return anfitriao or "Desconhecido"
+
+    @classmethod
+    def montar_filtro_exportacao(cls, filtros):
+        """Monta a cláusula WHERE (e parâmetros) usada pela exportação"""
+        conditions = []
+        params = []
+        if filtros.get("inicio") and filtros.get("fim"):
+            conditions.append(f"horario != 'N/A' AND {cls.SQL_DATA_INICIO} BETWEEN ? AND ?")
+            params.extend([filtros["inicio"], filtros["fim"]])
+        hoje = datetime.date.today().isoformat()
+        if filtros.get("validade") == "validas":
+            conditions.append(f"horario != 'N/A' AND {cls.SQL_DATA_FIM} >= ?")
+            params.append(hoje)
+        elif filtros.get("validade") == "expiradas":
+            conditions.append(f"horario != 'N/A' AND {cls.SQL_DATA_FIM} < ?")
+            params.append(hoje)
+        if filtros.get("nome"):
+            conditions.append("nome LIKE ?")
+            params.append(f"%{filtros['nome']}%")
+        where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+        return where, params
+
+# --- NOVA CLASSE: EXPORTAÇÃO EM SEGUNDO PLANO ---
+class EscritorCSV:
+    def __init__(self, caminho, colunas):
+        self.arquivo = open(caminho, "w", newline="", encoding="utf-8-sig")
+        self.writer = csv.writer(self.arquivo, delimiter=";")
+        self.writer.writerow(colunas)
+
+    def escrever(self, linhas):
+        self.writer.writerows(linhas)
+
+    def fechar(self):
+        self.arquivo.close()
+
+class EscritorParquet:
+    """Grava cada lote como um row group, sem acumular a tabela em memória"""
+    def __init__(self, caminho, colunas):
+        self.colunas = colunas
+        self.caminho = caminho
+        self.writer = None
+
+    def escrever(self, linhas):
+        if not linhas: return
+        dados = {col: [linha[i] for linha in linhas] for i, col in enumerate(self.colunas)}
+        tabela = pyarrow.Table.from_pydict(dados)
+        if self.writer is None:
+            # Colunas inteiramente nulas no primeiro lote viram texto para aceitar os lotes seguintes
+            schema = pyarrow.schema([
+                pyarrow.field(f.name, pyarrow.string()) if pyarrow.types.is_null(f.type) else f
+                for f in tabela.schema
+            ])
+            self.writer = pyarrow.parquet.ParquetWriter(self.caminho, schema, compression="zstd")
+        self.writer.write_table(tabela.cast(self.writer.schema))
+
+    def fechar(self):
+        if self.writer:
+            self.writer.close()
+
+class ExportadorVisitas(QThread):
+    """
+    Exporta as visitas (banco principal + arquivo) em lotes (fetchmany) para CSV ou Parquet,
+    gerando na mesma passada os agregados diário, mensal e por anfitrião.
+    Usa conexão própria, aberta dentro da thread. Os arquivos são gravados como
+    .tmp e só recebem o nome escolhido quando a exportação termina; em caso de
+    cancelamento ou erro os temporários são apagados.
+    """
+    progresso = pyqtSignal(int, int)
+    concluido = pyqtSignal(str)
+    erro = pyqtSignal(str)
+
+    TAMANHO_LOTE = 5000
+    COLUNAS = ["visita_id", "nome", "cpf", "horario", "url", "data_captura", "conteudo"]
+
+    def __init__(self, db_path, destino, formato, filtros, parent=None):
+        super().__init__(parent)
+        self.db_path = db_path
+        self.destino = destino
+        self.formato = formato
+        self.filtros = filtros
+        self.cancelado = False
+
+    def abrir_escritor(self, caminho, colunas):
+        temporario = caminho + ".tmp"
+        self.temporarios[temporario] = caminho
+        if self.formato == "parquet":
+            return EscritorParquet(temporario, colunas)
+        return EscritorCSV(temporario, colunas)
+
+    def caminho_agregado(self, sufixo):
+        base, ext = os.path.splitext(self.destino)
+        return f"{base}_{sufixo}{ext}"
+
+    def run(self):
+        conn = None
+        escritor = None
+        self.temporarios = {}
+        try:
+            conn = DatabaseHandler.abrir_conexao_leitura(self.db_path, somente_leitura=True)
+            where, params = DatabaseHandler.montar_filtro_exportacao(self.filtros)
+            total = conn.execute(f"SELECT COUNT(*) FROM visitas_todas{where}", params).fetchone()[0]
+            self.progresso.emit(0, total)
+
+            por_dia = {}
+            por_mes = {}
+            por_anfitriao = {}
+            feitos = 0
+
+            escritor = self.abrir_escritor(self.destino, self.COLUNAS)
+            cursor = conn.execute(f"SELECT {', '.join(self.COLUNAS)} FROM visitas_todas{where} ORDER BY visita_id", params)
+            while not self.cancelado:
+                lote = cursor.fetchmany(self.TAMANHO_LOTE)
+                if not lote: break
+                escritor.escrever(lote)
+
+                for vid, nome, cpf, horario, url, data_captura, conteudo in lote:
+                    dia = "Sem data"
+                    if horario and horario != "N/A":
+                        try:
+                            dia = datetime.datetime.strptime(horario.split(" - ")[0].strip(), "%d/%m/%Y").date().isoformat()
+                        except ValueError:
+                            pass
+                    por_dia[dia] = por_dia.get(dia, 0) + 1
+                    mes = dia[:7] if dia != "Sem data" else dia
+                    por_mes[mes] = por_mes.get(mes, 0) + 1
+
+                    anfitriao = DatabaseHandler.extrair_anfitriao(conteudo)
+                    resumo = por_anfitriao.setdefault(anfitriao, [0, None, None])
+                    resumo[0] += 1
+                    if dia != "Sem data":
+                        resumo[1] = min(resumo[1] or dia, dia)
+                        resumo[2] = max(resumo[2] or dia, dia)
+
+                feitos += len(lote)
+                self.progresso.emit(feitos, total)
+
+            escritor.fechar()
+            escritor = None
+            if self.cancelado:
+                self.erro.emit("Exportação cancelada pelo usuário.")
+                return
+
+            for sufixo, colunas, linhas in (
+                ("diario", ["dia", "visitas"], sorted(por_dia.items())),
+                ("mensal", ["mes", "visitas"], sorted(por_mes.items())),
+                ("anfitrioes", ["anfitriao", "visitas", "primeira_visita", "ultima_visita"],
+                 sorted(([a] + r for a, r in por_anfitriao.items()), key=lambda x: -x[1])),
+            ):
+                agregado = self.abrir_escritor(self.caminho_agregado(sufixo), colunas)
+                agregado.escrever([list(l) for l in linhas])
+                agregado.fechar()
+
+            for temporario, caminho in self.temporarios.items():
+                if os.path.exists(temporario):
+                    os.replace(temporario, caminho)
+            self.temporarios.clear()
+            self.concluido.emit(f"{feitos} visitas exportadas para {os.path.basename(self.destino)} (+ resumos diário, mensal e por anfitrião).")
+        except Exception as e:
+            self.erro.emit(str(e))
+        finally:
+            if escritor: escritor.fechar()
+            if conn: conn.close()
+            for temporario in self.temporarios:
+                try:
+                    os.remove(temporario)
+                except OSError:
+                    pass
+
+class ImportadorVisitas(QThread):
+    """
+    Mescla no banco ativo, em massa, outros bancos do aplicativo (.db, com o
+    _arquivo.db ao lado, se houver) e exportações CSV. Tudo passa primeiro por
+    uma tabela temporária (ATTACH + INSERT ... SELECT, sem replay linha a linha),
+    onde vence a data_captura mais recente; depois é mesclado por faixas curtas de
+    visita_id, com a mesma regra contra o banco ativo e o arquivo. Os índices do
+    banco ativo ficam no lugar (a captura continua gravando durante a mescla); os
+    índices derivados (nomes, visitantes, estatísticas) ficam para a fila em
+    segundo plano. Usa conexão própria, aberta dentro da thread.
+    """
+    progresso = pyqtSignal(int, int)
+    etapa = pyqtSignal(str)
+    concluido = pyqtSignal(str, int)
+    erro = pyqtSignal(str)
+
+    TAMANHO_LOTE = 20000
+    # Cada faixa da mescla é uma transação que segura a escrita da captura
+    TAMANHO_MESCLA = 1000
+    FOLGA_MINIMA_MS = 50
+    COLUNAS = ["visita_id", "nome", "cpf", "horario", "conteudo", "url", "data_captura"]
+    ORIGEM = "importacao"
+
+    def __init__(self, db_path, fontes, parent=None):
+        super().__init__(parent)
+        self.db_path = db_path
+        self.fontes = fontes
+        self.cancelado = False
+        self.feitos = 0
+        self.total = 0
+
+    @classmethod
+    def sql_upsert(cls, tabela, select):
+        atualizar = ", ".join(f"{c} = excluded.{c}" for c in cls.COLUNAS[1:])
+        return f'''
+            INSERT INTO {tabela} ({", ".join(cls.COLUNAS)}) {select}
+            ON CONFLICT(visita_id) DO UPDATE SET {atualizar}
+            WHERE COALESCE(excluded.data_captura, '') > COALESCE({tabela}.data_captura, '')
+        '''
+
+    def faixas(self, conn, tabela, tamanho=None):
+        """Percorre `tabela` em faixas (de, até] de visita_id com até `tamanho` (TAMANHO_LOTE) linhas"""
+        ultimo = -1
+        while not self.cancelado:
+            ate, quantidade = conn.execute(f'''
+                SELECT MAX(visita_id), COUNT(*) FROM (
+                    SELECT visita_id FROM {tabela} WHERE visita_id > ? ORDER BY visita_id LIMIT ?)
+            ''', (ultimo, tamanho or self.TAMANHO_LOTE)).fetchone()
+            if not quantidade: return
+            yield ultimo, ate, quantidade
+            ultimo = ate
+
+    def avancar(self, quantidade):
+        self.feitos += quantidade
+        self.progresso.emit(self.feitos, self.total)
+
+    @staticmethod
+    def tabelas_origem(caminho):
+        """(apelido, caminho, tabela, expressão do conteúdo) de um banco e do seu arquivo"""
+        tabelas = [("origem", caminho, "detalhes_visitas", "conteudo")]
+        arquivo = DatabaseHandler.caminho_arquivo(caminho)
+        if os.path.exists(arquivo):
+            tabelas.append(("origem_arquivo", arquivo, "visitas_arquivadas", "descomprimir(conteudo_zlib)"))
+        return tabelas
+
+    @staticmethod
+    def abrir_csv(caminho):
+        arquivo = open(caminho, newline="", encoding="utf-8-sig")
+        cabecalho = arquivo.readline()
+        arquivo.seek(0)
+        # A exportação do aplicativo usa ";"; planilhas costumam gravar ","
+        delimitador = ";" if cabecalho.count(";") >= cabecalho.count(",") else ","
+        return arquivo, csv.DictReader(arquivo, delimiter=delimitador)
+
+    def contar(self, conn, caminho):
+        if not caminho.lower().endswith(".csv"):
+            total = 0
+            for apelido, arquivo, tabela, _ in self.tabelas_origem(caminho):
+                conn.execute(f"ATTACH DATABASE ? AS {apelido}", (DatabaseHandler.uri_somente_leitura(arquivo),))
+                try:
+                    if not conn.execute(f"SELECT 1 FROM {apelido}.sqlite_master WHERE name = ?", (tabela,)).fetchone():
+                        if apelido == "origem":
+                            raise ValueError(f"{os.path.basename(caminho)} não é um banco de visitas deste aplicativo.")
+                        continue
+                    total += conn.execute(f"SELECT COUNT(*) FROM {apelido}.{tabela}").fetchone()[0]
+                finally:
+                    conn.execute(f"DETACH DATABASE {apelido}")
+            return total
+        arquivo, leitor = self.abrir_csv(caminho)
+        with arquivo:
+            if "visita_id" not in (leitor.fieldnames or []):
+                raise ValueError(f"{os.path.basename(caminho)}: CSV sem a coluna visita_id.")
+            return sum(1 for _ in leitor)
+
+    def carregar_banco(self, conn, caminho):
+        for apelido, arquivo, tabela, expr_conteudo in self.tabelas_origem(caminho):
+            conn.execute(f"ATTACH DATABASE ? AS {apelido}", (DatabaseHandler.uri_somente_leitura(arquivo),))
+            try:
+                existentes = {c[1] for c in conn.execute(f"PRAGMA {apelido}.table_info({tabela})")}
+                if not existentes: continue
+                # Bancos de versões antigas podem não ter todas as colunas
+                colunas = [expr_conteudo if c == "conteudo" else (c if c in existentes else "NULL") for c in self.COLUNAS]
+                for de, ate, quantidade in self.faixas(conn, f"{apelido}.{tabela}"):
+                    conn.execute(self.sql_upsert("temp.importacao", f'''
+                        SELECT {", ".join(colunas)} FROM {apelido}.{tabela} WHERE visita_id > ? AND visita_id <= ?
+                    '''), (de, ate))
+                    self.avancar(quantidade)
+            finally:
+                conn.commit()
+                conn.execute(f"DETACH DATABASE {apelido}")
+
+    def carregar_csv(self, conn, caminho):
+        sql = self.sql_upsert("temp.importacao", f"VALUES ({', '.join('?' * len(self.COLUNAS))})")
+        arquivo, leitor = self.abrir_csv(caminho)
+        with arquivo:
+            lote = []
+            for linha in leitor:
+                visita_id = (linha.get("visita_id") or "").strip()
+                if not visita_id.isdigit(): continue
+                conteudo = linha.get("conteudo") or None
+                nome, cpf, horario = linha.get("nome"), linha.get("cpf"), linha.get("horario")
+                if conteudo and not nome:
+                    nome, cpf, horario = DatabaseHandler.extrair_dados(conteudo)
+                lote.append((int(visita_id), nome, cpf, horario, conteudo, linha.get("url") or None, linha.get("data_captura") or None))
+                if len(lote) >= 5000:
+                    conn.executemany(sql, lote)
+                    self.avancar(len(lote))
+                    lote = []
+                    if self.cancelado: break
+            conn.executemany(sql, lote)
+            self.avancar(len(lote))
+        conn.commit()
+
+    def run(self):
+        conn = None
+        try:
+            # URI também no banco ativo: só assim o ATTACH aceita as fontes em mode=ro
+            conn = sqlite3.connect(pathlib.Path(self.db_path).absolute().as_uri(), uri=True, timeout=DatabaseHandler.ESPERA_ESCRITA_S)
+            DatabaseHandler.preparar_conexao(conn, self.db_path)
+            conn.create_function("hash_conteudo", 1, DatabaseHandler.calcular_hash)
+            conn.execute(f"CREATE TEMP TABLE importacao (visita_id INTEGER PRIMARY KEY, {', '.join(self.COLUNAS[1:])})")
+
+            alvo = os.path.abspath(self.db_path)
+            fontes = [f for f in self.fontes if os.path.abspath(f) != alvo]
+            self.etapa.emit("Contando registros...")
+            self.total = sum(self.contar(conn, f) for f in fontes)
+            self.progresso.emit(0, self.total)
+            for caminho in fontes:
+                if self.cancelado: break
+                self.etapa.emit(f"Lendo {os.path.basename(caminho)}...")
+                if caminho.lower().endswith(".csv"):
+                    csv.field_size_limit(2 ** 31 - 1)
+                    self.carregar_csv(conn, caminho)
+                else:
+                    self.carregar_banco(conn, caminho)
+            if self.cancelado:
+                self.erro.emit("Importação cancelada pelo usuário. Nada foi alterado no banco ativo.")
+                return
+
+            self.etapa.emit("Conferindo conflitos...")
+            lidas = conn.execute("SELECT COUNT(*) FROM temp.importacao").fetchone()[0]
+            # Descarta o que o banco ativo (ou o arquivo) já tem em versão igual ou mais nova
+            conn.execute('''
+                DELETE FROM temp.importacao WHERE EXISTS (
+                    SELECT 1 FROM visitas_todas v WHERE v.visita_id = importacao.visita_id
+                    AND COALESCE(v.data_captura, '') >= COALESCE(importacao.data_captura, ''))
+            ''')
+            conn.commit()
+            candidatas = conn.execute("SELECT COUNT(*) FROM temp.importacao").fetchone()[0]
+
+            # Faixas curtas, com os índices no lugar: cada transação segura a escrita
+            # por pouco tempo e a captura segue gravando (e consultando) normalmente
+            self.etapa.emit("Mesclando no banco ativo...")
+            self.feitos, self.total = 0, candidatas
+            self.progresso.emit(0, candidatas)
+            colunas = ", ".join(self.COLUNAS)
+            atualizar = ", ".join(f"{c} = excluded.{c}" for c in self.COLUNAS[1:] + ["origem", "hash_conteudo"])
+            aplicadas = 0
+            for de, ate, quantidade in self.faixas(conn, "temp.importacao", self.TAMANHO_MESCLA):
+                inicio = time.monotonic()
+                antes = conn.total_changes
+                conn.execute(f'''
+                    INSERT INTO main.detalhes_visitas ({colunas}, origem, hash_conteudo)
+                    SELECT {colunas}, '{self.ORIGEM}', hash_conteudo(conteudo)
+                    FROM temp.importacao WHERE visita_id > ? AND visita_id <= ?
+                    ON CONFLICT(visita_id) DO UPDATE SET {atualizar}
+                    WHERE COALESCE(excluded.data_captura, '') > COALESCE(detalhes_visitas.data_captura, '')
+                ''', (de, ate))
+                aplicadas += conn.total_changes - antes
+                conn.execute('''
+                    INSERT OR IGNORE INTO pendencias_indice (visita_id)
+                    SELECT visita_id FROM temp.importacao WHERE visita_id > ? AND visita_id <= ?
+                ''', (de, ate))
+                conn.commit()
+                self.avancar(quantidade)
+                # Folga do tamanho da transação: o busy handler do SQLite só tenta de tempos em
+                # tempos, e sem ela a captura perderia o lock para a faixa seguinte
+                self.msleep(max(self.FOLGA_MINIMA_MS, int((time.monotonic() - inicio) * 1000)))
+
+            if self.cancelado:
+                self.erro.emit(f"Importação interrompida. As {aplicadas} visitas já mescladas foram mantidas.")
+                return
+            self.concluido.emit(f"{aplicadas} visitas importadas ou atualizadas de {len(fontes)} arquivo(s); "
+                                f"{lidas - aplicadas} já estavam iguais ou mais novas no banco ativo.", aplicadas)
+        except Exception as e:
+            self.erro.emit(str(e))
+        finally:
+            if conn: conn.close()
+
+# --- NOVA CLASSE: SINCRONIZAÇÃO ENTRE ESTAÇÕES EM SEGUNDO PLANO ---
+class SincronizadorEstacoes(QThread):
+    """
+    Troca changesets (.jsonl.gz) com as outras estações pela pasta compartilhada
+    sem prender o loop de eventos quando o compartilhamento está lento. Toda a
+    E/S de arquivos e a leitura das alterações locais (conexão própria) ficam
+    aqui; as gravações voltam por sinais para o DatabaseHandler escritor, que
+    aplica os lotes e avança as marcas d'água.
+    Só vão as linhas capturadas aqui: cada estação lê os arquivos de todas as
+    outras, então reenviar o que foi recebido seria eco.
+    """
+    exportado = pyqtSignal(int, int)        # visitas enviadas, último seq_alteracao
+    lote_recebido = pyqtSignal(object, str)  # linhas, estação de origem
+    changeset_lido = pyqtSignal(str, str)    # estação de origem, nome do arquivo
+    concluido = pyqtSignal()
+    erro = pyqtSignal(str)
+
+    TAMANHO_LOTE = 1000
+
+    def __init__(self, db_path, pasta, estado, parent=None):
+        super().__init__(parent)
+        self.db_path = db_path
+        self.pasta = pasta
+        self.estacao, self.exportado_ate, self.recebidos = estado
+
+    def run(self):
+        try:
+            if not os.path.isdir(self.pasta):
+                self.erro.emit(f"Pasta de sincronização indisponível: {self.pasta}")
+                return
+            self.exportar()
+            self.importar()
+        except Exception as e:
+            self.erro.emit(str(e))
+        finally:
+            self.concluido.emit()
+
+    def exportar(self):
+        conn = DatabaseHandler.abrir_conexao_leitura(self.db_path, somente_leitura=True)
+        try:
+            cursor = conn.execute('''
+                SELECT visita_id, nome, cpf, horario, conteudo, url, data_captura, seq_alteracao FROM detalhes_visitas
+                WHERE seq_alteracao > ? AND origem IS NULL
+                ORDER BY seq_alteracao
+            ''', (self.exportado_ate,))
+            nome_arq = f"{self.estacao}_{datetime.datetime.now():%Y%m%d%H%M%S%f}.jsonl.gz"
+            temporario = os.path.join(self.pasta, nome_arq + ".tmp")
+            total = 0
+            ultima = self.exportado_ate
+            with gzip.open(temporario, "wt", encoding="utf-8") as f:
+                f.write(json.dumps({"estacao": self.estacao, "de": self.exportado_ate}) + "\n")
+                while True:
+                    lote = cursor.fetchmany(self.TAMANHO_LOTE)
+                    if not lote: break
+                    for *linha, seq in lote:
+                        f.write(json.dumps(linha, ensure_ascii=False) + "\n")
+                        ultima = seq
+                    total += len(lote)
+        finally:
+            conn.close()
+
+        if not total:
+            os.remove(temporario)
+            return
+        # Renomeia só no fim para que outras estações nunca leiam um arquivo pela metade
+        os.replace(temporario, os.path.join(self.pasta, nome_arq))
+        self.exportado.emit(total, ultima)
+        DatabaseHandler.limpar_changesets_antigos(self.pasta, self.estacao)
+
+    def importar(self):
+        """Lê os changesets de outras estações ainda não processados; o escritor aplica cada lote"""
+        for nome_arq in sorted(os.listdir(self.pasta)):
+            if not nome_arq.endswith(".jsonl.gz") or nome_arq.startswith(self.estacao + "_"): continue
+            origem = nome_arq.split("_")[0]
+            if nome_arq <= self.recebidos.get(origem, ""): continue
+
+            with gzip.open(os.path.join(self.pasta, nome_arq), "rt", encoding="utf-8") as f:
+                f.readline()  # cabeçalho
+                lote = []
+                for linha in f:
+                    lote.append(json.loads(linha))
+                    if len(lote) >= self.TAMANHO_LOTE:
+                        self.lote_recebido.emit(lote, origem)
+                        lote = []
+                if lote:
+                    self.lote_recebido.emit(lote, origem)
+            # Nomes de arquivo são ordenados por horário, então servem de marca d'água por origem
+            self.changeset_lido.emit(origem, nome_arq)
+
+# --- NOVA CLASSE: MANUTENÇÃO DO BANCO EM SEGUNDO PLANO ---
+class ExecutorManutencao(QThread):
+    """
+    Roda DatabaseHandler.executar_manutencao numa conexão própria, fora do loop
+    de eventos: a interface não congela e, no processo de captura, o batimento
+    continua saindo para o supervisor durante VACUUM, quick_check e backup.
+    """
+    concluido = pyqtSignal(object)  # lista de (tarefa, duracao_ms, bytes_recuperados, resultado)
+    erro = pyqtSignal(str)
+
+    def __init__(self, db_path, orcamento, completa, parent=None):
+        super().__init__(parent)
+        self.db_path = db_path
+        self.orcamento = orcamento
+        self.completa = completa
+
+    def run(self):
+        db = None
+        try:
+            db = DatabaseHandler(self.db_path, preparar_esquema=False)
+            # Escolhidas aqui: a conexão do escritor pode ver o auto_vacuum de antes de um VACUUM feito por esta
+            tarefas = db.selecionar_tarefas(self.completa)
+            self.concluido.emit(db.executar_manutencao(orcamento=self.orcamento, tarefas=tarefas))
+        except Exception as e:
+            self.erro.emit(str(e))
+        finally:
+            if db: db.fechar()
+
+# --- NOVA CLASSE: API LOCAL SOMENTE LEITURA ---
+class ManipuladorApi(BaseHTTPRequestHandler):
+    """Rotas GET da API local; o estado compartilhado fica em self.server.api"""
+
+    def log_message(self, formato, *args):
+        pass
+
+    def responder(self, status, corpo):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/eventos":
+            self.server.api.transmitir_eventos(self)
+            return
+        try:
+            status, corpo = self.server.api.atender(self.path)
+        except Exception as e:
+            status, corpo = 500, json.dumps({"erro": str(e)}).encode("utf-8")
+        self.responder(status, corpo)
+
+class ApiLocal:
+    """
+    API JSON somente leitura em 127.0.0.1 para outros programas da recepção
+    (impressora de crachás, painel do saguão), que assim não abrem o .db.
+    Usa um pool de conexões read-only e cache de respostas invalidado pelo
+    contador de gerações do DatabaseHandler.
+
+    GET /visitas?q=termos&pagina=1&por_pagina=20
+    GET /visitas/<id>
+    GET /cpf/<cpf>
+    GET /validos-hoje?pagina=1&por_pagina=20
+    GET /eventos  (Server-Sent Events; aceita Last-Event-ID para retomar)
+    """
+    TAMANHO_POOL = 4
+    TAMANHO_CACHE = 256
+    MAX_POR_PAGINA = 200
+    CAMPOS_LISTA = ["visita_id", "nome", "cpf", "horario", "data_captura"]
+    CAMPOS_DETALHE = ["visita_id", "nome", "cpf", "horario", "conteudo", "url", "data_captura"]
+
+    def __init__(self, db, porta):
+        self.db = db
+        self.porta = porta
+        self.pool = queue.Queue()
+        for _ in range(self.TAMANHO_POOL):
+            self.pool.put(DatabaseHandler.abrir_conexao_leitura(db.db_path, somente_leitura=True))
+        self.cache = collections.OrderedDict()
+        self.trava_cache = threading.Lock()
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", porta), ManipuladorApi)
+        self.servidor.daemon_threads = True
+        self.servidor.api = self
+        self.thread = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+
+    def iniciar(self):
+        self.thread.start()
+
+    def parar(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+
+    def consultar(self, sql, params):
+        conn = self.pool.get()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            self.pool.put(conn)
+
+    def atender(self, caminho):
+        geracao = self.db.geracao
+        with self.trava_cache:
+            em_cache = self.cache.get(caminho)
+            if em_cache and em_cache[0] == geracao:
+                self.cache.move_to_end(caminho)
+                return 200, em_cache[1]
+
+        status, dados = self.rotear(caminho)
+        corpo = json.dumps(dados, ensure_ascii=False).encode("utf-8")
+        if status == 200:
+            with self.trava_cache:
+                self.cache[caminho] = (geracao, corpo)
+                self.cache.move_to_end(caminho)
+                while len(self.cache) > self.TAMANHO_CACHE:
+                    self.cache.popitem(last=False)
+        return status, corpo
+
+    def rotear(self, caminho):
+        url = urllib.parse.urlsplit(caminho)
+        partes = [p for p in url.path.split("/") if p]
+        args = urllib.parse.parse_qs(url.query)
+        try:
+            pagina = max(1, int(args.get("pagina", ["1"])[0]))
+            por_pagina = min(self.MAX_POR_PAGINA, max(1, int(args.get("por_pagina", ["20"])[0])))
+        except ValueError:
+            return 400, {"erro": "pagina e por_pagina devem ser números"}
+
+        if partes == ["visitas"]:
+            termos = args.get("q", [""])[0].split()
+            if not termos:
+                return 400, {"erro": "informe o parâmetro q"}
+            conditions = " AND ".join(["(nome LIKE ? OR cpf LIKE ?)"] * len(termos))
+            params = [v for t in termos for v in (f"%{t}%", f"%{t}%")]
+            return 200, self.paginar(f"SELECT {', '.join(self.CAMPOS_LISTA)} FROM visitas_todas WHERE {conditions} ORDER BY visita_id DESC", params, pagina, por_pagina)
+
+        if len(partes) == 2 and partes[0] == "visitas":
+            if not partes[1].isdigit():
+                return 400, {"erro": "ID inválido"}
+            linhas = self.consultar(f"SELECT {', '.join(self.CAMPOS_DETALHE)} FROM visitas_todas WHERE visita_id = ?", [int(partes[1])])
+            if not linhas:
+                return 404, {"erro": "visita não encontrada"}
+            return 200, dict(zip(self.CAMPOS_DETALHE, linhas[0]))
+
+        if len(partes) == 2 and partes[0] == "cpf":
+            digitos = re.sub(r"\D", "", urllib.parse.unquote(partes[1]))
+            if len(digitos) != 11:
+                return 400, {"erro": "CPF deve ter 11 dígitos"}
+            cpf = f"{digitos[:3]}.{digitos[3:6]}.{digitos[6:9]}-{digitos[9:]}"
+            return 200, self.paginar(f"SELECT {', '.join(self.CAMPOS_LISTA)} FROM visitas_todas WHERE cpf = ? ORDER BY visita_id DESC", [cpf], pagina, por_pagina)
+
+        if partes == ["validos-hoje"]:
+            hoje = datetime.date.today().isoformat()
+            sql = f'''
+                SELECT {', '.join(self.CAMPOS_LISTA)} FROM detalhes_visitas
+                WHERE {DatabaseHandler.SQL_DATA_FIM} >= ? AND horario != 'N/A' AND {DatabaseHandler.SQL_DATA_INICIO} <= ?
+                ORDER BY visita_id DESC
+            '''
+            return 200, self.paginar(sql, [hoje, hoje], pagina, por_pagina)
+
+        return 404, {"erro": "rota desconhecida"}
+
+    def transmitir_eventos(self, handler):
+        """Mantém a conexão aberta enviando os eventos do barramento (SSE)"""
+        ultimo = handler.headers.get("Last-Event-ID")
+        fila = self.db.eventos.criar_fila(desde_id=int(ultimo) if ultimo and ultimo.isdigit() else None)
+        try:
+            handler.send_response(200)
+            handler.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            handler.send_header("Cache-Control", "no-cache")
+            handler.end_headers()
+            while True:
+                if getattr(fila, "transbordou", False) and fila.empty():
+                    handler.wfile.write(b"event: transbordo\ndata: {}\n\n")
+                    handler.wfile.flush()
+                    return
+                try:
+                    evento = fila.get(timeout=15)
+                except queue.Empty:
+                    # Comentário SSE mantém a conexão viva e detecta clientes que sumiram
+                    handler.wfile.write(b": ping\n\n")
+                    handler.wfile.flush()
+                    continue
+                dados = json.dumps(evento, ensure_ascii=False)
+                handler.wfile.write(f"id: {evento['id']}\nevent: {evento['tipo']}\ndata: {dados}\n\n".encode("utf-8"))
+                handler.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            pass
+        finally:
+            self.db.eventos.remover_fila(fila)
+
+    def paginar(self, sql, params, pagina, por_pagina):
+        # Busca um item a mais só para saber se existe próxima página, sem COUNT(*)
+        linhas = self.consultar(f"{sql} LIMIT ? OFFSET ?", params + [por_pagina + 1, (pagina - 1) * por_pagina])
+        return {
+            "pagina": pagina,
+            "por_pagina": por_pagina,
+            "proxima": len(linhas) > por_pagina,
+            "itens": [dict(zip(self.CAMPOS_LISTA, l)) for l in linhas[:por_pagina]],
+        }
+
+# --- NOVA CLASSE: MOTOR DE CAPTURA (no processo da janela ou em processo próprio) ---
+class MotorCaptura(QObject):
+    """
+    Tudo o que grava no banco em segundo plano: o worker oculto que percorre o
+    portal, a revalidação, a fila de índices, o arquivamento, a sincronização e
+    a manutenção. Roda dentro da janela ou, com captura/processo_separado, num
+    processo filho supervisionado (ver executar_processo_captura), recebendo
+    comandos por executar_comando e devolvendo o log pelo sinal `log`.
+    """
+    log = pyqtSignal(str)
+
+    def __init__(self, settings, parent=None):
+        super().__init__(parent)
+        self.settings = settings
+        self.db = None
+        self.sessao = None
+        self.revalidacao = None
+        self.id_atual = 1
+        self.escalonador = None
+        self.faixa_atual = None
+        # Estações que só recebem dados via sincronização não acessam o portal
+        self.rodando = settings.value("captura/ativa", True, type=bool)
+        self.aguardando_sessao = False
+        self.monitor_parser = MonitorParser()
+        # Pausa automática por mudança de layout; não mexe na preferência captura/ativa.
+        # Fica em captura/pausa_deriva para valer também depois de um reinício do processo
+        self.pausada_por_deriva = bool(settings.value("captura/pausa_deriva", ""))
+        if self.pausada_por_deriva:
+            self.rodando = False
+
+        # Perfil dedicado ao worker: cache em disco para que os estáticos do portal
+        # sejam baixados uma única vez e interceptador para cortar o restante
+        self.perfil_worker = QWebEngineProfile("worker_portaria", self)
+        self.perfil_worker.setHttpCacheType(QWebEngineProfile.HttpCacheType.DiskHttpCache)
+        self.perfil_worker.setHttpCacheMaximumSize(200 * 1024 * 1024)
+        self.economia_captura = ""
+
+        self.view_worker = QWebEngineView()
+        self.view_worker.setVisible(False)
+        self.view_worker.setPage(QWebEnginePage(self.perfil_worker, self.view_worker))
+        # Interceptador por página (e não no perfil): a revalidação usa o mesmo
+        # perfil e não pode somar nem zerar a contagem da captura
+        self.interceptador_worker = InterceptadorWorker(self)
+        self.view_worker.page().setUrlRequestInterceptor(self.interceptador_worker)
+        s_worker = self.view_worker.settings()
+        s_worker.setAttribute(QWebEngineSettings.WebAttribute.AutoLoadImages, False)
+        s_worker.setAttribute(QWebEngineSettings.WebAttribute.JavascriptEnabled, True)
+        self.view_worker.loadFinished.connect(self.on_worker_load_finished)
+
+        self.timer_retry = QTimer(self)
+        self.timer_retry.setSingleShot(True)
+        self.timer_retry.timeout.connect(self.carregar_url_id)
+
+        self.timer_pendencias = QTimer(self)
+        self.timer_pendencias.timeout.connect(self.processar_pendencias_indice)
+        self.timer_pendencias.start(200)
+        # A manutenção ociosa só roda com a fila de índices vazia
+        self.fila_indices_vazia = False
+
+        # Um único timer, rearmado a cada lote: 2 s enquanto houver atraso, 60 s depois
+        self.timer_arquivo = QTimer(self)
+        self.timer_arquivo.setSingleShot(True)
+        self.timer_arquivo.timeout.connect(self.arquivar_visitas_antigas)
+        self.timer_arquivo.start(60000)
+
+        self.timer_sync = QTimer(self)
+        self.timer_sync.timeout.connect(self.sincronizar_estacoes)
+        self.timer_sync.start(120000)
+        self.sincronizador = None
+        self.manutencao = None
+        self.sync_enviadas = self.sync_recebidas = 0
+        # Origens com lote não aplicado: a marca não avança e o changeset é relido
+        self.sync_falhas = set()
+
+    @property
+    def eventos(self):
+        return self.db.eventos
+
+    def registrar(self, texto):
+        self.log.emit(texto)
+
+    def usar_sessao(self, sessao):
+        """Liga o gerenciador de sessão (criado depois, pois precisa do perfil do worker)"""
+        self.sessao = sessao
+        sessao.sessao_renovada.connect(self.retomar_apos_sessao)
+        sessao.sessao_falhou.connect(self.falha_sessao)
+        self.revalidacao = AgendadorRevalidacao(self)
+
+    def conectar(self, db):
+        self.timer_retry.stop()
+        self.db = db
+        self.carregar_ultimo_id()
+        self.carregar_url_id()
+
+    def executar_comando(self, msg):
+        """Ponto único de entrada dos pedidos da interface (mesmo formato nos dois modos)"""
+        comando = msg.get("comando")
+        if comando == "captura_ativa":
+            self.definir_captura_ativa(msg["ativa"])
+        elif comando == "revalidar":
+            self.revalidacao.revalidar_agora(int(msg["visita_id"]))
+        elif comando == "ritmo_revalidacao":
+            self.revalidacao.configurar_ritmo(int(msg["por_minuto"]))
+        elif comando == "renovar_sessao":
+            self.sessao.renovar()
+        elif comando == "retomar_captura":
+            self.retomar_apos_deriva()
+        elif comando == "sincronizar":
+            self.sincronizar_estacoes()
+        elif comando == "manutencao":
+            self.executar_manutencao(msg.get("completa", False))
+        else:
+            self.registrar(f"⚠️ Comando desconhecido para a captura: {comando}")
+
+    def definir_captura_ativa(self, ativa):
+        self.rodando = ativa
+        self.settings.setValue("captura/ativa", ativa)
+        self.pausada_por_deriva = False
+        self.settings.remove("captura/pausa_deriva")
+        self.monitor_parser.reiniciar()
+        if ativa:
+            self.registrar("▶️ Captura do portal ativada nesta estação.")
+            self.carregar_ultimo_id()
+            self.carregar_url_id()
+        else:
+            self.timer_retry.stop()
+            self.registrar("⏸️ Captura do portal desativada. Dados chegarão pela sincronização.")
+
+    def processar_pendencias_indice(self):
+        """Atualiza aos poucos os índices derivados (migração e dados sincronizados)"""
+        if not self.db: return
+        try:
+            restante = self.db.processar_pendencias()
+        except Exception as e:
+            self.registrar(f"❌ Erro ao atualizar índices: {e}")
+            restante = False
+        self.fila_indices_vazia = not restante
+        # Sem fila, basta conferir de vez em quando
+        self.timer_pendencias.setInterval(200 if restante else 5000)
+
+    def arquivar_visitas_antigas(self):
+        """Move aos poucos as visitas antigas para o banco de arquivo"""
+        movidas = 0
+        dias = int(self.settings.value("arquivo/dias", 365))
+        try:
+            if self.db and dias > 0:
+                movidas = self.db.arquivar_lote(dias)
+        except Exception as e:
+            self.registrar(f"❌ Erro ao arquivar visitas: {e}")
+        if movidas:
+            self.registrar(f"🗄️ {movidas} visitas antigas movidas para o arquivo.")
+        # Ainda há o que mover: o próximo lote vem logo em seguida
+        self.timer_arquivo.start(2000 if movidas else 60000)
+
+    def executar_manutencao(self, completa=False):
+        """
+        Manutenção do banco, sempre no ExecutorManutencao. Pedida pela janela quando
+        a estação está ociosa (uma tarefa vencida, só com a fila de índices vazia e
+        nunca as TAREFAS_EXPLICITAS) ou explicitamente pelas configurações (todas as
+        tarefas, com orçamento maior).
+        """
+        if not self.db: return
+        if self.manutencao and self.manutencao.isRunning():
+            if completa:
+                self.registrar("🧰 Já há uma manutenção do banco em andamento.")
+            return
+        if completa:
+            orcamento = 30.0
+            self.registrar("🧰 Manutenção do banco iniciada em segundo plano...")
+        elif self.fila_indices_vazia:
+            orcamento = float(self.settings.value("manutencao/orcamento_s", 2.0))
+        else:
+            return
+        self.manutencao = ExecutorManutencao(self.db.db_path, orcamento, completa, self)
+        self.manutencao.concluido.connect(self.manutencao_concluida)
+        self.manutencao.erro.connect(lambda msg: self.registrar(f"❌ Erro na manutenção do banco: {msg}"))
+        self.manutencao.start()
+
+    def manutencao_concluida(self, registros):
+        for tarefa, duracao_ms, recuperados, resultado in registros:
+            if not DatabaseHandler.manutencao_concluida(resultado):
+                self.registrar(f"⏱️ Manutenção '{tarefa}' não concluída: {resultado} ({duracao_ms} ms). Nova tentativa mais tarde, com orçamento maior.")
+                continue
+            extra = f", {recuperados / 1024:.0f} KB recuperados" if recuperados else ""
+            self.registrar(f"🧰 Manutenção '{tarefa}': {resultado} ({duracao_ms} ms{extra})")
+
+    def sincronizar_estacoes(self):
+        """Troca changesets com as outras estações pela pasta compartilhada (em segundo plano)"""
+        pasta = self.settings.value("sync/pasta", "")
+        if not self.db or not pasta: return
+        if self.sincronizador and self.sincronizador.isRunning(): return
+        self.sync_enviadas = self.sync_recebidas = 0
+        self.sync_falhas.clear()
+        self.sincronizador = SincronizadorEstacoes(self.db.db_path, pasta, self.db.estado_sincronizacao(), self)
+        self.sincronizador.exportado.connect(self.on_sync_exportado)
+        self.sincronizador.lote_recebido.connect(self.on_sync_lote)
+        self.sincronizador.changeset_lido.connect(self.on_sync_changeset)
+        self.sincronizador.erro.connect(lambda msg: self.registrar(f"❌ Erro na sincronização: {msg}"))
+        self.sincronizador.concluido.connect(self.on_sync_concluido)
+        self.sincronizador.start()
+
+    def sync_do_banco_atual(self):
+        """Descarta resultados de uma sincronização iniciada antes de trocar de banco"""
+        return self.db is not None and self.sincronizador.db_path == self.db.db_path
+
+    def on_sync_exportado(self, total, ultima_seq):
+        if not self.sync_do_banco_atual(): return
+        self.db.set_meta("sync_exportado_seq", ultima_seq)
+        self.sync_enviadas = total
+
+    def on_sync_lote(self, linhas, origem):
+        if not self.sync_do_banco_atual(): return
+        try:
+            self.sync_recebidas += self.db.aplicar_lote_externo(linhas, origem)
+        except Exception as e:
+            self.sync_falhas.add(origem)
+            self.registrar(f"❌ Erro ao aplicar alterações de {origem}: {e}")
+
+    def on_sync_changeset(self, origem, nome_arq):
+        if not self.sync_do_banco_atual() or origem in self.sync_falhas: return
+        self.db.set_meta(f"sync_recebido_{origem}", nome_arq)
+
+    def on_sync_concluido(self):
+        if self.sync_enviadas or self.sync_recebidas:
+            self.registrar(f"🔄 Sincronização: {self.sync_enviadas} enviadas, {self.sync_recebidas} recebidas.")
+
+    def encerrar(self):
+        """Aguarda as threads de segundo plano antes de o processo sair"""
+        self.timer_sync.stop()
+        for thread in (self.sincronizador, self.manutencao):
+            if thread:
+                thread.wait()
+
+    def carregar_ultimo_id(self):
+        if not self.db: return
+        self.escalonador = EscalonadorCaptura(self.db, self.settings)
+        maior = self.escalonador.maior_salvo
+        if maior > 0: 
+            self.registrar(f"🔄 Procurando visitas novas a partir do ID: {maior + 1}")
+        else:
+            self.registrar("✨ Banco vazio/novo. Procurando o ID mais recente do portal.")
+        pendentes = self.escalonador.pendentes_historico()
+        if pendentes:
+            self.registrar(f"📚 {pendentes} IDs antigos pendentes no histórico.")
+
+    def carregar_url_id(self):
+        if not self.rodando or not self.db or not self.escalonador: return
+        visita_id, faixa = self.escalonador.proxima()
+        if visita_id is None:
+            # Nada liberado agora (cauda em espera ou fichas esgotadas)
+            self.timer_retry.start(faixa)
+            return
+        self.id_atual, self.faixa_atual = visita_id, faixa
+        url = f"https://portaria-global.governarti.com.br/visita/{self.id_atual}/detalhes?t={datetime.datetime.now().timestamp()}"
+        self.interceptador_worker.reiniciar_contagem()
+        self.view_worker.setUrl(QUrl(url))
+
+    def on_worker_load_finished(self, ok):
+        # O login do worker é tratado pelo GerenciadorSessao em callback_validacao
+        if self.rodando and self.db: QTimer.singleShot(800, self.extrair_e_validar)
+
+    def extrair_e_validar(self):
+        # Recursos servidos do cache têm transferSize 0 e encodedBodySize > 0
+        js_recursos = "JSON.stringify(performance.getEntriesByType('resource').map(r => [r.transferSize, r.encodedBodySize]))"
+        self.view_worker.page().runJavaScript(js_recursos, self.callback_recursos)
+        self.view_worker.page().runJavaScript("document.body.innerText;", self.callback_validacao)
+
+    def callback_recursos(self, recursos_json):
+        """Calcula os bytes poupados na captura atual (bloqueios + cache em disco)"""
+        bytes_cache = 0
+        try:
+            for transferido, tamanho in json.loads(recursos_json or "[]"):
+                if not transferido and tamanho: bytes_cache += tamanho
+        except (ValueError, TypeError):
+            pass
+        bloqueados = self.interceptador_worker.bytes_bloqueados
+        total_kb = (bloqueados + bytes_cache) / 1024
+        self.economia_captura = f"~{total_kb:.0f} KB poupados ({self.interceptador_worker.bloqueios} bloqueios, {bytes_cache / 1024:.0f} KB do cache)"
+
+    def callback_validacao(self, conteudo):
+        if not self.rodando or not self.db: return
+        if conteudo and "entrar" in conteudo.lower()[:300]:
+            # Uma única renovação atende todos os workers; a captura retoma no sinal
+            self.aguardando_sessao = True
+            self.sessao.renovar()
+            return
+        if not conteudo:
+            self.timer_retry.start(3000)
+            return
+
+        nome_str, cpf_str, horario_str = self.db.extrair_dados(conteudo)
+        dados_encontrados = (nome_str != "Desconhecido" or cpf_str != "N/A") and "não encontrada" not in conteudo.lower()
+
+        situacao = self.verificar_parser(self.id_atual, conteudo, nome_str, cpf_str, horario_str)
+        if not self.rodando: return
+        if situacao == "anomala" and not dados_encontrados and self.monitor_parser.repeticoes[self.id_atual] < 3:
+            # Página carregada mas ilegível: não conta como ID inexistente, tenta de novo
+            self.timer_retry.start(3000)
+            return
+
+        if dados_encontrados:
+            if self.db.salvar_visita(self.id_atual, nome_str, cpf_str, horario_str, conteudo, self.view_worker.url().toString()) is False:
+                # Banco ocupado ou erro de gravação: o ID não conta como capturado e é refeito
+                self.registrar(f"❌ Falha ao gravar o ID {self.id_atual}. Nova tentativa em instantes.")
+                self.timer_retry.start(3000)
+                return
+            faixa = " (histórico)" if self.faixa_atual == "historico" else ""
+            self.registrar(f"ID {self.id_atual} registrado{faixa}: {nome_str}" + (f" | {self.economia_captura}" if self.economia_captura else ""))
+        mensagem = self.escalonador.registrar(self.id_atual, self.faixa_atual, dados_encontrados)
+        if mensagem: self.registrar(mensagem)
+        # O ritmo de cada faixa é controlado pelo escalonador
+        self.timer_retry.start(500)
+
+    def verificar_parser(self, visita_id, conteudo, nome, cpf, horario):
+        """Alimenta o monitor do extrator; pausa a captura se o layout do portal mudou"""
+        situacao = self.monitor_parser.registrar(visita_id, conteudo, nome, cpf, horario)
+        if self.rodando and self.monitor_parser.deriva_detectada():
+            self.pausar_por_deriva()
+        return situacao
+
+    def pausar_por_deriva(self):
+        self.rodando = False
+        self.pausada_por_deriva = True
+        self.timer_retry.stop()
+        taxa = self.monitor_parser.taxa_falhas()
+        try:
+            pasta = self.monitor_parser.salvar_amostras()
+        except OSError as e:
+            pasta = f"(falha ao gravar amostras: {e})"
+        self.registrar(f"🚨 O portal parece ter mudado o layout ({taxa:.0%} das últimas páginas sem dados legíveis). "
+                       f"Captura pausada. Amostras em: {pasta}")
+        dados = {"taxa_falhas": round(taxa, 2), "pasta_amostras": pasta}
+        self.settings.setValue("captura/pausa_deriva", json.dumps(dados))
+        if self.db:
+            self.eventos.publicar("parser_alterado", dados)
+
+    def retomar_apos_deriva(self):
+        """Retoma depois da pausa automática (ex.: extrator corrigido ou alarme falso)"""
+        if not self.pausada_por_deriva: return
+        self.pausada_por_deriva = False
+        self.settings.remove("captura/pausa_deriva")
+        self.monitor_parser.reiniciar()
+        self.rodando = self.settings.value("captura/ativa", True, type=bool)
+        self.registrar("▶️ Captura retomada após a pausa por mudança de layout.")
+        self.carregar_ultimo_id()
+        self.carregar_url_id()
+
+    def retomar_apos_sessao(self):
+        if self.aguardando_sessao:
+            self.aguardando_sessao = False
+            self.carregar_url_id()
+
+    def falha_sessao(self, motivo):
+        if self.aguardando_sessao:
+            self.aguardando_sessao = False
+            self.timer_retry.start(30000)
+
+# --- NOVA CLASSE: SUPERVISOR DO PROCESSO DE CAPTURA ---
+class SupervisorCaptura(QObject):
+    """
+    Mantém o processo filho de captura (--processo-captura) vivo. A conversa é
+    por linhas JSON: comandos vão pelo stdin do filho; log, eventos do banco e
+    batimentos voltam pelo stdout. Sem batimento por LIMITE_SILENCIO_S o filho
+    é considerado travado e morto; toda saída inesperada é seguida de reinício
+    com espera exponencial, zerada depois que o filho fica estável.
+    """
+    log = pyqtSignal(str)
+    evento_recebido = pyqtSignal(dict)
+    pronto = pyqtSignal()  # o filho abriu (criou/migrou) o banco; repete a cada reinício
+
+    LIMITE_SILENCIO_S = 30
+    ESPERA_MAXIMA_S = 60
+    ESTAVEL_APOS_S = 120
+
+    def __init__(self, db_path, parent=None):
+        super().__init__(parent)
+        self.db_path = db_path
+        self.processo = None
+        self.buffer = b""
+        self.tentativas = 0
+        self.inicio = 0.0
+        self.ultimo_sinal = 0.0
+        self.encerrando = False
+
+        self.timer_vigia = QTimer(self)
+        self.timer_vigia.timeout.connect(self.verificar_saude)
+
+        self.timer_reinicio = QTimer(self)
+        self.timer_reinicio.setSingleShot(True)
+        self.timer_reinicio.timeout.connect(self.iniciar)
+
+    def linha_de_comando(self):
+        # Empacotado (PyInstaller) o próprio executável é o script
+        if getattr(sys, "frozen", False):
+            return sys.executable, ["--processo-captura", self.db_path]
+        return sys.executable, [os.path.abspath(__file__), "--processo-captura", self.db_path]
+
+    def iniciar(self):
+        if self.encerrando: return
+        if self.processo:
+            # O anterior já terminou (ou nem chegou a iniciar); sem isto os QProcess se acumulam
+            self.processo.deleteLater()
+        self.processo = QProcess(self)
+        # O stderr do filho (Chromium, tracebacks) vai direto para o console da janela
+        self.processo.setProcessChannelMode(QProcess.ProcessChannelMode.ForwardedErrorChannel)
+        self.processo.readyReadStandardOutput.connect(self.ler_saida)
+        self.processo.finished.connect(self.on_finalizado)
+        self.processo.errorOccurred.connect(self.on_erro)
+        self.buffer = b""
+        self.inicio = self.ultimo_sinal = time.monotonic()
+        programa, argumentos = self.linha_de_comando()
+        self.processo.start(programa, argumentos)
+        self.timer_vigia.start(5000)
+
+    def ler_saida(self):
+        self.buffer += bytes(self.processo.readAllStandardOutput())
+        *linhas, self.buffer = self.buffer.split(b"\n")
+        for linha in linhas:
+            texto = linha.decode("utf-8", "replace").strip()
+            if not texto: continue
+            self.ultimo_sinal = time.monotonic()
+            try:
+                msg = json.loads(texto)
+            except ValueError:
+                # print() solto de alguma biblioteca: vai para o log como está
+                self.log.emit(texto)
+                continue
+            tipo = msg.get("tipo")
+            if tipo == "log":
+                self.log.emit(msg["texto"])
+            elif tipo == "evento":
+                self.evento_recebido.emit(msg["evento"])
+            elif tipo == "pronto":
+                self.log.emit(f"🧩 Processo de captura iniciado (PID {msg.get('pid')}).")
+                self.pronto.emit()
+            if time.monotonic() - self.inicio > self.ESTAVEL_APOS_S:
+                self.tentativas = 0
+
+    def enviar(self, msg):
+        if self.processo and self.processo.state() == QProcess.ProcessState.Running:
+            self.processo.write((json.dumps(msg, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    def verificar_saude(self):
+        if not self.processo or self.processo.state() != QProcess.ProcessState.Running: return
+        silencio = time.monotonic() - self.ultimo_sinal
+        if silencio > self.LIMITE_SILENCIO_S:
+            self.log.emit(f"⚠️ Processo de captura sem resposta há {silencio:.0f} s. Reiniciando...")
+            self.processo.kill()
+
+    def on_erro(self, erro):
+        # Falha ao iniciar não gera finished; o reinício é agendado por aqui
+        if erro == QProcess.ProcessError.FailedToStart:
+            self.log.emit(f"❌ Não foi possível iniciar o processo de captura: {self.processo.errorString()}")
+            self.agendar_reinicio()
+
+    def on_finalizado(self, codigo, status):
+        self.timer_vigia.stop()
+        if self.encerrando: return
+        self.log.emit(f"❌ Processo de captura encerrou (código {codigo}).")
+        self.agendar_reinicio()
+
+    def agendar_reinicio(self):
+        if self.encerrando or self.timer_reinicio.isActive(): return
+        espera = min(self.ESPERA_MAXIMA_S, 2 ** self.tentativas)
+        self.tentativas += 1
+        self.log.emit(f"🔁 Nova tentativa em {espera} s.")
+        self.timer_reinicio.start(espera * 1000)
+
+    def parar(self):
+        self.encerrando = True
+        self.timer_vigia.stop()
+        self.timer_reinicio.stop()
+        if not self.processo or self.processo.state() == QProcess.ProcessState.NotRunning: return
+        self.enviar({"comando": "parar"})
+        self.processo.closeWriteChannel()
+        if not self.processo.waitForFinished(5000):
+            self.processo.kill()
+            self.processo.waitForFinished(2000)
+
 class SmartPortariaScanner(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -555,26 +4351,52 @@ class SmartPortariaScanner(QMainWindow):
         
         # INICIALIZA SEM BANCO DE DADOS
         self.db = None
-        self.id_atual = 1
-        self.rodando = True
-        
-        self.timer_retry = QTimer()
-        self.timer_retry.setSingleShot(True)
-        self.timer_retry.timeout.connect(self.carregar_url_id)
+        self.api = None
+        # Sobrevive à troca de banco, para que os assinantes não precisem se registrar de novo
+        self.eventos = BarramentoEventos()
+        self.eventos.assinar(self.on_evento_janela)
+        self.alerta_parser = None
+        # Captura local (motor) ou num processo filho supervisionado; decidido ao iniciar
+        self.processo_separado = "--captura-separada" in sys.argv or self.settings.value("captura/processo_separado", False, type=bool)
+        self.motor = None
+        self.supervisor = None
 
         self.profile_anonimo = QWebEngineProfile(self) 
         self.profile_anonimo.setHttpUserAgent("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
 
+        # Perfil persistente das abas do portal (o perfil padrão do Qt 6 não grava cookies)
+        self.perfil_portal = QWebEngineProfile("portaria", self)
+
         self.setup_ui()
-        self.configurar_navegadores()
+        self.gerenciador_abas = GerenciadorAbas(self)
+        if self.processo_separado:
+            # O perfil do worker fica com o processo filho (dois processos não dividem um perfil)
+            self.sessao = GerenciadorSessao(self, [self.perfil_portal])
+        else:
+            self.motor = MotorCaptura(self.settings, self)
+            self.motor.log.connect(self.registrar)
+            self.sessao = GerenciadorSessao(self, [self.perfil_portal, self.motor.perfil_worker])
+            self.motor.usar_sessao(self.sessao)
 
         # Carrega e aplica tema salvo
-        saved_theme = self.settings.value("theme", "light")
-        self.aplicar_tema(saved_theme)
+        self.temas = MotorTemas()
+        self.tema_atual = None
+        self.aplicar_tema(self.settings.value("theme", "light"))
 
         self.timer_busca = QTimer()
         self.timer_busca.setSingleShot(True)
         self.timer_busca.timeout.connect(self.executar_busca_local)
+
+        # Manutenção do banco só quando ninguém está usando a estação
+        self.ultima_interacao = time.monotonic()
+        QApplication.instance().installEventFilter(self)
+        self.timer_manutencao = QTimer()
+        self.timer_manutencao.timeout.connect(self.manutencao_ociosa)
+        self.timer_manutencao.start(60000)
+
+        self.perfilador = Perfilador(self, limite_ms=int(self.settings.value("perfil/travamento_ms", 200)))
+        if "--perfil" in sys.argv or self.settings.value("perfil/ativo", False, type=bool):
+            self.definir_perfilamento(True)
         
         self.add_new_tab(QUrl("https://portaria-global.governarti.com.br/visita/"), "Portaria Virtual", closable=False)
         self.add_new_tab(QUrl("about:blank"), "Guia anônima", closable=False, profile=self.profile_anonimo)
@@ -595,7 +4417,9 @@ class SmartPortariaScanner(QMainWindow):
 
         # --- PAINEL ESQUERDO ---
         painel = QWidget()
+        painel.setObjectName("painelLateral")
         painel.setFixedWidth(450)
+        self.painel = painel
         lat = QVBoxLayout(painel)
         lat.setSpacing(10)
 
@@ -605,18 +4429,29 @@ class SmartPortariaScanner(QMainWindow):
         self.btn_config = QPushButton("⚙️")
         self.btn_config.setToolTip("Abrir Configurações")
         self.btn_config.setFixedSize(32, 32)
+        self.btn_config.setProperty("papel", "cabecalho")
         self.btn_config.clicked.connect(self.abrir_configuracoes)
 
+        self.btn_dashboard = QPushButton("📊")
+        self.btn_dashboard.setToolTip("Movimento de Visitantes")
+        self.btn_dashboard.setFixedSize(32, 32)
+        self.btn_dashboard.setProperty("papel", "cabecalho")
+        self.btn_dashboard.clicked.connect(self.abrir_dashboard)
+
         self.btn_instrucao = QPushButton("Instrução para cadastramento")
         self.btn_instrucao.setFixedHeight(32)
+        self.btn_instrucao.setObjectName("btnInstrucao")
+        self.btn_instrucao.setProperty("papel", "cabecalho")
         self.btn_instrucao.clicked.connect(self.abrir_instrucoes)
 
         self.btn_abrir_camera = QPushButton("📷")
         self.btn_abrir_camera.setToolTip("Abrir Câmera")
         self.btn_abrir_camera.setFixedSize(32, 32)
+        self.btn_abrir_camera.setProperty("papel", "cabecalho")
         self.btn_abrir_camera.clicked.connect(self.abrir_camera)
 
         header_layout.addWidget(self.btn_config)
+        header_layout.addWidget(self.btn_dashboard)
         header_layout.addWidget(self.btn_instrucao)
         header_layout.addWidget(self.btn_abrir_camera)
         header_layout.addStretch()
@@ -642,12 +4477,20 @@ class SmartPortariaScanner(QMainWindow):
         
         self.btn_limpar_busca = QPushButton("✖")
         self.btn_limpar_busca.setFixedWidth(30)
+        self.btn_limpar_busca.setProperty("papel", "limpar")
         self.btn_limpar_busca.clicked.connect(self.input_busca.clear)
 
         busca_input_layout.addWidget(self.input_busca)
         busca_input_layout.addWidget(self.btn_limpar_busca)
         
         layout_busca.addLayout(busca_input_layout)
+
+        self.chk_agrupar = QCheckBox("Agrupar por pessoa")
+        self.chk_agrupar.setChecked(self.settings.value("busca/agrupar", False, type=bool))
+        self.chk_agrupar.toggled.connect(self.alternar_agrupamento)
+        layout_busca.addWidget(self.chk_agrupar)
+        # Pessoas com o histórico aberto na lista agrupada (carregado só ao clicar)
+        self.pessoas_expandidas = set()
         
         self.txt_res_busca = QTextBrowser()
         self.txt_res_busca.setOpenExternalLinks(False)
@@ -664,7 +4507,7 @@ class SmartPortariaScanner(QMainWindow):
         self.txt_live = QTextEdit()
         self.txt_live.setReadOnly(True)
         # Fonte monospace fixa, mas cores geridas pelo tema
-        self.txt_live.setStyleSheet("font-family: Consolas, monospace; font-size: 12px;")
+        self.txt_live.setObjectName("logSistema")
         layout_live.addWidget(self.txt_live)
         lat.addWidget(group_live)
 
@@ -678,13 +4521,16 @@ class SmartPortariaScanner(QMainWindow):
 
         btns_layout = QHBoxLayout()
         self.btn_open_anon = QPushButton("Abrir na Guia Anônima")
+        self.btn_open_anon.setProperty("papel", "anonima")
         self.btn_open_anon.clicked.connect(self.abrir_qr_na_anonima)
 
         self.btn_gen_qr = QPushButton("Gerar QR Code")
+        self.btn_gen_qr.setProperty("papel", "primario")
         self.btn_gen_qr.clicked.connect(self.mostrar_qr_code)
 
         self.btn_clear_qr = QPushButton("Apagar")
         self.btn_clear_qr.setFixedWidth(70)
+        self.btn_clear_qr.setProperty("papel", "perigo")
         self.btn_clear_qr.clicked.connect(self.txt_qr_input.clear)
 
         btns_layout.addWidget(self.btn_open_anon)
@@ -698,7 +4544,11 @@ class SmartPortariaScanner(QMainWindow):
         layout_web = QVBoxLayout(container_web)
         layout_web.setContentsMargins(0, 0, 0, 0)
 
-        toolbar = QHBoxLayout()
+        # A barra tem folha de estilo própria; as WebViews ficam fora de qualquer escopo estilizado
+        self.barra_navegacao = QWidget()
+        self.barra_navegacao.setObjectName("barraNavegacao")
+        toolbar = QHBoxLayout(self.barra_navegacao)
+        toolbar.setContentsMargins(0, 0, 0, 0)
         self.btn_back = QPushButton("←")
         self.btn_back.setFixedWidth(30)
         self.btn_forward = QPushButton("→")
@@ -711,11 +4561,12 @@ class SmartPortariaScanner(QMainWindow):
         self.btn_reload.clicked.connect(self.recarregar_pagina)
         
         self.btn_unlock = QPushButton("Destravar")
+        self.btn_unlock.setProperty("papel", "destravar")
         self.btn_unlock.clicked.connect(self.executar_desbloqueio)
 
         self.btn_home = QPushButton("🏠")
         self.btn_home.setFixedWidth(60)
-        self.btn_home.setStyleSheet("font-size: 18px; padding-bottom: 3px;")
+        self.btn_home.setProperty("papel", "home")
         self.btn_home.clicked.connect(self.ir_para_home)
 
         self.address_bar = QLineEdit()
@@ -736,14 +4587,10 @@ class SmartPortariaScanner(QMainWindow):
         toolbar.addWidget(self.btn_home)
         toolbar.addWidget(self.address_bar)
         toolbar.addWidget(self.tabs)
-        layout_web.addLayout(toolbar)
+        layout_web.addWidget(self.barra_navegacao)
 
         self.web_stack = QStackedWidget()
         layout_web.addWidget(self.web_stack)
-
-        self.view_worker = QWebEngineView()
-        self.view_worker.setVisible(False)
-        self.view_worker.loadFinished.connect(self.on_worker_load_finished)
         
         splitter.addWidget(painel)
         splitter.addWidget(container_web)
@@ -751,73 +4598,15 @@ class SmartPortariaScanner(QMainWindow):
 
     # === LÓGICA DE TEMAS ===
     def aplicar_tema(self, modo):
+        if modo == self.tema_atual: return
         self.settings.setValue("theme", modo)
-        
-        if modo == "dark":
-            # Estilo ESCURO
-            style = """
-                QMainWindow, QWidget { background-color: #0f172a; color: #e2e8f0; }
-                QLineEdit { background-color: #1e293b; color: #e2e8f0; border: 1px solid #475569; padding: 6px; border-radius: 4px; }
-                QTextEdit { background-color: #1e293b; color: #e2e8f0; border: 1px solid #475569; border-radius: 4px; }
-                QGroupBox { border: 1px solid #475569; border-radius: 6px; margin-top: 10px; font-weight: bold; color: #94a3b8; }
-                QGroupBox::title { subcontrol-origin: margin; subcontrol-position: top left; padding: 0 3px; }
-                QLabel { color: #e2e8f0; }
-                QPushButton { background-color: #334155; color: white; border: 1px solid #475569; border-radius: 4px; padding: 6px; }
-                QPushButton:hover { background-color: #475569; }
-                QTabBar::tab { background: #1e293b; color: #94a3b8; border: 1px solid #475569; padding: 8px 30px 8px 12px; border-radius: 4px; margin-right: 4px; }
-                QTabBar::tab:selected { background: #2563eb; color: white; border-color: #2563eb; }
-                QSplitter::handle { background-color: #475569; }
-            """
-            # Cores específicas de botões funcionais
-            btn_unlock_style = "background-color: #d97706; color: white; font-weight: bold; border-radius: 4px; padding: 5px 10px;"
-            btn_anon_style = "background-color: #475569; color: white; padding: 8px; border-radius: 4px;"
-            btn_qr_style = "background-color: #2563eb; color: white; padding: 8px; border-radius: 4px; font-weight: bold;"
-            btn_clear_style = "background-color: #ef4444; color: white; padding: 8px; border-radius: 4px; font-weight: bold;"
-            live_log_style = "background: #1e293b; color: #4ade80; font-family: Consolas, monospace; font-size: 12px; border: 1px solid #475569;"
-
-        else:
-            # Estilo CLARO (Padrão)
-            style = """
-                QMainWindow, QWidget { background-color: #f8fafc; color: #1e293b; }
-                QLineEdit { background-color: #ffffff; color: #1e293b; border: 1px solid #cbd5e1; padding: 6px; border-radius: 4px; }
-                QTextEdit { background-color: #ffffff; color: #1e293b; border: 1px solid #cbd5e1; border-radius: 4px; }
-                QGroupBox { border: 1px solid #94a3b8; border-radius: 6px; margin-top: 10px; font-weight: bold; color: #1e293b; }
-                QGroupBox::title { subcontrol-origin: margin; subcontrol-position: top left; padding: 0 3px; }
-                QLabel { color: #1e293b; }
-                QPushButton { background-color: #f1f5f9; color: #334155; border: 1px solid #cbd5e1; border-radius: 4px; padding: 6px; }
-                QPushButton:hover { background-color: #e2e8f0; }
-                QTabBar::tab { background: #f1f5f9; color: #334155; border: 1px solid #cbd5e1; padding: 8px 30px 8px 12px; border-radius: 4px; margin-right: 4px; }
-                QTabBar::tab:selected { background: #2563eb; color: white; border-color: #2563eb; }
-                QSplitter::handle { background-color: #cbd5e1; }
-            """
-            # Cores específicas
-            btn_unlock_style = "background-color: #f59e0b; color: white; font-weight: bold; border-radius: 4px; padding: 5px 10px;"
-            btn_anon_style = "background-color: #334155; color: white; padding: 8px; border-radius: 4px;"
-            btn_qr_style = "background-color: #2563eb; color: white; padding: 8px; border-radius: 4px; font-weight: bold;"
-            btn_clear_style = "background-color: #ef4444; color: white; padding: 8px; border-radius: 4px; font-weight: bold;"
-            live_log_style = "background: #1e293b; color: #4ade80; font-family: Consolas, monospace; font-size: 12px;"
-
-        self.setStyleSheet(style)
-        
-        # Reaplica estilos específicos que não devem ser sobrescritos pelo genérico
-        self.btn_unlock.setStyleSheet(btn_unlock_style)
-        self.btn_open_anon.setStyleSheet(btn_anon_style)
-        self.btn_gen_qr.setStyleSheet(btn_qr_style)
-        self.btn_clear_qr.setStyleSheet(btn_clear_style)
-        self.btn_limpar_busca.setStyleSheet(f"background-color: {'#334155' if modo=='dark' else '#e2e8f0'}; color: {'#e2e8f0' if modo=='dark' else '#64748b'}; border: none; border-radius: 4px; font-weight: bold;")
-        self.txt_live.setStyleSheet(live_log_style)
-        self.btn_home.setStyleSheet("font-size: 18px; padding-bottom: 3px;" + ("color: white;" if modo == "dark" else ""))
-        
-        # Ajusta botões do cabeçalho para parecerem com o tema
-        btn_conf_color = "#334155" if modo == "dark" else "#f1f5f9"
-        btn_conf_border = "#475569" if modo == "dark" else "#cbd5e1"
-        header_btn_style = f"""
-            QPushButton {{ background-color: {btn_conf_color}; color: {'white' if modo=='dark' else '#334155'}; border: 1px solid {btn_conf_border}; border-radius: 6px; }}
-            QPushButton:hover {{ border-color: #94a3b8; background-color: {'#475569' if modo=='dark' else '#e2e8f0'}; }}
-        """
-        self.btn_config.setStyleSheet(header_btn_style + "font-size: 18px;")
-        self.btn_instrucao.setStyleSheet(header_btn_style + "font-size: 12px; padding: 0 10px; font-weight: bold;")
-        self.btn_abrir_camera.setStyleSheet(header_btn_style + "font-size: 18px;")
+        # Mantido em memória: buscas e diálogos não consultam o QSettings
+        self.tema_atual = modo
+        self.cores_tema = self.temas.cores(modo)
+        QApplication.instance().setPalette(self.temas.paleta(modo))
+        self.painel.setStyleSheet(self.temas.folha(modo, "painel"))
+        self.barra_navegacao.setStyleSheet(self.temas.folha(modo, "barra"))
+        self.executar_busca_local()
 
     # === MÉTODOS DE CONTROLE DO BANCO DE DADOS ===
     def abrir_configuracoes(self):
@@ -825,6 +4614,10 @@ class SmartPortariaScanner(QMainWindow):
         dlg = ConfigDialog(self)
         dlg.exec()
 
+    def abrir_dashboard(self):
+        """Abre o painel de movimento (não modal, acompanha a captura)"""
+        DashboardDialog(self).show()
+
     def abrir_instrucoes(self):
         """Abre o diálogo de instruções de cadastramento"""
         dlg = InstrucoesDialog(self)
@@ -852,22 +4645,164 @@ class SmartPortariaScanner(QMainWindow):
 
     def conectar_banco(self, path):
         try:
-            self.db = DatabaseHandler(path)
-            nome_arq = os.path.basename(path)
-            self.lbl_status_db.setText(f"✅ Ativo: {nome_arq}")
-            self.lbl_status_db.setStyleSheet("color: #10b981; font-weight: bold; margin-bottom: 5px; font-size: 11px;")
-            
-            # Salva o caminho para a próxima sessão
-            self.settings.setValue("last_db_path", path)
-            
-            self.txt_live.append(f"--- BANCO CONECTADO: {path} ---")
-            self.carregar_ultimo_id()
-            self.carregar_url_id()
-            
+            if self.supervisor:
+                self.supervisor.parar()
+                self.supervisor = None
+            if self.processo_separado:
+                # Quem cria e migra o esquema é o filho: a janela só abre a leitura quando ele avisa que está pronto
+                self.db = None
+                self.configurar_api()
+                self.lbl_status_db.setText(f"⏳ Abrindo: {os.path.basename(path)}")
+                self.supervisor = SupervisorCaptura(path, self)
+                self.supervisor.log.connect(self.registrar)
+                self.supervisor.evento_recebido.connect(self.on_evento_captura)
+                self.supervisor.pronto.connect(self.on_captura_pronta)
+                self.supervisor.iniciar()
+            else:
+                self.db = DatabaseHandler(path, eventos=self.eventos)
+                self.banco_aberto(path)
+                self.motor.conectar(self.db)
+        except Exception as e:
+            QMessageBox.critical(self, "Erro de Conexão", f"Falha ao conectar ao banco de dados:\n{e}")
+            self.settings.remove("last_db_path")
+
+    def on_captura_pronta(self):
+        # Cada reinício do filho repete o aviso; a conexão de leitura é aberta só uma vez
+        if self.db or not self.supervisor: return
+        try:
+            self.db = DatabaseHandler(self.supervisor.db_path, eventos=self.eventos, somente_leitura=True)
+            self.banco_aberto(self.supervisor.db_path)
         except Exception as e:
             QMessageBox.critical(self, "Erro de Conexão", f"Falha ao conectar ao banco de dados:\n{e}")
             self.settings.remove("last_db_path")
 
+    def banco_aberto(self, path):
+        nome_arq = os.path.basename(path)
+        self.lbl_status_db.setText(f"✅ Ativo: {nome_arq}")
+        self.lbl_status_db.setStyleSheet("color: #10b981; font-weight: bold; margin-bottom: 5px; font-size: 11px;")
+
+        # Salva o caminho para a próxima sessão
+        self.settings.setValue("last_db_path", path)
+
+        self.txt_live.append(f"--- BANCO CONECTADO: {path} ---")
+        self.configurar_api()
+        # Pausa por mudança de layout de uma execução anterior: o alerta volta a aparecer
+        pausa = self.settings.value("captura/pausa_deriva", "")
+        if pausa:
+            QTimer.singleShot(0, lambda: self.alertar_parser_alterado(json.loads(pausa)))
+
+    def configurar_api(self):
+        """(Re)inicia a API local conforme as configurações e o banco atual"""
+        if self.api:
+            self.api.parar()
+            self.api = None
+        if not self.db or not self.settings.value("api/ativa", False, type=bool): return
+        porta = int(self.settings.value("api/porta", 8765))
+        try:
+            self.api = ApiLocal(self.db, porta)
+            self.api.iniciar()
+            self.txt_live.append(f"🌐 API local ativa em http://127.0.0.1:{porta}")
+        except Exception as e:
+            self.api = None
+            self.txt_live.append(f"❌ Falha ao iniciar a API local: {e}")
+
+    def registrar(self, texto):
+        self.txt_live.append(texto)
+
+    def comandar(self, comando, **dados):
+        """Entrega um comando ao motor de captura, local ou no processo filho"""
+        msg = dict(comando=comando, **dados)
+        if self.motor:
+            self.motor.executar_comando(msg)
+        elif self.supervisor:
+            self.supervisor.enviar(msg)
+
+    def definir_captura_ativa(self, ativa):
+        self.settings.setValue("captura/ativa", ativa)
+        self.comandar("captura_ativa", ativa=ativa)
+
+    def sincronizar_estacoes(self):
+        self.comandar("sincronizar")
+
+    def revalidar_agora(self, visita_id):
+        self.comandar("revalidar", visita_id=visita_id)
+
+    def renovar_sessao(self):
+        self.sessao.renovar()
+        # No modo separado o filho tem sua própria sessão (perfil do worker)
+        if self.supervisor:
+            self.comandar("renovar_sessao")
+
+    def visitas_importadas(self, aplicadas):
+        """A importação grava por conexão própria: invalida caches e avisa os assinantes"""
+        if not self.db: return
+        self.db.geracao += 1
+        if aplicadas:
+            self.txt_live.append(f"📥 {aplicadas} visitas importadas. Índices de nomes e estatísticas atualizam em segundo plano.")
+            self.eventos.publicar("visitas_importadas", {"aplicadas": aplicadas})
+        self.executar_busca_local()
+
+    def on_evento_janela(self, evento):
+        if evento["tipo"] == "parser_alterado":
+            # Fora da cadeia de assinantes: o alerta não deve segurar quem publicou
+            QTimer.singleShot(0, lambda: self.alertar_parser_alterado(evento["dados"]))
+
+    def alertar_parser_alterado(self, dados):
+        if self.alerta_parser: return
+        self.lbl_status_db.setText("🚨 Captura pausada: layout do portal mudou")
+        self.lbl_status_db.setStyleSheet("color: #ef4444; font-weight: bold; margin-bottom: 5px; font-size: 11px;")
+        caixa = QMessageBox(QMessageBox.Icon.Warning, "Captura pausada",
+                            f"{dados['taxa_falhas']:.0%} das últimas páginas do portal vieram sem os dados esperados "
+                            f"(\"Visitante:\" / \"Horário:\"). O layout provavelmente mudou e a captura foi pausada.\n\n"
+                            f"Amostras das páginas guardadas em:\n{dados['pasta_amostras']}", parent=self)
+        btn_retomar = caixa.addButton("▶️ Retomar captura", QMessageBox.ButtonRole.AcceptRole)
+        caixa.addButton("Manter pausada", QMessageBox.ButtonRole.RejectRole)
+        caixa.setWindowModality(Qt.WindowModality.NonModal)
+        caixa.finished.connect(lambda _: self.fechar_alerta_parser(caixa.clickedButton() is btn_retomar))
+        self.alerta_parser = caixa
+        caixa.show()
+
+    def fechar_alerta_parser(self, retomar):
+        self.alerta_parser = None
+        if retomar:
+            self.comandar("retomar_captura")
+            if self.db:
+                self.lbl_status_db.setText(f"✅ Ativo: {os.path.basename(self.db.db_path)}")
+                self.lbl_status_db.setStyleSheet("color: #10b981; font-weight: bold; margin-bottom: 5px; font-size: 11px;")
+
+    def on_evento_captura(self, evento):
+        """Eventos gravados pelo processo filho: republica aqui e invalida caches de leitura"""
+        if self.db: self.db.geracao += 1
+        self.eventos.publicar(evento["tipo"], evento["dados"])
+
+    def definir_perfilamento(self, ativo):
+        if ativo:
+            self.perfilador.iniciar()
+            self.txt_live.append(f"🩺 Perfilamento ativo. Relatórios em: {self.perfilador.pasta}")
+        elif self.perfilador.ativo:
+            self.perfilador.parar()
+            self.txt_live.append(f"🩺 Perfilamento encerrado. Relatórios em: {self.perfilador.pasta}")
+
+    def closeEvent(self, event):
+        self.perfilador.parar()
+        if self.supervisor:
+            self.supervisor.parar()
+        if self.motor:
+            self.motor.encerrar()
+        super().closeEvent(event)
+
+    def eventFilter(self, obj, event):
+        if event.type() in (QEvent.Type.KeyPress, QEvent.Type.MouseButtonPress, QEvent.Type.Wheel):
+            self.ultima_interacao = time.monotonic()
+        return False
+
+    def manutencao_ociosa(self):
+        """Pede uma tarefa de manutenção vencida se a estação estiver ociosa"""
+        if not self.db: return
+        # Sem interação há 2 minutos; a fila de índices vazia é conferida pelo motor
+        if time.monotonic() - self.ultima_interacao < 120: return
+        self.comandar("manutencao")
+
     # === MÉTODOS DE NAVEGAÇÃO ===
     def navegar_voltar(self):
         view = self.web_stack.currentWidget()
@@ -883,7 +4818,7 @@ class SmartPortariaScanner(QMainWindow):
 
     def add_new_tab(self, qurl, title, closable=True, profile=None):
         view = QWebEngineView()
-        target_profile = profile if profile else QWebEngineProfile.defaultProfile()
+        target_profile = profile if profile else self.perfil_portal
         page = CustomWebPage(target_profile, view, self)
         view.setPage(page)
         
@@ -895,6 +4830,7 @@ class SmartPortariaScanner(QMainWindow):
         tab_idx = self.tabs.addTab(title)
         if not closable: 
             self.tabs.setTabButton(tab_idx, QTabBar.ButtonPosition.RightSide, None)
+        self.gerenciador_abas.registrar(view, fixa=not closable)
             
         if qurl and not qurl.isEmpty(): 
             view.setUrl(qurl)
@@ -937,9 +4873,13 @@ class SmartPortariaScanner(QMainWindow):
 
     def mudar_aba(self, index):
         if index >= 0:
+            anterior = self.web_stack.currentWidget()
+            if anterior:
+                self.gerenciador_abas.marcar_uso(anterior)
             self.web_stack.setCurrentIndex(index)
             view = self.web_stack.currentWidget()
             if view:
+                self.gerenciador_abas.ativar(view)
                 url_str = view.url().toString()
                 self.address_bar.setText("" if url_str == "about:blank" else url_str)
 
@@ -948,6 +4888,7 @@ class SmartPortariaScanner(QMainWindow):
         if "Portaria Virtual" in titulo or "anônima" in titulo.lower(): return
         widget = self.web_stack.widget(index)
         if widget:
+            self.gerenciador_abas.remover(widget)
             self.web_stack.removeWidget(widget)
             widget.deleteLater()
         self.tabs.removeTab(index)
@@ -965,64 +4906,24 @@ class SmartPortariaScanner(QMainWindow):
             url_str = qurl.toString()
             self.address_bar.setText("" if url_str == "about:blank" else url_str)
 
-    def configurar_navegadores(self):
-        s_worker = self.view_worker.settings()
-        s_worker.setAttribute(QWebEngineSettings.WebAttribute.AutoLoadImages, False)
-        s_worker.setAttribute(QWebEngineSettings.WebAttribute.JavascriptEnabled, True)
-
-    def carregar_ultimo_id(self):
-        if not self.db: return
-        maior = self.db.get_maior_id_salvo()
-        if maior > 0: 
-            self.id_atual = maior + 1
-            self.txt_live.append(f"🔄 Retomando captura a partir do ID: {self.id_atual}")
-        else:
-            self.txt_live.append("✨ Banco vazio/novo. Começando do ID 1.")
-            self.id_atual = 1
-
-    def carregar_url_id(self):
-        if not self.rodando or not self.db: return
-        url = f"https://portaria-global.governarti.com.br/visita/{self.id_atual}/detalhes?t={datetime.datetime.now().timestamp()}"
-        self.view_worker.setUrl(QUrl(url))
-
     def injetar_login(self, browser_view):
         if browser_view.page().profile() == self.profile_anonimo: return
         url_atual = browser_view.url().toString()
         if "portaria-global.governarti.com.br/login" in url_atual:
-            js_login = "document.querySelectorAll('input').forEach(i => { if(i.type=='text') i.value='armando.junior'; if(i.type=='password') i.value='armandocampos.1'; });"
-            browser_view.page().runJavaScript(js_login)
+            self.sessao.preencher_login(browser_view)
 
     def on_tab_load_finished(self, ok, view):
         self.injetar_login(view)
 
-    def on_worker_load_finished(self, ok):
-        self.injetar_login(self.view_worker)
-        if self.rodando and self.db: QTimer.singleShot(800, self.extrair_e_validar)
-
-    def extrair_e_validar(self):
-        self.view_worker.page().runJavaScript("document.body.innerText;", self.callback_validacao)
-
-    def callback_validacao(self, conteudo):
-        if not self.rodando or not self.db: return
-        if not conteudo or "entrar" in conteudo.lower()[:300]:
-            self.timer_retry.start(3000)
-            return
-
-        nome_str, cpf_str, horario_str = self.db.extrair_dados(conteudo)
-        dados_encontrados = (nome_str != "Desconhecido" or cpf_str != "N/A") and "não encontrada" not in conteudo.lower()
-
-        if dados_encontrados:
-            self.db.salvar_visita(self.id_atual, nome_str, cpf_str, horario_str, conteudo, self.view_worker.url().toString())
-            self.txt_live.append(f"ID {self.id_atual} registrado: {nome_str}")
-            self.id_atual += 1
-            QTimer.singleShot(500, self.carregar_url_id)
-        else:
-            self.timer_retry.start(10000)
-
     def realizar_busca_local(self):
         if not self.db: return
+        self.pessoas_expandidas.clear()
         self.timer_busca.start(300)
 
+    def alternar_agrupamento(self, agrupar):
+        self.settings.setValue("busca/agrupar", agrupar)
+        self.executar_busca_local()
+
     def executar_busca_local(self):
         if not self.db: return
         termo = self.input_busca.text().strip().lower()
@@ -1030,13 +4931,16 @@ class SmartPortariaScanner(QMainWindow):
             self.txt_res_busca.clear()
             return
         termos = termo.split()
+        if self.chk_agrupar.isChecked():
+            self.executar_busca_pessoas(termos)
+            return
         dados = self.db.buscar_por_filtro(termos)
         html = ""
         hoje = datetime.date.today()
         # Define cor do texto baseada no tema
-        text_color = "#e2e8f0" if self.settings.value("theme") == "dark" else "#1e293b"
-        card_bg = "#1e293b" if self.settings.value("theme") == "dark" else "#ffffff"
-        border_color = "#475569" if self.settings.value("theme") == "dark" else "#cbd5e1"
+        text_color = self.cores_tema["texto"]
+        card_bg = self.cores_tema["cartao"]
+        border_color = self.cores_tema["borda"]
         
         for vid, nome, cpf, horario in dados:
             cor_validade = "green"
@@ -1061,8 +4965,48 @@ class SmartPortariaScanner(QMainWindow):
             """
         self.txt_res_busca.setHtml(html)
 
+    def executar_busca_pessoas(self, termos):
+        hoje = datetime.date.today().isoformat()
+        text_color = self.cores_tema["texto"]
+        card_bg = self.cores_tema["cartao"]
+        border_color = self.cores_tema["borda"]
+
+        html = ""
+        for chave, nome, cpf, total, primeira_data, validade_fim, horario_atual in self.db.buscar_visitantes(termos):
+            cor_validade = "green" if validade_fim and validade_fim >= hoje else "red"
+            desde = "/".join(reversed(primeira_data.split("-"))) if primeira_data else "-"
+            expandida = chave in self.pessoas_expandidas
+            historico = ""
+            if expandida:
+                for vid, _, _, horario in self.db.historico_visitante(chave):
+                    historico += f"<a href='{vid}' style='text-decoration: none; color: #2563eb;'>ID {vid}</a> <span style='color: #64748b;'>{horario}</span><br>"
+            html += f"""
+            <div style='background-color: {card_bg}; border: 1px solid {border_color}; border-bottom: 3px solid {border_color}; border-radius: 8px; padding: 12px; margin-bottom: 8px;'>
+                <div style='color: {text_color}; font-size: 14px;'>
+                    <a href="pessoa:{urllib.parse.quote(chave)}" style="text-decoration: none;"><b style='color: #2563eb;'>{'▾' if expandida else '▸'} {nome}</b></a><br>
+                    <span style='color: #64748b; font-size: 12px;'>CPF / ID: {cpf} · {total} visita(s) desde {desde}</span><br>
+                    <span style='color: #64748b; font-size: 12px;'><b>Validade atual:</b> <span style='color: {cor_validade}; font-weight: bold;'>{horario_atual}</span></span>
+                    {f"<div style='font-size: 12px; margin-top: 6px;'>{historico}</div>" if expandida else ""}
+                </div>
+            </div>
+            """
+        rolagem = self.txt_res_busca.verticalScrollBar().value()
+        self.txt_res_busca.setHtml(html)
+        self.txt_res_busca.verticalScrollBar().setValue(rolagem)
+
     def abrir_link_resultado(self, url_qurl):
         visita_id = url_qurl.toString()
+        if visita_id.startswith("pessoa:"):
+            chave = urllib.parse.unquote(visita_id[len("pessoa:"):])
+            self.pessoas_expandidas ^= {chave}
+            self.executar_busca_local()
+            return
+        if self.db and visita_id.isdigit() and self.db.obter_visita(int(visita_id)):
+            DetalhesVisitaDialog(self, int(visita_id)).show()
+            return
+        self.abrir_visita_no_portal(visita_id)
+
+    def abrir_visita_no_portal(self, visita_id):
         link_final = f"https://portaria-global.governarti.com.br/visita/{visita_id}/detalhes"
         for i in range(self.tabs.count()):
             if "Portaria Virtual" in self.tabs.tabText(i):
@@ -1137,7 +5081,98 @@ class SmartPortariaScanner(QMainWindow):
         dlg = CameraDialog(self, camera_device=camera_selecionada)
         dlg.exec()
 
+def testar_amostras_parser(pasta):
+    """
+    Modo --testar-parser <pasta>: roda o extrator atual sobre as amostras
+    guardadas pelo MonitorParser. Retorna 0 se todas passarem.
+    """
+    monitor = MonitorParser()
+    arquivos = sorted(a for a in os.listdir(pasta) if a.endswith(".txt") and a != "resumo.txt")
+    falhas = 0
+    for nome_arq in arquivos:
+        with open(os.path.join(pasta, nome_arq), encoding="utf-8") as f:
+            conteudo = f.read()
+        nome, cpf, horario = DatabaseHandler.extrair_dados(conteudo)
+        situacao, motivo = monitor.classificar(conteudo, nome, cpf, horario)
+        if situacao == "anomala": falhas += 1
+        print(f"{nome_arq}: {situacao} | {nome} | {cpf} | {horario}" + (f" ({motivo})" if motivo else ""))
+    print(f"{len(arquivos) - falhas} de {len(arquivos)} amostras extraídas corretamente.")
+    return 1 if falhas else 0
+
+def executar_processo_captura(db_path):
+    """
+    Ponto de entrada do processo filho (--processo-captura <banco>): sem janela,
+    só o MotorCaptura com o banco aberto para escrita. É o filho que cria e migra
+    o esquema; a janela espera o "pronto" para abrir sua conexão de leitura. Lê comandos JSON do stdin
+    e escreve log, eventos e batimentos no stdout. O fim do stdin (supervisor
+    fechado ou morto) encerra o processo.
+    """
+    app = QApplication(sys.argv)
+    app.setQuitOnLastWindowClosed(False)
+    settings = QSettings("PortariaApps", "MonitorVisitas")
+    trava_saida = threading.Lock()
+
+    def emitir(msg):
+        linha = json.dumps(msg, ensure_ascii=False, default=str) + "\n"
+        # Eventos podem ser publicados de outras threads
+        with trava_saida:
+            sys.stdout.write(linha)
+            sys.stdout.flush()
+
+    motor = MotorCaptura(settings)
+    motor.log.connect(lambda texto: emitir({"tipo": "log", "texto": texto}))
+    motor.usar_sessao(GerenciadorSessao(motor, [motor.perfil_worker]))
+
+    db = DatabaseHandler(db_path)
+    db.eventos.assinar(lambda evento: emitir({"tipo": "evento", "evento": evento}))
+
+    comandos = queue.Queue()
+    def ler_comandos():
+        for linha in sys.stdin:
+            comandos.put(linha)
+        comandos.put(None)
+    threading.Thread(target=ler_comandos, name="comandos", daemon=True).start()
+
+    def processar_comandos():
+        while True:
+            try:
+                linha = comandos.get_nowait()
+            except queue.Empty:
+                return
+            if linha is None:
+                app.quit()
+                return
+            try:
+                msg = json.loads(linha)
+            except ValueError:
+                continue
+            if msg.get("comando") == "parar":
+                app.quit()
+                return
+            try:
+                motor.executar_comando(msg)
+            except Exception as e:
+                motor.registrar(f"❌ Erro ao executar '{msg.get('comando')}': {e}")
+
+    timer_comandos = QTimer()
+    timer_comandos.timeout.connect(processar_comandos)
+    timer_comandos.start(100)
+    # O batimento sai do loop de eventos: se ele travar, o supervisor percebe
+    timer_batimento = QTimer()
+    timer_batimento.timeout.connect(lambda: emitir({"tipo": "batimento"}))
+    timer_batimento.start(5000)
+
+    emitir({"tipo": "pronto", "pid": os.getpid()})
+    motor.conectar(db)
+    codigo = app.exec()
+    motor.encerrar()
+    sys.exit(codigo)
+
 if __name__ == "__main__":
+    if "--processo-captura" in sys.argv:
+        executar_processo_captura(sys.argv[sys.argv.index("--processo-captura") + 1])
+    if "--testar-parser" in sys.argv:
+        sys.exit(testar_amostras_parser(sys.argv[sys.argv.index("--testar-parser") + 1]))
     app = QApplication(sys.argv)
     win = SmartPortariaScanner()
     win.show()